@@ -0,0 +1,206 @@
+import hashlib
+import os
+from glob import glob
+import fire
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+from smartbib.utils import atomic_path, iter_parquet_batches
+
+# Schema of the author dimension: one row per author, with the most common
+# spelling of their name
+AUTHORS_SCHEMA = pa.schema([
+    ('id_author', pa.int64()),
+    ('name', pa.dictionary(pa.int32(), pa.string())),
+    ('n_papers', pa.int32()),
+])
+# Schema of the authorship table: one row per (paper, author)
+AUTHORSHIP_SCHEMA = pa.schema([
+    ('id_paper', pa.binary()),
+    ('id_author', pa.int64()),
+    ('position', pa.int16()),
+])
+# ID of the authors without an S2 ID nor a usable name
+UNKNOWN_AUTHOR_ID = -1
+
+# Maximum number of distinct (author, name) pairs kept before they are
+# aggregated again
+_MAX_PENDING_NAMES = 10_000_000
+
+
+def normalize_names(names) -> pa.Array:
+    """Normalize author names (NFKC, lowercase, single spaces).
+
+    Args:
+        names: Arrow array of strings.
+
+    Returns:
+        pa.Array: The normalized names.
+    """
+    names = pc.utf8_lower(pc.utf8_normalize(names, 'NFKC'))
+    names = pc.replace_substring_regex(names, r'[^\pL\pN]+', ' ')
+    return pc.utf8_trim_whitespace(names)
+
+
+def _name_surrogate(name):
+    """Surrogate ID of a normalized name, in [-2**63, -2]."""
+    digest = hashlib.blake2b(name.encode(), digest_size=8).digest()
+    return -1 - max(int.from_bytes(digest, 'little') >> 1, 1)
+
+
+def surrogate_author_ids(names) -> np.ndarray:
+    """Deterministic IDs for authors without an S2 ID.
+
+    The ID is derived from the normalized name (see `normalize_names`), so
+    the same author gets the same ID in every file and release. Surrogate IDs
+    are negative, so they never collide with S2 IDs. Null names and names
+    that are empty once normalized get `UNKNOWN_AUTHOR_ID`, which no
+    surrogate ID takes.
+
+    Args:
+        names: Arrow array of strings.
+
+    Returns:
+        np.ndarray: Surrogate ID (int64) of each name.
+    """
+    encoded = pc.dictionary_encode(normalize_names(names))
+    dictionary = encoded.dictionary.to_pylist()
+    surrogates = np.array([
+        _name_surrogate(name) if name else UNKNOWN_AUTHOR_ID
+        for name in dictionary
+    ] + [UNKNOWN_AUTHOR_ID], dtype=np.int64)
+    # Null names point to the last surrogate
+    return surrogates[encoded.indices.fill_null(len(dictionary)).to_numpy()]
+
+
+def author_ids(ids, names) -> pa.Array:
+    """Fill the missing author IDs with surrogate IDs.
+
+    Args:
+        ids: Arrow array with the S2 ID of each author (null if unknown).
+        names: Arrow array with the name of each author.
+
+    Returns:
+        pa.Array: The ID (int64) of each author.
+    """
+    ids = pc.cast(ids, pa.int64())
+    missing = pc.is_null(ids)
+    if not pc.any(missing).as_py():
+        return ids
+    values = ids.fill_null(0).to_numpy(zero_copy_only=False).copy()
+    values[missing.to_numpy(zero_copy_only=False)] = surrogate_author_ids(
+        names.filter(missing)
+    )
+    return pa.array(values, pa.int64())
+
+
+def _authorship_batch(batch):
+    """Flatten the `authors` column of a batch of papers."""
+    authors = batch.column('authors')
+    lengths = pc.list_value_length(authors).fill_null(0).to_numpy()
+    authors_flat = pc.list_flatten(authors)
+    first = np.cumsum(lengths) - lengths
+    return pa.table([
+        batch.column('id_').take(np.repeat(np.arange(len(lengths)), lengths)),
+        authors_flat.field('id_author').cast(pa.int64()),
+        pa.array(
+            np.arange(lengths.sum()) - np.repeat(first, lengths), pa.int16()
+        ),
+    ], schema=AUTHORSHIP_SCHEMA), authors_flat.field('name')
+
+
+def _count_names(tables):
+    """Count the papers of each (author, name) pair."""
+    return pa.concat_tables(tables).group_by(
+        ['id_author', 'name']
+    ).aggregate([('n_papers', 'sum')]).rename_columns(
+        ['id_author', 'name', 'n_papers']
+    )
+
+
+def build_author_tables(
+    input_path_pattern: str,
+    output_folder: str,
+    batch_size: int = 1_000_000,
+):
+    """Split the authors of the papers into normalized tables.
+
+    Two parquet files are written to `output_folder` (and skipped if they
+    match `input_path_pattern`):
+
+    - `authors.parquet` (`AUTHORS_SCHEMA`): one row per author, with its most
+      common name (dictionary encoded) and number of papers.
+    - `authorship.parquet` (`AUTHORSHIP_SCHEMA`): one row per author of each
+      paper, with the position of the author in the list of authors.
+
+    The files are streamed in batches. Only the distinct (author, name) pairs
+    are kept in memory.
+
+    Args:
+        input_path_pattern: Glob-like pattern for the parquet files.
+        output_folder: Folder where the tables are stored.
+        batch_size: Number of papers read at a time.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    path_authorship = os.path.join(output_folder, 'authorship.parquet')
+    path_authors = os.path.join(output_folder, 'authors.parquet')
+    outputs = {os.path.abspath(path_authorship), os.path.abspath(path_authors)}
+    file_list = sorted(
+        path for path in glob(input_path_pattern)
+        if os.path.abspath(path) not in outputs
+    )
+    names, n_pending = [], 0
+    n_authorships = 0
+    with atomic_path(path_authorship) as path_tmp:
+        with pq.ParquetWriter(path_tmp, AUTHORSHIP_SCHEMA) as writer:
+            for batch in iter_parquet_batches(
+                file_list, ['id_', 'authors'], batch_size
+            ):
+                authorship, batch_names = _authorship_batch(batch)
+                writer.write_table(authorship)
+                n_authorships += authorship.num_rows
+                names.append(pa.table(dict(
+                    id_author=authorship.column('id_author'),
+                    name=batch_names,
+                    n_papers=pa.array(
+                        np.ones(authorship.num_rows, dtype=np.int32)
+                    ),
+                )))
+                n_pending += authorship.num_rows
+                if n_pending > _MAX_PENDING_NAMES:
+                    names = [_count_names(names)]
+                    n_pending = names[0].num_rows
+    names = _count_names(names) if names else pa.table(dict(
+        id_author=pa.array([], pa.int64()),
+        name=pa.array([], pa.string()),
+        n_papers=pa.array([], pa.int64()),
+    ))
+    # The most common name of each author (ties broken by the name)
+    names = names.sort_by([
+        ('id_author', 'ascending'), ('n_papers', 'descending'),
+        ('name', 'ascending'),
+    ])
+    id_author = names.column('id_author').to_numpy()
+    first = np.ones(len(id_author), dtype=bool)
+    first[1:] = id_author[1:] != id_author[:-1]
+    n_papers = np.add.reduceat(
+        names.column('n_papers').to_numpy(), np.flatnonzero(first)
+    ) if len(id_author) else np.empty(0, dtype=np.int64)
+    authors = names.filter(pa.array(first))
+    authors = pa.table([
+        authors.column('id_author'),
+        pc.dictionary_encode(authors.column('name')),
+        pa.array(n_papers.astype(np.int32)),
+    ], schema=AUTHORS_SCHEMA)
+    with atomic_path(path_authors) as path_tmp:
+        pq.write_table(authors, path_tmp)
+    logger.debug(
+        f"{authors.num_rows} authors and {n_authorships} authorships stored "
+        f"in '{output_folder}'"
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(build_author_tables)
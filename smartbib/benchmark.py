@@ -0,0 +1,423 @@
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from glob import glob
+from typing import Iterable, Optional
+import fire
+import numpy as np
+import pyarrow as pa
+from loguru import logger
+from smartbib.utils import ids_str_to_bytes_array
+
+# Benchmarks run by default, in order
+BENCHMARKS = (
+    'parse', 'parse_arrow', 'ids', 'parquet_write', 'db_load', 'gzip_to_db'
+)
+
+_FIELDS_OF_STUDY = (
+    'Computer Science', 'Mathematics', 'Medicine', 'Biology', 'Physics',
+    'Chemistry', 'Economics', 'Psychology', 'Engineering', 'Sociology',
+)
+_VENUES = ('NeurIPS', 'ICML', 'Nature', 'Science', 'PLoS ONE', 'arXiv', '')
+# Vocabulary of the titles and abstracts
+_WORDS = tuple(f'word{i}' for i in range(5_000))
+
+
+def _paper_id(seed, i):
+    return hashlib.sha1(f'{seed}-{i}'.encode()).hexdigest()
+
+
+def _synthetic_record(
+    rng, seed, i, n_papers, fan_out, n_authors, abstract_length
+):
+    """Random paper in the format of the S2 corpus."""
+    paper_id = _paper_id(seed, i)
+    # Citations and authors of a paper are distinct, as in the corpus
+    citers = np.unique(rng.integers(0, n_papers, rng.poisson(fan_out)))
+    authors = [
+        dict(
+            name=f'Author {author}',
+            # Some authors have no S2 ID
+            ids=[str(author)] if author % 10 else []
+        )
+        for author in np.unique(rng.integers(
+            0, max(n_papers // 2, 1), 1 + rng.poisson(max(n_authors - 1, 0))
+        ))
+    ]
+    words = rng.integers(0, len(_WORDS), 8 + abstract_length)
+    return dict(
+        id=paper_id,
+        title=' '.join(_WORDS[word] for word in words[:8]),
+        paperAbstract=' '.join(_WORDS[word] for word in words[8:]),
+        authors=authors,
+        inCitations=[_paper_id(seed, citer) for citer in citers],
+        outCitations=[],
+        year=int(rng.integers(1980, 2021)) if rng.random() > 0.05 else None,
+        s2Url=f'https://semanticscholar.org/paper/{paper_id}',
+        sources=['DBLP'],
+        pdfUrls=[f'https://example.org/{paper_id}.pdf'],
+        venue=_VENUES[rng.integers(len(_VENUES))],
+        journalName=_VENUES[rng.integers(len(_VENUES))],
+        journalVolume=str(rng.integers(1, 100)),
+        journalPages='1-10',
+        doi='',
+        doiUrl='',
+        pmid='',
+        fieldsOfStudy=[
+            _FIELDS_OF_STUDY[field]
+            for field in rng.choice(
+                len(_FIELDS_OF_STUDY), rng.integers(0, 3), replace=False
+            )
+        ],
+        magId='',
+        s2PdfUrl='',
+        entities=[],
+    )
+
+
+def generate_corpus(
+    output_folder: str,
+    n_papers: int = 10_000,
+    n_files: int = 1,
+    fan_out: float = 10.,
+    n_authors: float = 3.,
+    abstract_length: int = 150,
+    seed: int = 0,
+) -> list:
+    """Generate synthetic gzip files in the format of the S2 corpus.
+
+    Papers are cited by `fan_out` papers and written by `n_authors` authors
+    on average (Poisson distributed), drawn uniformly from the corpus and
+    from a pool of `n_papers / 2` authors. The same arguments always generate
+    the same files.
+
+    Args:
+        output_folder: Folder where the files (`s2-corpus-<i>.gz`) are
+            stored.
+        n_papers: Total number of papers.
+        n_files: Number of files the papers are split into.
+        fan_out: Average number of citations of a paper.
+        n_authors: Average number of authors of a paper.
+        abstract_length: Number of words of each abstract.
+        seed: Seed of the random number generator.
+
+    Returns:
+        list: Paths to the generated files.
+    """
+    assert n_files > 0, "At least one file must be generated"
+    os.makedirs(output_folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    bounds = np.linspace(0, n_papers, n_files + 1).astype(int)
+    file_list = []
+    for i_file, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        path_file = os.path.join(output_folder, f's2-corpus-{i_file:03d}.gz')
+        with gzip.open(path_file, 'wt', compresslevel=6) as file:
+            for i in range(start, stop):
+                record = _synthetic_record(
+                    rng, seed, i, n_papers, fan_out, n_authors,
+                    abstract_length
+                )
+                file.write(json.dumps(record) + '\n')
+        file_list.append(path_file)
+    logger.debug(f"{n_papers} papers generated in '{output_folder}'")
+    return file_list
+
+
+def _bench_parse(file_list, work_folder):
+    """Parse the gzip files with pandas (`_read_json_gzip`)."""
+    from smartbib.parquetizer import _read_json_gzip
+
+    def run():
+        return sum(len(_read_json_gzip(path)) for path in file_list)
+    return run
+
+
+def _bench_parse_arrow(file_list, work_folder):
+    """Parse the gzip files with the arrow engine."""
+    from smartbib.parquetizer import _iter_json_gzip_arrow
+
+    def run():
+        return sum(
+            table.num_rows
+            for path in file_list for table in _iter_json_gzip_arrow(path)
+        )
+    return run
+
+
+def _bench_ids(file_list, work_folder):
+    """Convert the hex IDs of the papers and citations into bytes."""
+    from smartbib.parquetizer import _read_json_arrow
+    ids = []
+    for path in file_list:
+        with gzip.open(path, 'rb') as file:
+            table = _read_json_arrow(file)
+        ids += [
+            table.column('id').combine_chunks(),
+            table.column('inCitations').combine_chunks().flatten(),
+        ]
+    ids = pa.concat_arrays(ids)
+
+    def run():
+        return len(ids_str_to_bytes_array(ids))
+    return run
+
+
+def _bench_parquet_write(file_list, work_folder):
+    """Write parsed papers into parquet files (`store_parquet_batches`)."""
+    from smartbib.parquetizer import (
+        _iter_json_gzip_arrow, store_parquet_batches
+    )
+    tables = [list(_iter_json_gzip_arrow(path)) for path in file_list]
+
+    def run():
+        return sum(
+            store_parquet_batches(batches, path, work_folder)
+            for path, batches in zip(file_list, tables)
+        )
+    return run
+
+
+def _bench_db_load(file_list, work_folder):
+    """Load parsed papers into a SQLite database (`write_s2_data_to_db`)."""
+    from smartbib.mysql_writer import _sqlite_engine, write_s2_data_to_db
+    from smartbib.parquetizer import _read_json_gzip
+    dfs = [_read_json_gzip(path) for path in file_list]
+    path_db = os.path.join(work_folder, 'papers.db')
+    if os.path.exists(path_db):
+        os.remove(path_db)
+
+    def run():
+        engine = _sqlite_engine(path_db)
+        for df in dfs:
+            write_s2_data_to_db(df, engine)
+        engine.dispose()
+        return sum(len(df) for df in dfs)
+    return run
+
+
+def _bench_gzip_to_db(file_list, work_folder):
+    """Stream the gzip files into a SQLite database, parsing included."""
+    from smartbib.mysql_writer import (
+        _iter_s2_gzip, _sqlite_engine, write_s2_data_to_db
+    )
+    path_db = os.path.join(work_folder, 'papers-stream.db')
+    if os.path.exists(path_db):
+        os.remove(path_db)
+
+    def run():
+        engine = _sqlite_engine(path_db)
+        n_records = 0
+        for df in _iter_s2_gzip(file_list, 100_000):
+            write_s2_data_to_db(df, engine)
+            n_records += len(df)
+        engine.dispose()
+        return n_records
+    return run
+
+
+_BENCHMARKS = dict(
+    parse=_bench_parse,
+    parse_arrow=_bench_parse_arrow,
+    ids=_bench_ids,
+    parquet_write=_bench_parquet_write,
+    db_load=_bench_db_load,
+    gzip_to_db=_bench_gzip_to_db,
+)
+
+
+def _peak_rss_mb():
+    """Peak resident set size of the current process, in MB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return peak_rss / 2 ** (20 if sys.platform == 'darwin' else 10)
+
+
+def _run_benchmark(name, file_list, work_folder):
+    """Set up and time a benchmark (called in a fresh process)."""
+    run = _BENCHMARKS[name](file_list, work_folder)
+    start = time.perf_counter()
+    n_records = run()
+    seconds = time.perf_counter() - start
+    return dict(
+        n_records=n_records, seconds=seconds, peak_rss_mb=_peak_rss_mb()
+    )
+
+
+def _git_commit():
+    """Commit checked out in the repository of the package, if any."""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=folder, capture_output=True,
+            text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=folder, capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def run_benchmarks(
+    input_path_pattern: Optional[str] = None,
+    path_results: str = 'benchmarks.jsonl',
+    benchmarks: Iterable[str] = BENCHMARKS,
+    repeat: int = 3,
+    n_papers: int = 10_000,
+    n_files: int = 1,
+    fan_out: float = 10.,
+    n_authors: float = 3.,
+    abstract_length: int = 150,
+    seed: int = 0,
+) -> dict:
+    """Benchmark the stages of the ingestion pipeline.
+
+    Each run of a benchmark happens in a fresh process, so that its peak
+    resident set size (which includes the setup, e.g., parsing the files
+    loaded into the database) is not affected by the other benchmarks. The
+    fastest of the `repeat` runs is reported.
+
+    The results are appended, as a JSON line with the current git commit, to
+    `path_results`, so that they can be compared across commits with
+    `compare_results`.
+
+    Args:
+        input_path_pattern (optional): Glob-like pattern for S2 gzip files.
+            If not set, a synthetic corpus is generated (see
+            `generate_corpus`) with the arguments below.
+        path_results: Path to the JSON lines file storing the results.
+        benchmarks: Names of the benchmarks to run (see `BENCHMARKS`).
+        repeat: Number of runs of each benchmark.
+        n_papers: Number of papers of the synthetic corpus.
+        n_files: Number of files of the synthetic corpus.
+        fan_out: Average number of citations of the synthetic papers.
+        n_authors: Average number of authors of the synthetic papers.
+        abstract_length: Number of words of the synthetic abstracts.
+        seed: Seed of the synthetic corpus.
+
+    Returns:
+        dict: The stored results.
+    """
+    if isinstance(benchmarks, str):
+        benchmarks = benchmarks.split(',')
+    for name in benchmarks:
+        assert name in _BENCHMARKS, f"Unknown benchmark '{name}'"
+    assert repeat > 0, "Each benchmark must run at least once"
+    corpus = dict(
+        n_papers=n_papers, n_files=n_files, fan_out=fan_out,
+        n_authors=n_authors, abstract_length=abstract_length, seed=seed
+    )
+    results = {}
+    with tempfile.TemporaryDirectory() as work_folder:
+        if input_path_pattern is None:
+            file_list = generate_corpus(
+                os.path.join(work_folder, 'corpus'), **corpus
+            )
+        else:
+            file_list = sorted(glob(input_path_pattern))
+            corpus = dict(input_path_pattern=input_path_pattern)
+        corpus['n_bytes'] = sum(os.path.getsize(path) for path in file_list)
+        context = multiprocessing.get_context('spawn')
+        for name in benchmarks:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    runs.append(executor.submit(
+                        _run_benchmark, name, file_list, work_folder
+                    ).result())
+            seconds = min(run['seconds'] for run in runs)
+            results[name] = dict(
+                n_records=runs[0]['n_records'],
+                seconds=seconds,
+                records_per_s=runs[0]['n_records'] / seconds,
+                peak_rss_mb=max(run['peak_rss_mb'] or 0 for run in runs),
+            )
+            logger.info(
+                f"{name}: {results[name]['records_per_s']:,.0f} records/s, "
+                f"{results[name]['peak_rss_mb']:,.0f} MB"
+            )
+    commit, dirty = _git_commit()
+    entry = dict(
+        commit=commit,
+        dirty=dirty,
+        timestamp=datetime.now(timezone.utc).isoformat(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        corpus=corpus,
+        results=results,
+    )
+    with open(path_results, 'a') as file:
+        file.write(json.dumps(entry) + '\n')
+    logger.debug(f"Results stored in '{path_results}'")
+    return entry
+
+
+def compare_results(
+    path_results: str = 'benchmarks.jsonl',
+    baseline: int = -2,
+    candidate: int = -1,
+    tolerance: float = 0.1,
+) -> dict:
+    """Compare two runs stored by `run_benchmarks`.
+
+    Args:
+        path_results: Path to the JSON lines file storing the results.
+        baseline: Position of the baseline run in the file (e.g., -2 for the
+            second to last run).
+        candidate: Position of the run compared to the baseline.
+        tolerance: Relative drop in throughput (or rise in peak memory)
+            reported as a regression.
+
+    Returns:
+        dict: For each benchmark run in both, the ratios of the throughput
+            and peak memory of the candidate to the ones of the baseline.
+    """
+    with open(path_results, 'r') as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    baseline, candidate = entries[baseline], entries[candidate]
+    if baseline['corpus'] != candidate['corpus']:
+        logger.warning("The runs used different corpora")
+    ratios = {}
+    for name, result in candidate['results'].items():
+        if name not in baseline['results']:
+            continue
+        reference = baseline['results'][name]
+        ratios[name] = dict(
+            records_per_s=result['records_per_s'] / reference['records_per_s'],
+            peak_rss_mb=result['peak_rss_mb'] / reference['peak_rss_mb']
+            if reference['peak_rss_mb'] else None,
+        )
+        if ratios[name]['records_per_s'] < 1 - tolerance:
+            logger.warning(
+                f"{name}: throughput dropped to "
+                f"{ratios[name]['records_per_s']:.0%} of "
+                f"{str(baseline['commit'])[:8]}"
+            )
+        if (ratios[name]['peak_rss_mb'] or 0) > 1 + tolerance:
+            logger.warning(
+                f"{name}: peak memory rose to "
+                f"{ratios[name]['peak_rss_mb']:.0%} of "
+                f"{str(baseline['commit'])[:8]}"
+            )
+    return ratios
+
+
+if __name__ == "__main__":
+    fire.Fire(dict(
+        generate=generate_corpus, run=run_benchmarks, compare=compare_results
+    ))
@@ -0,0 +1,275 @@
+import os
+import tempfile
+from glob import glob
+from typing import Optional
+import fire
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from smartbib.metrics import span
+from smartbib.utils import (
+    atomic_path, id_prefixes, ids_bytes_to_numpy, iter_parquet_batches,
+    search_ids
+)
+
+# Layout of the edge lists written by `clean_citations`
+CITATIONS_SCHEMA = pa.schema([
+    ('id_cited', pa.binary()),
+    ('id_citer', pa.binary()),
+])
+
+# Each edge is a fixed-width record with the 20 bytes of the cited paper
+# followed by the 20 bytes of the citer, so sorting the records sorts the
+# edges by cited paper (and then by citer)
+_RECORD_SIZE = 40
+_RECORD_DTYPE = np.dtype(f'S{_RECORD_SIZE}')
+
+
+def _edge_records(batch, ids, prefixes):
+    """Records of the edges of a batch whose endpoints are both in `ids`.
+
+    Returns:
+        Tuple[np.ndarray, int]: The records and the number of edges dropped.
+    """
+    in_citations = batch.column('inCitations')
+    citers = ids_bytes_to_numpy(in_citations.flatten())
+    edges = np.empty((len(citers), 2), dtype='S20')
+    edges[:, 0] = np.repeat(
+        ids_bytes_to_numpy(batch.column('id_')),
+        np.diff(in_citations.offsets.to_numpy())
+    )
+    edges[:, 1] = citers
+    found = (
+        (search_ids(ids, edges[:, 0], prefixes) >= 0)
+        & (search_ids(ids, edges[:, 1], prefixes) >= 0)
+    )
+    records = edges.view(_RECORD_DTYPE).ravel()
+    return records[found], int((~found).sum())
+
+
+def _sort_unique(records):
+    """Sort records, dropping the duplicated ones."""
+    records = np.sort(records)
+    if len(records):
+        keep = np.empty(len(records), dtype=bool)
+        keep[0] = True
+        np.not_equal(records[1:], records[:-1], out=keep[1:])
+        records = records[keep]
+    return records
+
+
+def _spill_runs(batches, ids, run_size, path_tmp):
+    """Write the edges of the batches into sorted runs of `run_size` edges.
+
+    Returns:
+        Tuple[List[str], int]: The paths to the runs and the number of edges
+            dropped for having an endpoint not in `ids`.
+    """
+    prefixes = id_prefixes(ids)
+    path_runs, pending, n_pending, n_dropped = [], [], 0, 0
+
+    def spill():
+        with span('citations.sort', rows=n_pending):
+            records = _sort_unique(np.concatenate(pending))
+        path_run = os.path.join(path_tmp, f'run-{len(path_runs)}.bin')
+        records.tofile(path_run)
+        path_runs.append(path_run)
+        logger.debug(f"Run of {len(records)} edges spilled to '{path_run}'")
+
+    for batch in batches:
+        with span('citations.read', rows=batch.num_rows):
+            records, n_batch_dropped = _edge_records(batch, ids, prefixes)
+        n_dropped += n_batch_dropped
+        while len(records):
+            size = min(run_size - n_pending, len(records))
+            pending.append(records[:size])
+            n_pending += size
+            records = records[size:]
+            if n_pending == run_size:
+                spill()
+                pending, n_pending = [], 0
+    if n_pending:
+        spill()
+    return path_runs, n_dropped
+
+
+def _merge_runs(path_runs, block_size):
+    """Merge sorted runs, dropping the records repeated across runs.
+
+    Each run is read in blocks of `block_size` records. The records up to
+    the smallest last record of the blocks are sorted and yielded, since
+    no record still on disk can come before them.
+
+    Yields:
+        np.ndarray: Sorted chunk of distinct records.
+    """
+    runs = [
+        np.memmap(path_run, dtype=_RECORD_DTYPE, mode='r')
+        for path_run in path_runs
+    ]
+    positions = [min(block_size, len(run)) for run in runs]
+    blocks = [
+        np.array(run[:position]) for run, position in zip(runs, positions)
+    ]
+    last = None
+    while any(len(block) for block in blocks):
+        # Runs with records still on disk bound the records that can be
+        # merged
+        bounds = [
+            block[-1] for block, run, position in zip(blocks, runs, positions)
+            if position < len(run)
+        ]
+        bound = min(bounds) if bounds else None
+        merged = []
+        for i, block in enumerate(blocks):
+            split = (
+                len(block) if bound is None
+                else np.searchsorted(block, bound, side='right')
+            )
+            merged.append(block[:split])
+            blocks[i] = block[split:]
+            if not len(blocks[i]) and positions[i] < len(runs[i]):
+                end = positions[i] + block_size
+                blocks[i] = np.array(runs[i][positions[i]:end])
+                positions[i] = min(end, len(runs[i]))
+        with span('citations.merge') as current:
+            records = _sort_unique(np.concatenate(merged))
+            if last is not None and len(records) and records[0] == last:
+                records = records[1:]
+            current.rows = len(records)
+        if len(records):
+            last = records[-1]
+            yield records
+
+
+def _partitions(records, n_partitions):
+    """Partition of each record, given by the first bytes of the cited ID.
+
+    Partitions split the range of the IDs, so sorted records have sorted
+    partitions.
+    """
+    id_bytes = records.view(np.uint8).reshape(-1, _RECORD_SIZE)
+    prefixes = (id_bytes[:, 0].astype(np.int64) << 8) | id_bytes[:, 1]
+    return (prefixes * n_partitions) >> 16
+
+
+def _records_to_table(records):
+    id_bytes = records.view(np.uint8).reshape(-1, _RECORD_SIZE)
+    columns = [
+        pa.FixedSizeBinaryArray.from_buffers(
+            pa.binary(20), len(records),
+            [None, pa.py_buffer(np.ascontiguousarray(id_bytes[:, part]))]
+        ).cast(pa.binary())
+        for part in (slice(0, 20), slice(20, 40))
+    ]
+    return pa.table(columns, schema=CITATIONS_SCHEMA)
+
+
+def _write_partitions(chunks, output_folder, n_partitions):
+    """Write sorted chunks of records into one parquet file per partition.
+
+    Returns:
+        int: Number of edges written.
+    """
+    chunks = iter(chunks)
+    pending = np.empty(0, dtype=_RECORD_DTYPE)
+    n_edges = 0
+    for partition in range(n_partitions):
+        path_partition = os.path.join(
+            output_folder, f'citations-{partition:03d}.parquet'
+        )
+        with atomic_path(path_partition) as path_tmp, pq.ParquetWriter(
+            path_tmp, CITATIONS_SCHEMA
+        ) as writer:
+            while True:
+                if not len(pending):
+                    pending = next(chunks, None)
+                    if pending is None:
+                        pending = np.empty(0, dtype=_RECORD_DTYPE)
+                        break
+                split = np.searchsorted(
+                    _partitions(pending, n_partitions), partition,
+                    side='right'
+                )
+                if split:
+                    with span('citations.write', rows=split):
+                        writer.write_table(_records_to_table(pending[:split]))
+                    n_edges += split
+                pending = pending[split:]
+                if len(pending):
+                    break
+    return n_edges
+
+
+def clean_citations(
+    input_path_pattern: str,
+    output_folder: str,
+    memory_budget_mb: float = 512,
+    n_partitions: int = 16,
+    batch_size: int = 100_000,
+    spill_folder: Optional[str] = None,
+) -> int:
+    """Write the distinct citations between papers of the parquet files.
+
+    The `inCitations` of the papers are turned into (cited, citer) edges,
+    stored as fixed-width records of 40 bytes. Edges whose cited paper or
+    citer is not in the files are dropped. The other edges are sorted
+    out-of-core: runs filling the memory budget are sorted, deduplicated and
+    spilled to disk, and then merged.
+
+    The edges are written sorted into `n_partitions` parquet files
+    (`citations-000.parquet`, ...) with the columns `id_cited` and
+    `id_citer` (see `CITATIONS_SCHEMA`). Files are partitioned by ranges of
+    `id_cited`, so all the citers of a paper are in the same file.
+
+    Args:
+        input_path_pattern: Glob-like pattern for the parquet files.
+        output_folder: Folder where the edge lists are stored.
+        memory_budget_mb: Approximate memory, in MB, used to sort the edges.
+            The IDs of the papers (20 bytes each) are kept in memory on top
+            of it.
+        n_partitions: Number of files of the edge lists (at most 65536).
+        batch_size: Number of papers read at a time from each file.
+        spill_folder (optional): Folder where the sorted runs are stored.
+            By default, the system temporary folder.
+
+    Returns:
+        int: Number of edges written.
+    """
+    assert 0 < n_partitions <= 1 << 16, 'n_partitions must be in [1, 65536]'
+    file_list = sorted(glob(input_path_pattern))
+    logger.debug(f"Cleaning the citations of {len(file_list)} files")
+    ids = np.unique(np.concatenate([
+        ids_bytes_to_numpy(batch.column('id_')).copy()
+        for batch in iter_parquet_batches(file_list, ['id_'], batch_size)
+    ] or [np.empty(0, dtype='S20')]))
+    # Sorting a run needs a copy of it
+    run_size = max(int(memory_budget_mb * 2 ** 20) // (2 * _RECORD_SIZE), 1)
+    os.makedirs(output_folder, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=spill_folder) as path_tmp:
+        path_runs, n_dropped = _spill_runs(
+            iter_parquet_batches(
+                file_list, ['id_', 'inCitations'], batch_size
+            ),
+            ids, run_size, path_tmp
+        )
+        logger.debug(
+            f"{n_dropped} citations with unknown papers dropped. "
+            f"Merging {len(path_runs)} runs"
+        )
+        # The blocks read from the runs fill half of the budget, leaving
+        # room to sort the merged records
+        block_size = max(run_size // (2 * max(len(path_runs), 1)), 1)
+        n_edges = _write_partitions(
+            _merge_runs(path_runs, block_size), output_folder, n_partitions
+        )
+    logger.debug(
+        f"{n_edges} citations stored in {n_partitions} files in "
+        f"'{output_folder}'"
+    )
+    return n_edges
+
+
+if __name__ == "__main__":
+    fire.Fire(clean_citations)
@@ -0,0 +1,308 @@
+import inspect
+import os
+import shutil
+import tempfile
+from glob import glob
+from typing import List, Optional
+from urllib.parse import quote
+import fire
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+from tqdm.auto import tqdm
+from smartbib.utils import atomic_path
+
+# Partition keys of the dataset, in the order of the directories
+PARTITION_COLUMNS = ('year_bucket', 'field_of_study')
+# Directory name used by Hive for null partition values
+_HIVE_NULL = '__HIVE_DEFAULT_PARTITION__'
+# Summary files written to the root of the dataset
+_SUMMARY_FILES = ('_common_metadata', '_metadata')
+# Options of the parquet writer, which depend on the version of pyarrow
+# (e.g., bloom filters are only written by recent versions)
+_WRITER_OPTIONS = set(inspect.signature(pq.ParquetWriter).parameters)
+
+
+def _partition_keys(batch, year_bucket_size):
+    """Year bucket and primary field of study of each paper.
+
+    The year bucket is the first year of the bucket (-1 when the year is
+    unknown) and the primary field of study the first one in the list (null
+    when there is none).
+    """
+    years = batch.column('year').fill_null(-1).to_numpy()
+    year_bucket = np.where(
+        years >= 0, years // year_bucket_size * year_bucket_size, -1
+    )
+    fields = batch.column('fieldsOfStudy')
+    lengths = pc.list_value_length(fields).fill_null(0).to_numpy()
+    offsets = pc.subtract(fields.offsets, fields.offsets[0]).to_numpy()
+    field_of_study = pc.list_flatten(fields).take(
+        pa.array(offsets[:-1], mask=lengths == 0)
+    )
+    return year_bucket, field_of_study
+
+
+def _partition_path(year_bucket, field_of_study):
+    """Hive-style relative path of a partition."""
+    values = (
+        str(year_bucket),
+        _HIVE_NULL if field_of_study is None
+        else quote(field_of_study, safe='')
+    )
+    return os.path.join(*[
+        f'{name}={value}' for name, value in zip(PARTITION_COLUMNS, values)
+    ])
+
+
+def _spill_partitions(
+    path_parquet, path_tmp, shard, year_bucket_size, batch_size
+):
+    """Split the papers of a parquet file into partition fragments.
+
+    Each partition receives (at most) one fragment per input file, stored as
+    `<path_tmp>/<partition>/fragment-<shard>.parquet`.
+    """
+    writers = {}
+    try:
+        parquet_file = pq.ParquetFile(path_parquet)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            table = pa.Table.from_batches([batch])
+            year_bucket, field_of_study = _partition_keys(
+                batch, year_bucket_size
+            )
+            # Group the rows of the batch by partition
+            fields = pc.dictionary_encode(field_of_study)
+            # Papers without field of study get the code 0
+            field_codes = fields.indices.fill_null(-1).to_numpy() + 1
+            keys = (
+                year_bucket.astype(np.int64) * (len(fields.dictionary) + 1)
+                + field_codes
+            )
+            groups = np.unique(keys, return_inverse=True)[1].ravel()
+            order = np.argsort(groups, kind='stable')
+            bounds = np.cumsum(np.bincount(groups))
+            for start, end in zip(np.r_[0, bounds[:-1]], bounds):
+                rows = order[start:end]
+                year = int(year_bucket[rows[0]])
+                field = field_of_study[int(rows[0])].as_py()
+                partition = _partition_path(year, field)
+                if partition not in writers:
+                    folder = os.path.join(path_tmp, partition)
+                    os.makedirs(folder, exist_ok=True)
+                    path_fragment = os.path.join(
+                        folder, f'fragment-{shard:05d}.parquet'
+                    )
+                    writers[partition] = pq.ParquetWriter(
+                        path_fragment, table.schema
+                    )
+                writers[partition].write_table(table.take(pa.array(rows)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
+def _group_fragments(fragments, max_rows_per_file):
+    """Split fragments in groups with at most `max_rows_per_file` rows.
+
+    Fragments larger than `max_rows_per_file` make up a group on their own.
+    """
+    groups, group, n_rows = [], [], 0
+    for path in fragments:
+        rows = pq.ParquetFile(path).metadata.num_rows
+        if group and n_rows + rows > max_rows_per_file:
+            groups.append(group)
+            group, n_rows = [], 0
+        group.append(path)
+        n_rows += rows
+    if group:
+        groups.append(group)
+    return groups
+
+
+def _write_sorted(
+    table, path, row_group_size, compression, compression_level,
+    metadata_collector
+):
+    """Write a table sorted by `id_`.
+
+    The page index, sorting columns and bloom filter of `id_` are written
+    when the version of pyarrow supports them.
+    """
+    table = table.sort_by('id_')
+    options = {}
+    if 'write_page_index' in _WRITER_OPTIONS:
+        options['write_page_index'] = True
+    if 'sorting_columns' in _WRITER_OPTIONS:
+        options['sorting_columns'] = pq.SortingColumn.from_ordering(
+            table.schema, [('id_', 'ascending')]
+        )
+    if 'bloom_filter_options' in _WRITER_OPTIONS:
+        options['bloom_filter_options'] = {
+            'id_': dict(ndv=max(table.num_rows, 1), fpp=0.01)
+        }
+    with atomic_path(path) as path_tmp:
+        pq.write_table(
+            table, path_tmp,
+            row_group_size=row_group_size,
+            compression=compression,
+            compression_level=compression_level,
+            metadata_collector=metadata_collector,
+            **options
+        )
+
+
+def _check_output_folder(output_folder, overwrite=False):
+    """Refuse to replace a folder that does not hold a previous dataset."""
+    if overwrite or not os.path.isdir(output_folder):
+        return
+    content = os.listdir(output_folder)
+    if content and not any(name in content for name in _SUMMARY_FILES):
+        raise FileExistsError(
+            f"'{output_folder}' is not empty and does not hold a dataset. "
+            "Use `overwrite=True` to replace it"
+        )
+
+
+def _write_partitioned_dataset(
+    file_list: List[str],
+    output_folder: str,
+    year_bucket_size: int = 10,
+    max_rows_per_file: int = 5_000_000,
+    row_group_size: int = 100_000,
+    compression: str = 'zstd',
+    compression_level: Optional[int] = None,
+    batch_size: int = 1_000_000,
+    spill_folder: Optional[str] = None,
+    overwrite: bool = False,
+):
+    """Write parquet files as a partitioned dataset.
+
+    See `write_partitioned_dataset`.
+    """
+    _check_output_folder(output_folder, overwrite)
+    schema = None
+    metadata = []
+    # The dataset is built next to the output folder, which is only replaced
+    # once the dataset is complete
+    output_folder = os.path.abspath(output_folder)
+    path_dataset = tempfile.mkdtemp(
+        prefix=f'.{os.path.basename(output_folder)}.',
+        dir=os.path.dirname(output_folder)
+    )
+    try:
+        with tempfile.TemporaryDirectory(dir=spill_folder) as path_tmp:
+            for shard, path_parquet in enumerate(tqdm(file_list)):
+                _spill_partitions(
+                    path_parquet, path_tmp, shard, year_bucket_size,
+                    batch_size
+                )
+            partitions = sorted({
+                os.path.relpath(os.path.dirname(path), path_tmp)
+                for path in glob(
+                    os.path.join(path_tmp, '*', '*', '*.parquet')
+                )
+            })
+            for partition in tqdm(partitions):
+                groups = _group_fragments(
+                    sorted(glob(
+                        os.path.join(path_tmp, partition, '*.parquet')
+                    )),
+                    max_rows_per_file
+                )
+                os.makedirs(os.path.join(path_dataset, partition))
+                for i, group in enumerate(groups):
+                    table = pa.concat_tables([
+                        pq.read_table(path) for path in group
+                    ])
+                    schema = schema or table.schema
+                    path_relative = os.path.join(
+                        partition, f'part-{i:05d}.parquet'
+                    )
+                    collector = []
+                    _write_sorted(
+                        table, os.path.join(path_dataset, path_relative),
+                        row_group_size, compression, compression_level,
+                        collector
+                    )
+                    collector[0].set_file_path(path_relative)
+                    metadata += collector
+        if schema is None:
+            logger.warning("No papers found. The dataset was not written")
+            return
+        # Summary files, so readers can plan the scan without opening every
+        # file
+        pq.write_metadata(
+            schema, os.path.join(path_dataset, '_common_metadata')
+        )
+        pq.write_metadata(
+            schema, os.path.join(path_dataset, '_metadata'),
+            metadata_collector=metadata
+        )
+        shutil.rmtree(output_folder, ignore_errors=True)
+        os.replace(path_dataset, output_folder)
+    finally:
+        shutil.rmtree(path_dataset, ignore_errors=True)
+    logger.debug(
+        f"Dataset with {len(metadata)} files written to '{output_folder}'"
+    )
+
+
+def write_partitioned_dataset(
+    input_path_pattern: str,
+    output_folder: str,
+    year_bucket_size: int = 10,
+    max_rows_per_file: int = 5_000_000,
+    row_group_size: int = 100_000,
+    compression: str = 'zstd',
+    compression_level: Optional[int] = None,
+    batch_size: int = 1_000_000,
+    spill_folder: Optional[str] = None,
+    overwrite: bool = False,
+):
+    """Rewrite parquet files as a Hive-partitioned dataset.
+
+    Papers are partitioned by year bucket and primary field of study (e.g.,
+    `year_bucket=2010/field_of_study=Computer%20Science/part-00000.parquet`),
+    so that filters on these columns skip whole directories. Within each
+    file, papers are sorted by `id_`, which is described by the statistics,
+    page index and bloom filter of the row groups. A `_metadata` file with
+    the footers of all the files is written to the root of the dataset.
+
+    The dataset can be read with, e.g.,
+    `pyarrow.dataset.dataset(output_folder, partitioning='hive')` or
+    `dask.dataframe.read_parquet(output_folder)`.
+
+    Papers are first split into partitions, one input file at a time, and
+    then each partition is sorted, `max_rows_per_file` papers at a time, so
+    the memory used does not depend on the size of the corpus.
+
+    Args:
+        input_path_pattern: Glob-like pattern for the parquet files.
+        output_folder: Folder of the dataset. A previous dataset in the
+            folder is replaced, but other non-empty folders are refused.
+        year_bucket_size: Number of years in each year bucket.
+        max_rows_per_file: Maximum number of papers per file (files holding
+            a single large fragment may exceed it).
+        row_group_size: Maximum number of papers per row group.
+        compression: Compression codec of the files.
+        compression_level (optional): Compression level of the codec.
+        batch_size: Number of papers read at a time from the input files.
+        spill_folder (optional): Folder where the partitions are stored
+            before being sorted. By default, the system temporary folder.
+        overwrite: Whether to replace the content of `output_folder` even
+            if it does not hold a dataset.
+    """
+    file_list = sorted(glob(input_path_pattern))
+    logger.debug(f"Partitioning {len(file_list)} files")
+    _write_partitioned_dataset(
+        file_list, output_folder, year_bucket_size, max_rows_per_file,
+        row_group_size, compression, compression_level, batch_size,
+        spill_folder, overwrite
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(write_partitioned_dataset)
@@ -0,0 +1,336 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from multiprocessing import cpu_count
+from typing import List, Optional
+import fire
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+from tqdm.auto import tqdm
+from smartbib.utils import (
+    atomic_path, hash_tokens, ids_bytes_to_numpy, tokenize
+)
+
+# Number of distinct hashes of the tokens
+_N_HASHES = 1 << 31
+# Signature value of the papers without enough tokens
+_EMPTY = np.iinfo(np.uint32).max
+# Minimum number of distinct tokens of the papers compared. Generic titles
+# without authors ("Editorial", "Erratum", ...) would otherwise all be
+# duplicates
+_MIN_TOKENS = 3
+# Records spilled to disk for each (paper, band): the band, its hash and the
+# paper, encoded as `shard << 32 | row`
+_BUCKET_DTYPE = np.dtype([
+    ('band', np.uint16), ('key', np.uint64), ('doc', np.int64)
+])
+# Schema of the duplicates file
+DUPLICATES_SCHEMA = pa.schema([
+    ('id_', pa.binary()),
+    ('id_canonical', pa.binary()),
+])
+
+
+def _paper_texts(batch):
+    """Join the title and the author names of each paper."""
+    authors = batch.column('authors')
+    lengths = pc.list_value_length(authors).fill_null(0).to_numpy()
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    names = pa.ListArray.from_arrays(
+        pa.array(offsets), pc.list_flatten(authors).field('name')
+    )
+    return pc.binary_join_element_wise(
+        batch.column('title'), pc.binary_join(names, ' '), ' ',
+        null_handling='replace'
+    )
+
+
+def minhash(
+    texts, n_perm: int = 64, seed: int = 0, min_tokens: int = 1
+) -> np.ndarray:
+    """Compute the MinHash signatures of the token sets of texts.
+
+    The tokens (see `tokenize`) are hashed once and each of the `n_perm`
+    multiply-shift hash functions `(a * x + b) >> 32` is applied to all the
+    tokens at once, reducing the minimum over the tokens of each text with
+    `np.minimum.reduceat`.
+
+    Args:
+        texts: Arrow array of strings.
+        n_perm: Number of hash functions.
+        seed: Seed used to draw the hash functions.
+        min_tokens: Minimum number of distinct tokens of the texts hashed.
+
+    Returns:
+        np.ndarray: Signatures (uint32) with shape `(len(texts), n_perm)`.
+            Texts with less than `min_tokens` distinct tokens have all the
+            values set to `_EMPTY`.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, n_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, n_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), n_perm), _EMPTY, dtype=np.uint32)
+    owners, tokens = tokenize(texts)
+    if not len(tokens):
+        return signatures
+    # Distinct (text, token hash) pairs, sorted by text
+    keys = np.sort(owners * _N_HASHES + hash_tokens(tokens, _N_HASHES))
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+    owners, hashes = keys // _N_HASHES, (keys % _N_HASHES).astype(np.uint64)
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    kept = np.diff(np.r_[starts, len(owners)]) >= min_tokens
+    for j in range(n_perm):
+        # Overflows wrap around, as in a multiplicative hash
+        values = (hashes * a[j] + b[j]) >> np.uint64(32)
+        signatures[owners[starts[kept]], j] = np.minimum.reduceat(
+            values, starts
+        )[kept]
+    return signatures
+
+
+def _band_keys(signatures, n_bands, seed=0):
+    """Hash each band of rows of the signatures into a 64-bits key."""
+    n_rows = signatures.shape[1] // n_bands
+    multipliers = np.random.default_rng(seed).integers(
+        1, np.iinfo(np.int64).max, n_rows, dtype=np.uint64
+    ) | np.uint64(1)
+    bands = signatures[:, :n_bands * n_rows].reshape(-1, n_bands, n_rows)
+    # Overflows wrap around, as in a multiplicative hash
+    return (bands.astype(np.uint64) * multipliers).sum(axis=2)
+
+
+def _signature_shard(
+    path_parquet, shard, path_tmp, n_perm, n_bands, n_partitions, seed,
+    batch_size
+):
+    """Compute the signatures of a parquet file and spill its LSH buckets.
+
+    The signatures and IDs of the papers are stored as `.npy` files, and the
+    bucket records are split into `n_partitions` files by their key.
+    """
+    parquet_file = pq.ParquetFile(path_parquet)
+    ids, signatures, records = [], [], []
+    n_docs = 0
+    for batch in parquet_file.iter_batches(
+        batch_size=batch_size, columns=['id_', 'title', 'authors']
+    ):
+        batch_signatures = minhash(
+            _paper_texts(batch), n_perm, seed, _MIN_TOKENS
+        )
+        rows = np.flatnonzero((batch_signatures != _EMPTY).any(axis=1))
+        keys = _band_keys(batch_signatures[rows], n_bands, seed)
+        batch_records = np.empty(keys.shape, dtype=_BUCKET_DTYPE)
+        batch_records['band'] = np.arange(n_bands)
+        batch_records['key'] = keys
+        batch_records['doc'] = ((shard << 32) | (rows + n_docs))[:, None]
+        ids.append(ids_bytes_to_numpy(batch.column('id_')).copy())
+        signatures.append(batch_signatures)
+        records.append(batch_records.ravel())
+        n_docs += batch.num_rows
+    np.save(
+        os.path.join(path_tmp, f'ids-{shard}.npy'),
+        np.concatenate(ids or [np.empty(0, dtype='S20')])
+    )
+    np.save(
+        os.path.join(path_tmp, f'signatures-{shard}.npy'),
+        np.concatenate(
+            signatures or [np.empty((0, n_perm), dtype=np.uint32)]
+        )
+    )
+    records = np.concatenate(records or [np.empty(0, dtype=_BUCKET_DTYPE)])
+    partition = records['key'] % np.uint64(n_partitions)
+    for i in range(n_partitions):
+        np.save(
+            os.path.join(path_tmp, f'buckets-{i}-{shard}.npy'),
+            records[partition == i]
+        )
+    return n_docs
+
+
+def _gather(arrays, docs):
+    """Gather the rows `docs` (encoded as `shard << 32 | row`) of arrays."""
+    shards, rows = docs >> 32, docs & 0xffffffff
+    if not len(docs):
+        return arrays[0][:0] if arrays else np.empty(0)
+    values = np.empty((len(docs), *arrays[0].shape[1:]), arrays[0].dtype)
+    for shard in np.unique(shards):
+        mask = shards == shard
+        values[mask] = arrays[shard][rows[mask]]
+    return values
+
+
+def _candidate_pairs(records):
+    """Pair the first paper of each LSH bucket with the other ones."""
+    if not len(records):
+        return np.empty((0, 2), dtype=np.int64)
+    records = records[np.lexsort(
+        (records['doc'], records['key'], records['band'])
+    )]
+    band, key = records['band'], records['key']
+    starts = np.r_[True, (band[1:] != band[:-1]) | (key[1:] != key[:-1])]
+    first = records['doc'][np.flatnonzero(starts)[np.cumsum(starts) - 1]]
+    pairs = np.stack([first, records['doc']], axis=1)[~starts]
+    return np.unique(pairs, axis=0)
+
+
+def _connected_components(edges, n_nodes):
+    """Label each node with the smallest node of its component."""
+    labels = np.arange(n_nodes)
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, edges[:, 0], labels[edges[:, 1]])
+        np.minimum.at(new_labels, edges[:, 1], labels[edges[:, 0]])
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def _find_duplicates(
+    file_list: List[str],
+    path_output: str,
+    threshold: float = 0.8,
+    n_perm: int = 64,
+    n_bands: int = 16,
+    n_partitions: int = 16,
+    n_jobs: int = 1,
+    batch_size: int = 100_000,
+    spill_folder: Optional[str] = None,
+    seed: int = 0,
+) -> int:
+    """Find near-duplicate papers in a list of parquet files.
+
+    See `find_duplicates`.
+    """
+    assert n_perm % n_bands == 0, 'n_perm must be a multiple of n_bands'
+    n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+    with tempfile.TemporaryDirectory(dir=spill_folder) as path_tmp:
+        args = [
+            (
+                path, i, path_tmp, n_perm, n_bands, n_partitions, seed,
+                batch_size
+            )
+            for i, path in enumerate(file_list)
+        ]
+        if n_jobs > 1 and args:
+            with ProcessPoolExecutor(n_jobs) as executor:
+                list(tqdm(
+                    executor.map(_signature_shard, *zip(*args)),
+                    total=len(args)
+                ))
+        else:
+            for shard_args in tqdm(args):
+                _signature_shard(*shard_args)
+        ids, signatures = [[
+            np.load(os.path.join(path_tmp, f'{name}-{i}.npy'), mmap_mode='r')
+            for i in range(len(file_list))
+        ] for name in ('ids', 'signatures')]
+        # Verify the candidates of each partition of the buckets, comparing
+        # their signatures
+        pairs = []
+        for i in tqdm(range(n_partitions)):
+            candidates = _candidate_pairs(np.concatenate([
+                np.load(os.path.join(path_tmp, f'buckets-{i}-{shard}.npy'))
+                for shard in range(len(file_list))
+            ] or [np.empty(0, dtype=_BUCKET_DTYPE)]))
+            similarity = (
+                _gather(signatures, candidates[:, 0])
+                == _gather(signatures, candidates[:, 1])
+            ).mean(axis=1)
+            pairs.append(candidates[similarity >= threshold])
+        pairs = np.concatenate(pairs or [np.empty((0, 2), dtype=np.int64)])
+        # Group the duplicates, sorting the papers by ID so that the
+        # canonical paper of each group is the one with the smallest ID
+        docs, edges = np.unique(pairs, return_inverse=True)
+        node_ids = _gather(ids, docs)
+        order = np.argsort(node_ids, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        labels = _connected_components(
+            rank[edges.reshape(-1, 2)], len(docs)
+        )
+        node_ids = node_ids[order]
+        duplicated = labels != np.arange(len(docs))
+    # NumPy strips the trailing null bytes of the IDs
+    to_binary = [
+        id_.ljust(20, b'\0') for id_ in node_ids[duplicated].tolist()
+    ]
+    canonical = [
+        id_.ljust(20, b'\0')
+        for id_ in node_ids[labels[duplicated]].tolist()
+    ]
+    table = pa.table(
+        [pa.array(to_binary, pa.binary()), pa.array(canonical, pa.binary())],
+        schema=DUPLICATES_SCHEMA
+    )
+    with atomic_path(path_output) as path_tmp:
+        pq.write_table(table, path_tmp)
+    logger.debug(
+        f"{table.num_rows} duplicates found in {len(file_list)} files. "
+        f"Stored in '{path_output}'"
+    )
+    return table.num_rows
+
+
+def find_duplicates(
+    input_path_pattern: str,
+    path_output: str,
+    threshold: float = 0.8,
+    n_perm: int = 64,
+    n_bands: int = 16,
+    n_partitions: int = 16,
+    n_jobs: int = 1,
+    batch_size: int = 100_000,
+    spill_folder: Optional[str] = None,
+    seed: int = 0,
+) -> int:
+    """Find near-duplicate papers in parquet files.
+
+    Papers are represented by the set of tokens of their title and author
+    names. Papers with less than `_MIN_TOKENS` distinct tokens, such as
+    generic titles without authors, are skipped. Their MinHash signatures
+    are split into `n_bands` bands, hashed into LSH buckets, and papers
+    sharing a bucket are compared using their signatures. The buckets are
+    spilled to disk in `n_partitions` partitions processed one at a time, so
+    the memory used is bounded by the size of a partition (and not by the
+    size of the corpus).
+
+    Each group of duplicates is mapped to its paper with the smallest ID,
+    and stored in a parquet file with the columns `id_` (duplicate) and
+    `id_canonical` (see `DUPLICATES_SCHEMA`).
+
+    Args:
+        input_path_pattern: Glob-like pattern for the parquet files.
+        path_output: Path to the duplicates parquet file.
+        threshold: Minimum estimated Jaccard similarity of duplicates.
+        n_perm: Number of hash functions of the signatures.
+        n_bands: Number of LSH bands. Pairs with similarity `s` are
+            compared with probability `1 - (1 - s ** r) ** n_bands`, where
+            `r = n_perm / n_bands`.
+        n_partitions: Number of partitions of the buckets.
+        n_jobs: Number of files processed in parallel. Use -1 to use all the
+            CPUs.
+        batch_size: Number of papers read at a time from each file.
+        spill_folder (optional): Folder where the signatures and buckets are
+            stored during the search. By default, the system temporary
+            folder.
+        seed: Seed used to draw the hash functions.
+
+    Returns:
+        int: Number of duplicates found.
+    """
+    file_list = sorted(glob(input_path_pattern))
+    logger.debug(f"Looking for duplicates in {len(file_list)} files")
+    return _find_duplicates(
+        file_list, path_output, threshold, n_perm, n_bands, n_partitions,
+        n_jobs, batch_size, spill_folder, seed
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(find_duplicates)
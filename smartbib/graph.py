@@ -0,0 +1,211 @@
+import os
+import tempfile
+from glob import glob
+from typing import List, Optional
+import numpy as np
+from loguru import logger
+from smartbib.utils import (
+    ids_bytes_to_numpy, iter_parquet_batches, search_ids
+)
+
+# Arrays stored by `CitationGraph.save`
+_GRAPH_ARRAYS = (
+    'ids', 'in_indptr', 'in_indices', 'out_indptr', 'out_indices'
+)
+
+
+def _build_csr(edge_chunks, n_nodes, source, target):
+    """Build a CSR adjacency structure from chunks of edges.
+
+    Uses a counting sort, so only the output arrays and one chunk are kept in
+    memory at a time (chunks can be memory-mapped).
+
+    Args:
+        edge_chunks: List of (n, 2) arrays of node indices.
+        n_nodes: Number of nodes in the graph.
+        source: Column of the chunks used as the source of the edges.
+        target: Column of the chunks used as the target of the edges.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The indptr (int64) and indices (int32)
+            arrays.
+    """
+    counts = np.zeros(n_nodes, dtype=np.int64)
+    for edges in edge_chunks:
+        counts += np.bincount(edges[:, source], minlength=n_nodes)
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    position = indptr[:-1].copy()
+    for edges in edge_chunks:
+        order = np.argsort(edges[:, source], kind='stable')
+        sources = edges[order, source]
+        nodes, starts, node_counts = np.unique(
+            sources, return_index=True, return_counts=True
+        )
+        rank = np.arange(len(sources)) - np.repeat(starts, node_counts)
+        indices[position[sources] + rank] = edges[order, target]
+        position[nodes] += node_counts
+    return indptr, indices
+
+
+class CitationGraph:
+    """Citation graph of the corpus stored as CSR arrays.
+
+    Papers are mapped to dense node indices, given by the position of their
+    20-bytes ID (`id_` in `PARQUET_SCHEMA`) in the sorted array `ids`. The
+    edges are stored in both directions: `in_*` arrays hold the papers
+    citing each node (from `inCitations`) and `out_*` arrays the papers
+    cited by each node.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        in_indptr: np.ndarray,
+        in_indices: np.ndarray,
+        out_indptr: np.ndarray,
+        out_indices: np.ndarray,
+    ) -> None:
+        """Create a graph from its arrays.
+
+        Args:
+            ids: Sorted array (dtype `S20`) with the ID of each node.
+            in_indptr: Offsets of the citers of each node in `in_indices`.
+            in_indices: Node indices of the citers.
+            out_indptr: Offsets of the references of each node in
+                `out_indices`.
+            out_indices: Node indices of the references.
+        """
+        self.ids = ids
+        self.in_indptr = in_indptr
+        self.in_indices = in_indices
+        self.out_indptr = out_indptr
+        self.out_indices = out_indices
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.in_indices)
+
+    @classmethod
+    def from_parquet(
+        cls, path_pattern: str, spill_folder: Optional[str] = None
+    ) -> 'CitationGraph':
+        """Build the graph streaming over parquet files.
+
+        The files are read twice: first to collect the IDs of the papers and
+        then to map the `inCitations` column into edges. Citers not in the
+        files are ignored.
+
+        Args:
+            path_pattern: Glob-like pattern for the parquet files.
+            spill_folder (optional): Folder where the edges are stored while
+                building the graph. If set, the edges are memory-mapped
+                instead of kept in memory.
+
+        Returns:
+            CitationGraph: The citation graph.
+        """
+        file_list = sorted(glob(path_pattern))
+        logger.debug(f"Building citation graph from {len(file_list)} files")
+        ids = np.unique(np.concatenate([
+            ids_bytes_to_numpy(batch.column('id_')).copy()
+            for batch in iter_parquet_batches(file_list, ['id_'])
+        ] or [np.empty(0, dtype='S20')]))
+        n_nodes = len(ids)
+        n_dropped = 0
+        edge_chunks = []
+        with tempfile.TemporaryDirectory(dir=spill_folder) as path_tmp:
+            batches = iter_parquet_batches(file_list, ['id_', 'inCitations'])
+            for i, batch in enumerate(batches):
+                in_citations = batch.column('inCitations')
+                cited = np.repeat(
+                    search_ids(ids, ids_bytes_to_numpy(batch.column('id_'))),
+                    np.diff(in_citations.offsets.to_numpy())
+                )
+                citers = search_ids(
+                    ids, ids_bytes_to_numpy(in_citations.flatten())
+                )
+                found = citers >= 0
+                n_dropped += int((~found).sum())
+                edges = np.stack(
+                    [cited[found], citers[found]], axis=1
+                ).astype(np.int32)
+                if spill_folder is not None:
+                    path_edges = os.path.join(path_tmp, f'edges-{i}.npy')
+                    np.save(path_edges, edges)
+                    edges = np.load(path_edges, mmap_mode='r')
+                edge_chunks.append(edges)
+            logger.debug(f"{n_dropped} citations from unknown papers ignored")
+            in_indptr, in_indices = _build_csr(edge_chunks, n_nodes, 0, 1)
+            out_indptr, out_indices = _build_csr(edge_chunks, n_nodes, 1, 0)
+            del edge_chunks
+        logger.debug(
+            f"Citation graph with {n_nodes} nodes and {len(in_indices)} edges"
+        )
+        return cls(ids, in_indptr, in_indices, out_indptr, out_indices)
+
+    def node_index(self, ids) -> np.ndarray:
+        """Map 20-bytes IDs into node indices.
+
+        Args:
+            ids: Array (or sequence) of IDs represented as bytes.
+
+        Returns:
+            np.ndarray: Node index of each ID, or -1 for IDs not in the graph.
+        """
+        return search_ids(self.ids, ids_bytes_to_numpy(ids))
+
+    def node_ids(self, nodes) -> List[bytes]:
+        """Map node indices into 20-bytes IDs."""
+        # NumPy strips the trailing null bytes of the IDs
+        return [id_.ljust(20, b'\0') for id_ in self.ids[nodes].tolist()]
+
+    def citers(self, node: int) -> np.ndarray:
+        """Node indices of the papers citing `node`."""
+        return self.in_indices[self.in_indptr[node]:self.in_indptr[node + 1]]
+
+    def references(self, node: int) -> np.ndarray:
+        """Node indices of the papers cited by `node`."""
+        return self.out_indices[
+            self.out_indptr[node]:self.out_indptr[node + 1]
+        ]
+
+    def in_degree(self, nodes=None) -> np.ndarray:
+        """Number of citations received by each node (or by `nodes`)."""
+        degree = np.diff(self.in_indptr)
+        return degree if nodes is None else degree[nodes]
+
+    def out_degree(self, nodes=None) -> np.ndarray:
+        """Number of references of each node (or of `nodes`)."""
+        degree = np.diff(self.out_indptr)
+        return degree if nodes is None else degree[nodes]
+
+    def save(self, folder: str):
+        """Store the arrays of the graph as `.npy` files in `folder`."""
+        os.makedirs(folder, exist_ok=True)
+        for name in _GRAPH_ARRAYS:
+            np.save(os.path.join(folder, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(
+        cls, folder: str, mmap_mode: Optional[str] = 'r'
+    ) -> 'CitationGraph':
+        """Load a graph stored by `save`.
+
+        Args:
+            folder: Folder containing the `.npy` files.
+            mmap_mode (optional): Mode used to memory-map the arrays (see
+                `np.load`). Use None to load them in memory.
+
+        Returns:
+            CitationGraph: The citation graph.
+        """
+        return cls(*[
+            np.load(os.path.join(folder, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in _GRAPH_ARRAYS
+        ])
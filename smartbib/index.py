@@ -0,0 +1,186 @@
+import json
+import os
+from glob import glob
+from typing import List, Optional
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from tqdm.auto import tqdm
+from smartbib.utils import id_prefixes, ids_bytes_to_numpy, search_ids
+
+# Arrays stored by `PaperIndex.save`
+_INDEX_ARRAYS = ('ids', 'shard', 'row_group', 'row', 'prefixes')
+# File listing the parquet files referenced by the index
+_INDEX_FILES = 'files.json'
+
+
+class PaperIndex:
+    """Sorted index of the papers stored in parquet files.
+
+    The 20-bytes IDs (`id_` in `PARQUET_SCHEMA`) are kept in a sorted array,
+    next to the location of each paper: the parquet file (shard), the row
+    group and the row within the row group. Lookups are binary searches
+    (`np.searchsorted`), vectorized over batches of IDs, and the arrays can
+    be memory-mapped, so the index does not have to fit in memory.
+    """
+
+    def __init__(
+        self,
+        files: List[str],
+        ids: np.ndarray,
+        shard: np.ndarray,
+        row_group: np.ndarray,
+        row: np.ndarray,
+        prefixes: Optional[np.ndarray] = None,
+    ) -> None:
+        """Create an index from its arrays.
+
+        Args:
+            files: Path to each parquet file (shard).
+            ids: Sorted array (dtype `S20`) of IDs.
+            shard: Position in `files` of the file containing each paper.
+            row_group: Row group containing each paper.
+            row: Row of each paper within its row group.
+            prefixes (optional): Output of `id_prefixes(ids)`, used to speed
+                up the searches. Computed if not given.
+        """
+        self.files = files
+        self.ids = ids
+        self.shard = shard
+        self.row_group = row_group
+        self.row = row
+        self.prefixes = id_prefixes(ids) if prefixes is None else prefixes
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_parquet(cls, path_pattern: str) -> 'PaperIndex':
+        """Build the index from parquet files.
+
+        Only the `id_` column of the files is read.
+
+        Args:
+            path_pattern: Glob-like pattern for the parquet files.
+
+        Returns:
+            PaperIndex: The index.
+        """
+        files = sorted(os.path.abspath(path) for path in glob(path_pattern))
+        ids, shard, row_group, row = [], [], [], []
+        for i, path_parquet in enumerate(tqdm(files)):
+            parquet_file = pq.ParquetFile(path_parquet)
+            for j in range(parquet_file.num_row_groups):
+                table = parquet_file.read_row_group(j, columns=['id_'])
+                ids.append(ids_bytes_to_numpy(
+                    table.column('id_').combine_chunks()
+                ).copy())
+                shard.append(np.full(table.num_rows, i, dtype=np.int32))
+                row_group.append(np.full(table.num_rows, j, dtype=np.int32))
+                row.append(np.arange(table.num_rows, dtype=np.int32))
+        if not ids:
+            return cls(files, *[
+                np.empty(0, dtype=dtype)
+                for dtype in ('S20', np.int32, np.int32, np.int32)
+            ])
+        ids = np.concatenate(ids)
+        order = np.argsort(ids, kind='stable')
+        logger.debug(f"Index built with {len(ids)} papers")
+        return cls(
+            files, ids[order], np.concatenate(shard)[order],
+            np.concatenate(row_group)[order], np.concatenate(row)[order]
+        )
+
+    def lookup(self, ids):
+        """Locate a batch of papers.
+
+        Args:
+            ids: Array (or sequence) of IDs represented as bytes.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The shard, row group
+                and row of each paper, or -1 for IDs not in the index.
+        """
+        positions = search_ids(
+            self.ids, ids_bytes_to_numpy(ids), self.prefixes
+        )
+        found = positions >= 0
+        positions = positions[found]
+        locators = []
+        for array in (self.shard, self.row_group, self.row):
+            locator = np.full(len(found), -1, dtype=np.int64)
+            locator[found] = array[positions]
+            locators.append(locator)
+        return tuple(locators)
+
+    def read(self, ids, columns: Optional[List[str]] = None) -> pa.Table:
+        """Read the papers with the given IDs from the parquet files.
+
+        Only the row groups containing the papers are read.
+
+        Args:
+            ids: Array (or sequence) of IDs represented as bytes.
+            columns (optional): Columns to read. By default, all of them.
+
+        Returns:
+            pa.Table: The papers found, in the same order as `ids`. IDs not
+                in the index are skipped.
+        """
+        shard, row_group, row = self.lookup(ids)
+        found = np.flatnonzero(shard >= 0)
+        # Read each row group once, sorting the papers by their location
+        order = found[np.lexsort((row[found], row_group[found], shard[found]))]
+        groups = np.stack([shard[order], row_group[order]], axis=1)
+        tables = []
+        if len(order):
+            starts = np.flatnonzero(
+                np.r_[True, (groups[1:] != groups[:-1]).any(axis=1)]
+            )
+            ends = np.r_[starts[1:], len(order)]
+            parquet_files = {}
+            for start, end in zip(starts, ends):
+                i, j = groups[start]
+                if i not in parquet_files:
+                    parquet_files[i] = pq.ParquetFile(self.files[i])
+                table = parquet_files[i].read_row_group(j, columns=columns)
+                tables.append(table.take(row[order[start:end]]))
+        if not tables:
+            schema = pq.read_schema(self.files[0]) if self.files else None
+            if schema is None:
+                return pa.table({})
+            if columns is not None:
+                schema = pa.schema([schema.field(name) for name in columns])
+            return schema.empty_table()
+        table = pa.concat_tables(tables)
+        # Restore the order of the input IDs
+        return table.take(np.argsort(order, kind='stable'))
+
+    def save(self, folder: str):
+        """Store the index as `.npy` files in `folder`."""
+        os.makedirs(folder, exist_ok=True)
+        for name in _INDEX_ARRAYS:
+            np.save(os.path.join(folder, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(folder, _INDEX_FILES), 'w') as file:
+            json.dump(self.files, file, indent=2)
+
+    @classmethod
+    def load(
+        cls, folder: str, mmap_mode: Optional[str] = 'r'
+    ) -> 'PaperIndex':
+        """Load an index stored by `save`.
+
+        Args:
+            folder: Folder containing the index.
+            mmap_mode (optional): Mode used to memory-map the arrays (see
+                `np.load`). Use None to load them in memory.
+
+        Returns:
+            PaperIndex: The index.
+        """
+        with open(os.path.join(folder, _INDEX_FILES), 'r') as file:
+            files = json.load(file)
+        return cls(files, *[
+            np.load(os.path.join(folder, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in _INDEX_ARRAYS
+        ])
@@ -0,0 +1,306 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Optional
+from loguru import logger
+from smartbib.utils import atomic_path
+
+# Prefix of the names of the Prometheus metrics
+PROMETHEUS_PREFIX = 'smartbib'
+
+
+def _current_rss():
+    """Resident set size of the current process, in bytes."""
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Without /proc, fall back to the peak so far
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class Span:
+    """Timed block of a stage, whose rows and bytes can be set in the block."""
+
+    def __init__(self, rows: int = 0, n_bytes: int = 0) -> None:
+        self.rows = rows
+        self.n_bytes = n_bytes
+
+
+class Metrics:
+    """Time, rows and bytes processed by each stage of a pipeline.
+
+    Stages are named with dots for sub-stages (e.g., 'transform.ids'), and
+    the time of a span includes the time of the spans nested in it. Spans
+    can be recorded from several threads.
+    """
+
+    def __init__(self) -> None:
+        self.stages = defaultdict(lambda: dict(
+            calls=0, seconds=0., rows=0, bytes=0
+        ))
+        self.files = defaultdict(lambda: defaultdict(float))
+        self.peak_rss = 0
+        self.started = time.time()
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        stage: str,
+        seconds: float = 0.,
+        rows: int = 0,
+        n_bytes: int = 0,
+        path: Optional[str] = None,
+    ):
+        """Add to the counters of a stage (and of a file, if set)."""
+        with self._lock:
+            counters = self.stages[stage]
+            counters['calls'] += 1
+            counters['seconds'] += seconds
+            counters['rows'] += int(rows)
+            counters['bytes'] += int(n_bytes)
+            if path is not None:
+                self.files[path][stage] += seconds
+
+    @contextmanager
+    def span(
+        self,
+        stage: str,
+        path: Optional[str] = None,
+        rows: int = 0,
+        n_bytes: int = 0,
+    ):
+        """Time a block as part of `stage`.
+
+        Yields:
+            Span: Object whose `rows` and `n_bytes` can be set in the block.
+        """
+        span = Span(rows, n_bytes)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            self.add(
+                stage, time.perf_counter() - start, span.rows, span.n_bytes,
+                path
+            )
+
+    def sample_rss(self):
+        self.peak_rss = max(self.peak_rss, _current_rss())
+
+    def snapshot(self) -> dict:
+        """Picklable copy of the counters, which can be `merge`d."""
+        with self._lock:
+            return dict(
+                stages={
+                    stage: dict(counters)
+                    for stage, counters in self.stages.items()
+                },
+                files={
+                    path: dict(stages) for path, stages in self.files.items()
+                },
+                peak_rss=self.peak_rss,
+            )
+
+    def merge(self, snapshot: dict):
+        """Add the counters of other metrics (e.g., of a worker process)."""
+        with self._lock:
+            for stage, counters in snapshot['stages'].items():
+                for name, value in counters.items():
+                    self.stages[stage][name] += value
+            for path, stages in snapshot['files'].items():
+                for stage, seconds in stages.items():
+                    self.files[path][stage] += seconds
+            self.peak_rss = max(self.peak_rss, snapshot['peak_rss'])
+
+    def report(self) -> dict:
+        """Summary of the counters, with the throughput of each stage."""
+        snapshot = self.snapshot()
+        elapsed = self.elapsed
+        if elapsed is None:
+            elapsed = time.time() - self.started
+        for counters in snapshot['stages'].values():
+            seconds = counters['seconds']
+            counters['rows_per_s'] = (
+                counters['rows'] / seconds if seconds else None
+            )
+            counters['bytes_per_s'] = (
+                counters['bytes'] / seconds if seconds else None
+            )
+        return dict(
+            elapsed_s=elapsed,
+            peak_rss_bytes=snapshot['peak_rss'],
+            stages=dict(sorted(snapshot['stages'].items())),
+            files=snapshot['files'],
+        )
+
+    def to_prometheus(self) -> str:
+        """Counters in the Prometheus text exposition format."""
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, description, samples):
+            name = f'{PROMETHEUS_PREFIX}_{name}'
+            lines.extend([
+                f'# HELP {name} {description}', f'# TYPE {name} {kind}'
+            ])
+            for labels, value in samples:
+                labels = ','.join(
+                    f'{key}="{_escape_label(label)}"'
+                    for key, label in labels.items()
+                )
+                lines.append(
+                    f'{name}{{{labels}}} {value}' if labels
+                    else f'{name} {value}'
+                )
+
+        metric('run_seconds', 'gauge', 'Duration of the run.', [
+            ({}, report['elapsed_s'])
+        ])
+        metric('peak_rss_bytes', 'gauge', 'Peak resident set size.', [
+            ({}, report['peak_rss_bytes'])
+        ])
+        for name, description in [
+            ('calls', 'Number of spans of the stage.'),
+            ('seconds', 'Time spent in the stage.'),
+            ('rows', 'Rows processed by the stage.'),
+            ('bytes', 'Bytes processed by the stage.'),
+        ]:
+            metric(f'stage_{name}_total', 'counter', description, [
+                (dict(stage=stage), counters[name])
+                for stage, counters in report['stages'].items()
+            ])
+        metric('file_seconds_total', 'counter', 'Time spent on each file.', [
+            (dict(file=path, stage=stage), seconds)
+            for path, stages in report['files'].items()
+            for stage, seconds in stages.items()
+        ])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path_report: str):
+        """Write the report as JSON and in the Prometheus text format.
+
+        The Prometheus file has the same name as `path_report`, with the
+        `.prom` extension (e.g., for the node exporter textfile collector).
+        """
+        with atomic_path(path_report) as path_tmp:
+            with open(path_tmp, 'w') as file:
+                json.dump(self.report(), file, indent=2)
+        path_prometheus = os.path.splitext(path_report)[0] + '.prom'
+        with atomic_path(path_prometheus) as path_tmp:
+            with open(path_tmp, 'w') as file:
+                file.write(self.to_prometheus())
+        logger.debug(f"Metrics stored in '{path_report}'")
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n'
+    )
+
+
+# Metrics where the spans are recorded (see `collect`)
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Metrics currently recording the spans."""
+    return _metrics
+
+
+def span(
+    stage: str, path: Optional[str] = None, rows: int = 0, n_bytes: int = 0
+):
+    """Time a block as part of `stage` (see `Metrics.span`)."""
+    return _metrics.span(stage, path, rows, n_bytes)
+
+
+def timed(stage: str):
+    """Decorator timing each call of a function as part of `stage`.
+
+    The length of the result, when it has one (e.g., a dataframe), is counted
+    as the rows of the stage.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage) as current:
+                result = function(*args, **kwargs)
+                if hasattr(result, '__len__'):
+                    current.rows = len(result)
+            return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect(sample_interval: Optional[float] = None):
+    """Record the spans of a block into new metrics.
+
+    The previous metrics are restored at the end of the block, so runs (or
+    files processed by a worker) can be measured on their own and merged.
+
+    Args:
+        sample_interval (optional): Interval, in seconds, between samples of
+            the RSS, taken in a background thread. The RSS is always sampled
+            at the start and at the end of the block.
+
+    Yields:
+        Metrics: The metrics of the block.
+    """
+    global _metrics
+    previous, metrics = _metrics, Metrics()
+    _metrics = metrics
+    metrics.sample_rss()
+    stop = threading.Event()
+    if sample_interval:
+        def sample():
+            while not stop.wait(sample_interval):
+                metrics.sample_rss()
+        threading.Thread(target=sample, daemon=True).start()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        stop.set()
+        metrics.elapsed = time.perf_counter() - start
+        metrics.sample_rss()
+        _metrics = previous
+
+
+@contextmanager
+def profiled(path_stats: Optional[str] = None):
+    """Profile a block with cProfile.
+
+    The PID is logged, so that a sampling profiler can be attached instead
+    (e.g., `py-spy record --pid <pid>`).
+
+    Args:
+        path_stats (optional): Path to the stats written at the end of the
+            block (readable by `pstats` or `snakeviz`). If not set, nothing
+            is profiled.
+    """
+    if path_stats is None:
+        yield
+        return
+    logger.info(f"Profiling into '{path_stats}' (PID {os.getpid()})")
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path_stats)
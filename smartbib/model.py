@@ -1,19 +1,72 @@
+import threading
+from collections import OrderedDict
+from itertools import count
+from typing import Dict, Iterable, Optional
+from loguru import logger
 from sqlalchemy import (
-    Table, String, Text, Integer, Column, ForeignKey, MetaData
+    BINARY, Table, String, Text, Integer, BigInteger, Column, ForeignKey,
+    MetaData, Index, insert, inspect
 )
-from sqlalchemy.schema import ForeignKeyConstraint
-from sqlalchemy.dialects.mysql import insert, INTEGER, BINARY
+from sqlalchemy.schema import AddConstraint, CreateTable, ForeignKeyConstraint
+from tqdm.auto import tqdm
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.sql import select, update
+from smartbib.utils import chunks
+
+
+# Schema profiles. With 'bulk_load', tables are created without foreign keys
+# and secondary indexes, which are only built by `PaperDatabase.finalize`
+PROFILES = ('default', 'bulk_load')
+
+# Lookups (see `PaperDatabase.fetch_where_in`) with more distinct values than
+# this join a temporary table instead of using IN clauses
+TEMP_TABLE_THRESHOLD = 10_000
+# Maximum number of values in each IN clause of a lookup
+IN_CHUNK_SIZE = 1_000
+# Number of values inserted at a time into the temporary table of a lookup
+BULK_INSERT_CHUNK_SIZE = 5_000
+# Suffixes of the names of the temporary tables
+_TEMP_TABLE_IDS = count()
 
 
 class PaperDatabase:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        profile: str = 'default',
+        table_engine: Optional[str] = None,
+        row_format: Optional[str] = None,
+        key_block_size: Optional[int] = None,
+    ) -> None:
+        """Tables used to store the papers.
+
+        Args:
+            profile: Either 'default', where tables are created with all their
+                constraints and indexes, or 'bulk_load', where foreign keys
+                and non-unique indexes are deferred to `finalize`, so that
+                inserts do not pay for index maintenance.
+            table_engine (optional): MySQL storage engine (e.g., 'InnoDB',
+                'MyISAM' or 'Aria').
+            row_format (optional): MySQL row format (e.g., 'COMPRESSED').
+            key_block_size (optional): Page size, in KB, of compressed InnoDB
+                tables.
+        """
+        assert profile in PROFILES, f"Unknown profile '{profile}'"
+        self.profile = profile
+        self.table_options = {
+            f'mysql_{key}': str(value)
+            for key, value in [
+                ('engine', table_engine),
+                ('row_format', row_format),
+                ('key_block_size', key_block_size),
+            ]
+            if value is not None
+        }
         self.metadata_obj = MetaData()
         self.paper = self._gen_table_paper()
         self.pdf_url = self._gen_table_pdf_url()
         self.fos = self._gen_table_fos()
         self.author = self._gen_table_author()
-        #  self.authorship = self._gen_table_authorship()
+        self.authorship = self._gen_table_authorship()
         self.citation = self._gen_table_citation()
 
     def _gen_table_paper(self):
@@ -28,45 +81,143 @@ class PaperDatabase:
             Column('journal_name', String(256)),
             Column('journal_volume', String(256)),
             Column('journal_pages', String(256)),
+            **self.table_options
         )
 
     def _gen_table_pdf_url(self):
         return Table(
             'pdf_urls', self.metadata_obj,
             Column('id_paper', BINARY(20), ForeignKey('papers.id_')),
-            Column('content', Text)
+            Column('content', Text),
+            # SHA-1 of the URL. MySQL can only index a prefix of TEXT
+            # columns, so URLs are told apart by their hash
+            Column('content_hash', BINARY(20)),
+            Index(
+                'ix_pdf_urls_key', 'id_paper', 'content_hash', unique=True
+            ),
+            **self.table_options
         )
 
     def _gen_table_fos(self):
         return Table(
             'fields_of_study', self.metadata_obj,
-            Column('id_paper', BINARY(20), ForeignKey('papers.id_')),
-            Column('content', String(40))
+            Column(
+                'id_paper', BINARY(20), ForeignKey('papers.id_'),
+                primary_key=True
+            ),
+            Column('content', String(40), primary_key=True),
+            Index('ix_fields_of_study_content', 'content'),
+            **self.table_options
         )
 
     def _gen_table_author(self):
+        # Authors without S2 id have negative surrogate ids (see
+        # `authors.surrogate_author_ids`)
         return Table(
             'authors', self.metadata_obj,
-            Column('id_author', Integer),
+            Column('id_author', BigInteger, primary_key=True),
             Column('name', String(256)),
-            Column('id_paper', BINARY(20), ForeignKey('papers.id_'))
+            **self.table_options
         )
 
+    def _gen_table_authorship(self):
+        return Table(
+            'authorship', self.metadata_obj,
+            Column(
+                'id_paper', BINARY(20), ForeignKey('papers.id_'),
+                primary_key=True
+            ),
+            Column(
+                'id_author', BigInteger, ForeignKey('authors.id_author'),
+                primary_key=True
+            ),
+            Index('ix_authorship_id_author', 'id_author'),
+            **self.table_options
+        )
 
     def _gen_table_citation(self):
         return Table(
             'citations', self.metadata_obj,
-            Column('id_cited', BINARY(20), ForeignKey('papers.id_')),
-            Column('id_citer', BINARY(20))
+            Column(
+                'id_cited', BINARY(20), ForeignKey('papers.id_'),
+                primary_key=True
+            ),
+            Column('id_citer', BINARY(20), primary_key=True),
+            # Lookups by id_cited use the primary key
+            Index('ix_citations_id_citer', 'id_citer'),
+            **self.table_options
         )
 
 
     def insert(self, table, ignore_dup=False):
         insert_clause = insert(table)
         if ignore_dup:
-            insert_clause = insert_clause.prefix_with('IGNORE')
+            insert_clause = (
+                insert_clause
+                .prefix_with('IGNORE', dialect='mysql')
+                .prefix_with('OR IGNORE', dialect='sqlite')
+            )
         return insert_clause
 
+    @staticmethod
+    def _key_columns(table):
+        """Columns of the primary key, or of the first unique index."""
+        if len(table.primary_key.columns):
+            return list(table.primary_key.columns)
+        for index in table.indexes:
+            if index.unique:
+                return list(index.columns)
+        raise ValueError(f"Table '{table.name}' has no unique key")
+
+    def upsert(self, table, dialect='mysql', update_columns=None):
+        """Build an INSERT statement that updates rows with duplicated keys.
+
+        Uses `ON DUPLICATE KEY UPDATE` for MySQL and `ON CONFLICT` for SQLite
+        and PostgreSQL, so that data can be loaded again (e.g., a new release
+        of the corpus) without duplicating rows.
+
+        Args:
+            table: Table where the data is inserted.
+            dialect: Name of the SQL dialect ('mysql', 'sqlite' or
+                'postgresql').
+            update_columns (optional): Columns updated when the key already
+                exists. By default, all the columns not in the key. If there
+                are no such columns, duplicated rows are ignored.
+
+        Returns:
+            The insert statement.
+        """
+        key_columns = self._key_columns(table)
+        if update_columns is None:
+            update_columns = [
+                column.name for column in table.columns
+                if column not in key_columns
+            ]
+        if dialect == 'mysql':
+            upsert_clause = mysql.insert(table)
+            if not update_columns:
+                # A no-op update, so that duplicated rows are ignored
+                update_columns = [key_columns[0].name]
+            return upsert_clause.on_duplicate_key_update({
+                column: upsert_clause.inserted[column]
+                for column in update_columns
+            })
+        if dialect in ('sqlite', 'postgresql'):
+            module = sqlite if dialect == 'sqlite' else postgresql
+            upsert_clause = module.insert(table)
+            if not update_columns:
+                return upsert_clause.on_conflict_do_nothing(
+                    index_elements=key_columns
+                )
+            return upsert_clause.on_conflict_do_update(
+                index_elements=key_columns,
+                set_={
+                    column: upsert_clause.excluded[column]
+                    for column in update_columns
+                }
+            )
+        raise ValueError(f"Upsert not supported for dialect '{dialect}'")
+
     def select_where_in(self, table, column, values, selected_columns=None):
         if selected_columns:
             select_clause = select(
@@ -78,6 +229,76 @@ class PaperDatabase:
             getattr(table.c, column).in_(values)
         )
 
+    def fetch_where_in(
+        self,
+        conn,
+        table,
+        column,
+        values,
+        selected_columns=None,
+        chunk_size: int = IN_CHUNK_SIZE,
+        temp_table_threshold: int = TEMP_TABLE_THRESHOLD,
+    ):
+        """Fetch the rows of `table` whose `column` is in `values`.
+
+        Unlike `select_where_in`, the statement is executed, and it scales to
+        large sets of values: up to `temp_table_threshold` distinct values
+        are looked up with `IN` clauses of `chunk_size` values. Larger sets
+        are bulk-inserted into a temporary table, joined with `table`.
+
+        Args:
+            conn: Connection to the database.
+            table: Table where the rows are selected.
+            column: Name of the column compared to `values`.
+            values: Values looked up.
+            selected_columns (optional): Names of the columns returned. By
+                default, all the columns of the table.
+            chunk_size: Maximum number of values per `IN` clause.
+            temp_table_threshold: Number of distinct values above which a
+                temporary table is used.
+
+        Returns:
+            List[Row]: The rows found, in no particular order.
+        """
+        values = list(dict.fromkeys(values))
+        key = getattr(table.c, column)
+        columns = [
+            getattr(table.c, name) for name in selected_columns
+        ] if selected_columns else list(table.columns)
+        if len(values) <= temp_table_threshold:
+            return [
+                row
+                for chunk in chunks(values, chunk_size)
+                for row in conn.execute(select(columns).where(key.in_(chunk)))
+            ]
+        # Temporary tables are private to the connection
+        keys = Table(
+            f'_lookup_keys_{next(_TEMP_TABLE_IDS)}', MetaData(),
+            Column('value', key.type, primary_key=True),
+            prefixes=['TEMPORARY']
+        )
+        keys.create(conn)
+        try:
+            for chunk in chunks(values, BULK_INSERT_CHUNK_SIZE):
+                conn.execute(
+                    keys.insert(), [dict(value=value) for value in chunk]
+                )
+            return conn.execute(
+                select(columns).select_from(
+                    table.join(keys, key == keys.c.value)
+                )
+            ).fetchall()
+        finally:
+            if conn.dialect.name == 'mysql':
+                # Unlike DROP TEMPORARY TABLE, a plain DROP TABLE commits the
+                # transaction of the caller
+                conn.exec_driver_sql(
+                    'DROP TEMPORARY TABLE '
+                    + conn.dialect.identifier_preparer.quote(keys.name)
+                )
+            else:
+                keys.drop(conn)
+
     def update_where_equal(self, table, eq_column, eq_value, values):
         update_clause = update(table).where(
             getattr(table.c, eq_column) == eq_value
@@ -85,5 +306,161 @@ class PaperDatabase:
         return update_clause
 
     def create_tables(self, db_engine):
-        self.metadata_obj.create_all(db_engine)
+        if self.profile == 'default':
+            self.metadata_obj.create_all(db_engine)
+            return
+        # Bare tables: only primary keys and unique indexes, required to
+        # detect duplicated rows
+        with db_engine.begin() as conn:
+            existing_tables = inspect(conn).get_table_names()
+            for table in self.metadata_obj.sorted_tables:
+                if table.name in existing_tables:
+                    continue
+                conn.execute(
+                    CreateTable(table, include_foreign_key_constraints=[])
+                )
+                for index in table.indexes:
+                    if index.unique:
+                        index.create(conn)
+
+    def finalize(self, db_engine):
+        """Build the indexes and constraints deferred by the bulk load profile.
+
+        Should be called once all the data is loaded. Indexes already in the
+        database are skipped, so it is safe to call it again after a failure.
+        Foreign keys are not added for SQLite, which does not support adding
+        constraints to existing tables.
+
+        Args:
+            db_engine: SQLAlchemy engine connected to the database.
+        """
+        with db_engine.begin() as conn:
+            inspector = inspect(conn)
+            steps = [
+                index
+                for table in self.metadata_obj.sorted_tables
+                for index in table.indexes
+                if index.name not in {
+                    existing['name']
+                    for existing in inspector.get_indexes(table.name)
+                }
+            ]
+            if conn.dialect.name != 'sqlite':
+                steps += [
+                    constraint
+                    for table in self.metadata_obj.sorted_tables
+                    for constraint in table.foreign_key_constraints
+                    if not inspector.get_foreign_keys(table.name)
+                ]
+        for step in tqdm(steps, desc='Finalizing tables'):
+            # Each step runs in its own transaction, so that the progress is
+            # kept if a later one fails
+            with db_engine.begin() as conn:
+                if isinstance(step, Index):
+                    logger.debug(f"Creating index '{step.name}'")
+                    step.create(conn)
+                else:
+                    logger.debug(
+                        f"Adding foreign key to '{step.table.name}'"
+                    )
+                    conn.execute(AddConstraint(step))
+
+
+class CachedLookup:
+    """Rows of a table by key, behind a size-bounded LRU cache.
+
+    Keys missing from the cache are fetched in a single batched lookup (see
+    `PaperDatabase.fetch_where_in`). Keys not found in the table are cached
+    as well, so repeated lookups of hot (or unknown) papers do not reach the
+    database.
+
+    ```python
+        lookup = CachedLookup(db, engine, db.citation, 'id_cited')
+        citers = lookup.get_many(paper_ids)
+    ```
+    """
+
+    def __init__(
+        self,
+        db: PaperDatabase,
+        engine,
+        table,
+        column: str = 'id_',
+        selected_columns: Optional[Iterable[str]] = None,
+        max_size: int = 100_000,
+        **lookup_kwargs,
+    ) -> None:
+        """Create a cache.
+
+        Args:
+            db: Database where the rows are looked up.
+            engine: SQLAlchemy engine connected to the database.
+            table: Table where the rows are looked up.
+            column: Name of the key column (e.g., a 20-bytes paper ID).
+            selected_columns (optional): Names of the columns returned. By
+                default, all the columns of the table.
+            max_size: Maximum number of keys in the cache.
+            **lookup_kwargs: Arguments of `PaperDatabase.fetch_where_in`.
+        """
+        assert max_size > 0, "The cache must hold at least one key"
+        self.db = db
+        self.engine = engine
+        self.table = table
+        self.column = column
+        self.selected_columns = list(
+            selected_columns or table.columns.keys()
+        )
+        self.max_size = max_size
+        self.lookup_kwargs = lookup_kwargs
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get_many(self, keys: Iterable) -> Dict:
+        """Rows of each key.
+
+        Args:
+            keys: Values of the key column.
+
+        Returns:
+            Dict: Rows (list of tuples with the selected columns) of each
+                key. Keys not found have no rows.
+        """
+        keys = list(dict.fromkeys(keys))
+        rows = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    rows[key] = self._cache[key]
+            self.hits += len(rows)
+            self.misses += len(keys) - len(rows)
+        missing = [key for key in keys if key not in rows]
+        if missing:
+            fetched = {key: [] for key in missing}
+            with self.engine.connect() as conn:
+                for row in self.db.fetch_where_in(
+                    conn, self.table, self.column, missing,
+                    [self.column] + self.selected_columns,
+                    **self.lookup_kwargs
+                ):
+                    fetched[row[0]].append(tuple(row[1:]))
+            rows.update(fetched)
+            with self._lock:
+                self._cache.update(fetched)
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return {key: rows[key] for key in keys}
+
+    def get(self, key) -> list:
+        """Rows of a single key."""
+        return self.get_many([key])[key]
 
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
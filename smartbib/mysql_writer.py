@@ -1,158 +1,666 @@
 import pandas as pd
+import pyarrow.parquet as pq
+from smartbib.metrics import collect, profiled, span, timed
 from smartbib.model import PaperDatabase
+from smartbib.parquetizer import (
+    _iter_gzip_chunks, _pandas_metadata, _parse_s2_chunk
+)
+from smartbib.schema import PAPER_COLUMNS
 from loguru import logger
 import fire
+import hashlib
+import os
+from typing import Optional
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from sqlalchemy import BINARY, text
 from tqdm.auto import tqdm
-from smartbib.utils import chunks
+from smartbib.utils import ids_bytes_to_str_array, prefetch
 
+# Methods used to write the data into the database
+METHODS = ('insert', 'load_data')
 
-def _papers_to_records(df):
-    """Convert a dataframe containing papers to s2 into records.
+# Databases where the data can be written (see `write_data_to_db`)
+BACKENDS = ('mysql', 'sqlite')
+
+# Pragmas set on the connections of `_sqlite_engine`. The journal is only
+# synced to the disk at the end of the load (see `_sync_sqlite`)
+_SQLITE_PRAGMAS = dict(
+    journal_mode='WAL', synchronous='OFF', temp_store='MEMORY'
+)
+
+# Modifiers of LOAD DATA for each way of handling duplicated keys
+_LOAD_DATA_MODIFIERS = {None: '', 'ignore': 'IGNORE ', 'update': 'REPLACE '}
+
+# Escape sequences used by MySQL's LOAD DATA (backslash must come first)
+_TSV_ESCAPES = (
+    ('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'),
+    ('\0', '\\0')
+)
+
+
+@timed('db.frame.papers')
+def _papers_to_frame(df, columns):
+    """Convert a dataframe containing papers from s2 into the `papers` table.
 
     Take a pandas dataframe from data downloaded from Semantic Scholar and
-    convert into a list of dictionaries containing the data to write to a mysql
-    database.
+    rename its columns to the ones used in the mysql database (see
+    `schema.PAPER_COLUMNS`). Columns not available in the dataframe are left
+    to their default values.
 
     Args:
         df: Pandas dataframe from s2 data.
+        columns: Columns of the `papers` table.
 
     Returns:
-        List[Dict]: Containing the records.
+        pd.DataFrame: Containing the records.
     """
-    return (
-        df.reset_index().drop(
-            ['authors', 'inCitations', 'sources', 'pdfUrls', 'fieldsOfStudy'],
-            axis=1
-        )
-        .rename(
-            columns=dict(
-                id='id_paper', paperAbstract='paper_abstract', s2Url='s2_url',
-                journalName='journal_name', journalVolume='journal_volume',
-                journalPages='journal_pages'
+    df = df.reset_index().rename(columns=PAPER_COLUMNS)
+    return df[[column for column in columns if column in df.columns]]
+
+
+@timed('db.tsv')
+def _frame_to_tsv(df, binary_columns, file):
+    """Write a dataframe as tab separated values readable by LOAD DATA.
+
+    Binary columns are written as hexadecimal strings (converted back with
+    `UNHEX` when loading), nulls as `\\N` and the remaining values are
+    escaped following the default format of MySQL.
+
+    Args:
+        df: Dataframe to write.
+        binary_columns: Names of the columns containing 20-bytes IDs.
+        file: File object (opened in text mode) used to write the data.
+    """
+    if df.empty:
+        return
+    fields = []
+    for column in df.columns:
+        values = df[column]
+        if column in binary_columns:
+            values = pd.Series(
+                ids_bytes_to_str_array(values.to_numpy())
+                .to_numpy(zero_copy_only=False)
             )
+        else:
+            is_null = values.isna().to_numpy()
+            values = values.astype(str).reset_index(drop=True)
+            for char, escaped in _TSV_ESCAPES:
+                values = values.str.replace(char, escaped, regex=False)
+            values = values.where(~is_null, None)
+        fields.append(values)
+    lines = fields[0].str.cat(fields[1:], sep='\t', na_rep='\\N')
+    file.write('\n'.join(lines))
+    file.write('\n')
+
+
+def _load_data(conn, table, df, on_duplicate=None, chunk_size=100_000):
+    """Write a dataframe into a table using LOAD DATA LOCAL INFILE.
+
+    The data is streamed, `chunk_size` rows at a time, into a temporary TSV
+    file, which is then loaded by the server in a single statement.
+
+    Args:
+        conn: Connection to a MySQL database.
+        table: Table where the data is loaded.
+        df: Dataframe whose columns match the ones in `table`.
+        on_duplicate (optional): What to do with rows with duplicated keys.
+            Either 'ignore' or 'update' (the existing rows are replaced).
+        chunk_size: Number of rows converted to TSV at a time.
+    """
+    if df.empty:
+        return
+    binary_columns = [
+        column.name for column in table.columns
+        if isinstance(column.type, BINARY)
+    ]
+    with tempfile.NamedTemporaryFile(
+        'w', suffix='.tsv', encoding='utf-8', newline='', delete=False
+    ) as file:
+        for start in range(0, df.shape[0], chunk_size):
+            _frame_to_tsv(
+                df.iloc[start:start + chunk_size], binary_columns, file
+            )
+    columns = ', '.join(
+        f'@{column}' if column in binary_columns else f'`{column}`'
+        for column in df.columns
+    )
+    assignments = ', '.join(
+        f'`{column}` = UNHEX(@{column})'
+        for column in df.columns if column in binary_columns
+    )
+    statement = (
+        f"LOAD DATA LOCAL INFILE :path {_LOAD_DATA_MODIFIERS[on_duplicate]}"
+        f"INTO TABLE `{table.name}` CHARACTER SET utf8mb4 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' "
+        f"({columns})"
+    )
+    if assignments:
+        statement += f" SET {assignments}"
+    try:
+        with span(f'db.load_data.{table.name}', rows=df.shape[0]):
+            conn.execute(text(statement), dict(path=file.name))
+    finally:
+        os.remove(file.name)
+
+
+def _iter_row_chunks(data, columns, chunk_size=5_000):
+    """Yield chunks of rows, as tuples, from a dataframe.
+
+    Rows are converted on the fly, one chunk at a time, from the column
+    arrays. Values are converted to Python objects the DB drivers understand
+    (e.g., numpy integers to `int` and NaN to `None`).
+
+    Args:
+        data: Pandas dataframe.
+        columns: Columns in the order used for the tuples.
+        chunk_size: Number of rows per chunk.
+
+    Yields:
+        List[Tuple]: Chunk of rows.
+    """
+    for start in range(0, data.shape[0], chunk_size):
+        chunk = data.iloc[start:start + chunk_size]
+        arrays = [
+            chunk[column].astype(object)
+            .where(chunk[column].notna(), None).tolist()
+            for column in columns
+        ]
+        yield list(zip(*arrays))
+
+
+def _positional_insert(db, conn, table, columns, on_duplicate=None):
+    """Compile an INSERT statement taking positional parameters.
+
+    Statements with positional parameters can be sent straight to the DB
+    driver with tuples, instead of one dictionary per row. Rows with
+    duplicated keys are ignored when `on_duplicate='ignore'` and update the
+    existing rows when `on_duplicate='update'` (see `PaperDatabase.upsert`).
+
+    Returns:
+        Tuple[str, List[str]]: The statement and the order of the columns in
+            the parameters.
+    """
+    dialect = conn.dialect
+    if not dialect.positional:
+        dialect = type(dialect)(paramstyle='format')
+    if on_duplicate == 'update':
+        # Only the columns being written are updated
+        insert_clause = db.upsert(
+            table, conn.dialect.name,
+            [column for column in columns if not table.c[column].primary_key]
         )
-        .to_dict(orient='records')
+    else:
+        insert_clause = db.insert(table, ignore_dup=on_duplicate == 'ignore')
+    compiled = insert_clause.compile(
+        dialect=dialect, column_keys=list(columns)
     )
+    return compiled.string, list(compiled.positiontup)
+
+
+def _write_frame(db, conn, table, df, method='insert', on_duplicate=None):
+    """Write a dataframe matching the columns in `table`.
+
+    With `method='load_data'`, MySQL databases are loaded using `_load_data`.
+    Other databases (e.g., SQLite) fall back to chunked inserts, whose rows
+    are generated lazily by `_iter_row_chunks`.
+    """
+    if method == 'load_data' and conn.dialect.name == 'mysql':
+        _load_data(conn, table, df, on_duplicate)
+    else:
+        statement, columns = _positional_insert(
+            db, conn, table, df.columns, on_duplicate
+        )
+        chunks = _iter_row_chunks(df, columns)
+        while True:
+            # Converting the rows into Python objects is timed on its own
+            with span('db.rows'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            with span(f'db.execute.{table.name}', rows=len(chunk)):
+                conn.exec_driver_sql(statement, chunk)
+
+
+@contextmanager
+def _bulk_load_mode(conn, tables, enabled=True):
+    """Disable keys and constraint checks while loading data into MySQL.
+
+    Non-unique indexes are disabled (for engines supporting it) and rebuilt
+    at the end, in a single pass, instead of being updated row by row.
+    Constraint checks are only disabled for the session of `conn`.
+    """
+    if not enabled or conn.dialect.name != 'mysql':
+        yield
+        return
+    conn.execute(text('SET foreign_key_checks = 0, unique_checks = 0'))
+    for table in tables:
+        conn.execute(text(f'ALTER TABLE `{table.name}` DISABLE KEYS'))
+    try:
+        yield
+    finally:
+        for table in tables:
+            conn.execute(text(f'ALTER TABLE `{table.name}` ENABLE KEYS'))
+        conn.execute(text('SET foreign_key_checks = 1, unique_checks = 1'))
+
 
-def _insert_papers(db, conn, df):
+def _insert_papers(db, conn, df, method='insert', on_duplicate=None):
     logger.debug(f"{df.shape[0]} papers to insert")
     # Insert papers
-    insert_clause = db.insert(db.paper)
-    records = _papers_to_records(df)
-    for chunk in chunks(records):
-        conn.execute(insert_clause, chunk)
+    df_papers = _papers_to_frame(df, db.paper.columns.keys())
+    _write_frame(db, conn, db.paper, df_papers, method, on_duplicate)
     logger.debug("Papers up/inserted")
 
-def _insert_citations(db, conn, df):
-    df_citations = df.inCitations.explode().dropna().to_frame()
-    logger.debug(f"{df_citations.shape[0]} citations in the dataframe")
-
-    # Convert the dataframe into records
-    records = (
-        df_citations
+@timed('db.frame.citations')
+def _citations_frame(df):
+    return (
+        df.inCitations.explode().dropna().to_frame()
         .reset_index()
         .set_axis(['id_cited', 'id_citer'], axis='columns')
-        .to_dict(orient='records')
     )
-    insert_clause = db.insert(db.citation)
-    for chunk in chunks(records):
-        conn.execute(insert_clause, chunk)
-    logger.debug("Citations inserted")
-    return df
 
 
-def _insert_fos(db, conn, df):
-    # Prepare the records
-    records = (
+@timed('db.frame.fos')
+def _fos_frame(df):
+    return (
         df.fieldsOfStudy.explode().dropna()
         .reset_index(drop=False)
         .set_axis(['id_paper', 'content'], axis='columns')
-        .to_dict(orient='records')
     )
-    # Insert the data
-    insert_clause = db.insert(db.fos)
-    for chunk in chunks(records):
-        conn.execute(insert_clause, chunk)
-    logger.debug("FoS inserted")
 
-def _insert_pdf_urls(db, conn, df):
-    # Prepare the records
-    records = (
+
+@timed('db.frame.pdf_urls')
+def _pdf_urls_frame(df):
+    df_pdf_urls = (
         df.pdfUrls.explode().dropna()
         .reset_index(drop=False)
         .set_axis(['id_paper', 'content'], axis='columns')
-        .to_dict(orient='records')
     )
-    # Insert the data
-    insert_clause = db.insert(db.pdf_url)
-    for chunk in chunks(records):
-        conn.execute(insert_clause, chunk)
-    logger.debug("PDF url's inserted")
+    # Key of the URLs (see `PaperDatabase._gen_table_pdf_url`)
+    df_pdf_urls['content_hash'] = [
+        hashlib.sha1(url.encode()).digest() for url in df_pdf_urls.content
+    ]
+    return df_pdf_urls
+
 
-def _insert_authors(db, conn, df):
+@timed('db.frame.authors')
+def _authors_frame(df):
     # Explode the authors column and convert the dictionary into columns
-    df_authors = (
+    return (
         df.authors.explode().dropna()
         .pipe(lambda s: pd.DataFrame(s.tolist(), index=s.index))
         .reset_index(drop=False)
         .set_axis(['id_paper', 'id_author', 'name'], axis='columns')
     )
-    logger.debug(f"{df_authors.shape[0]} authors in the dataframe")
+
+
+def _author_dimension_frame(df_authors):
+    # One row per author, with the first name found
+    return df_authors.drop_duplicates('id_author')[['id_author', 'name']]
+
+
+def _authorship_frame(df_authors):
+    return df_authors[['id_paper', 'id_author']].drop_duplicates()
+
+
+def _insert_citations(db, conn, df, method='insert', on_duplicate=None):
+    df_citations = _citations_frame(df)
+    logger.debug(f"{df_citations.shape[0]} citations in the dataframe")
+    _write_frame(
+        db, conn, db.citation, df_citations, method, on_duplicate
+    )
+    logger.debug("Citations inserted")
+    return df
+
+
+def _insert_fos(db, conn, df, method='insert', on_duplicate=None):
     # Insert the data
-    insert_clause = db.insert(db.author, ignore_dup=True)
-    records = df_authors.to_dict(orient='records')
-    for chunk in chunks(records):
-        conn.execute(insert_clause, chunk)
+    _write_frame(db, conn, db.fos, _fos_frame(df), method, on_duplicate)
+    logger.debug("FoS inserted")
+
+def _insert_pdf_urls(db, conn, df, method='insert', on_duplicate=None):
+    if 'pdfUrls' not in df.columns:
+        logger.debug("No PDF url's in the dataframe")
+        return
+    # Insert the data
+    _write_frame(
+        db, conn, db.pdf_url, _pdf_urls_frame(df), method, on_duplicate
+    )
+    logger.debug("PDF url's inserted")
+
+def _insert_authors(db, conn, df, method='insert', on_duplicate='ignore'):
+    df_authors = _authors_frame(df)
+    logger.debug(f"{df_authors.shape[0]} authorships in the dataframe")
+    # Authors are shared between papers, so duplicates are always ignored
+    _write_frame(
+        db, conn, db.author, _author_dimension_frame(df_authors), method,
+        'ignore'
+    )
+    _write_frame(
+        db, conn, db.authorship, _authorship_frame(df_authors), method,
+        on_duplicate
+    )
     logger.debug("Authors inserted")
 
 
-def write_s2_data_to_db(df, engine):
-    db = PaperDatabase()
-    db.create_tables(engine)
-    with engine.connect() as conn:
-        _insert_papers(db, conn, df)
-        df = _insert_citations(db, conn, df)
-        _insert_fos(db, conn, df)
-        _insert_pdf_urls(db, conn, df)
-        _insert_authors(db, conn, df)
+def _write_chunk(db, engine, table, df, method='insert', on_duplicate=None):
+    """Write a chunk of rows in its own transaction (and connection)."""
+    with engine.begin() as conn:
+        with _bulk_load_mode(conn, [], method == 'load_data'):
+            _write_frame(db, conn, table, df, method, on_duplicate)
 
 
-def write_data_to_db(
-    path_data: str, path_config: str, path_credentials: str
+def _write_children_concurrently(
+    db, engine, df, method='insert', n_threads=4, on_duplicate=None,
+    chunk_size=50_000
+):
+    """Write the tables referencing `papers` using a pool of threads.
+
+    The rows of each table are split in chunks of `chunk_size` rows, which are
+    written concurrently, each one in its own transaction, using connections
+    from the engine pool.
+    """
+    children = [
+        (db.citation, _citations_frame(df), on_duplicate),
+        (db.fos, _fos_frame(df), on_duplicate),
+        (db.authorship, _authorship_frame(_authors_frame(df)), 'ignore'),
+    ]
+    if 'pdfUrls' in df.columns:
+        children.append((db.pdf_url, _pdf_urls_frame(df), on_duplicate))
+    with ThreadPoolExecutor(n_threads) as executor:
+        futures = [
+            executor.submit(
+                _write_chunk, db, engine, table,
+                df_table.iloc[start:start + chunk_size], method, table_dup
+            )
+            for table, df_table, table_dup in children
+            for start in range(0, df_table.shape[0], chunk_size)
+        ]
+        # Raise the first error, if any
+        for future in as_completed(futures):
+            future.result()
+    logger.debug(f"{len(futures)} chunks written concurrently")
+
+
+def write_s2_data_to_db(
+    df, engine, method='insert', n_threads=1, upsert=False, db=None
 ):
-    """Load dataframes from parquet files and write to database
+    """Write a dataframe with papers from s2 into the database.
 
     Args:
-        path_data: Glob-like patter for input files.
-        path_config: Path to the configuration file used to access the
-            database
-        path_credentials: Path to the credentials file used to access the
-            database
+        df: Pandas dataframe from s2 data, indexed by the paper id.
+        engine: SQLAlchemy engine connected to the database.
+        method: Either 'insert', which uses (chunked) INSERT statements, or
+            'load_data', which bulk-loads each table with LOAD DATA LOCAL
+            INFILE with keys and constraint checks disabled. The latter
+            requires a MySQL connection with `local_infile` enabled and falls
+            back to inserts for other databases.
+        n_threads: Number of connections used to write the tables. When
+            greater than one, the papers are committed first and the other
+            tables are then written concurrently (see
+            `_write_children_concurrently`). The engine pool must allow
+            `n_threads` connections.
+        upsert: Whether papers already in the database should be updated
+            (and duplicated rows in the other tables ignored), so that a new
+            release of the corpus can be loaded over an existing database.
+        db (optional): Tables used to store the data. If not set, the tables
+            from `PaperDatabase()` are created (if needed) and used.
+    """
+    assert method in METHODS, f"Unknown method '{method}'"
+    if db is None:
+        db = PaperDatabase()
+        db.create_tables(engine)
+    tables = [
+        db.paper, db.citation, db.fos, db.pdf_url, db.author, db.authorship
+    ]
+    paper_dup, child_dup = ('update', 'ignore') if upsert else (None, None)
+    with engine.connect() as conn:
+        with _bulk_load_mode(conn, tables, method == 'load_data'):
+            if n_threads > 1:
+                # Authors are written with the papers, before the tables
+                # referencing them
+                with conn.begin():
+                    _insert_papers(db, conn, df, method, paper_dup)
+                    _write_frame(
+                        db, conn, db.author,
+                        _author_dimension_frame(_authors_frame(df)), method,
+                        'ignore'
+                    )
+                _write_children_concurrently(
+                    db, engine, df, method, n_threads, child_dup
+                )
+                return
+            _insert_papers(db, conn, df, method, paper_dup)
+            df = _insert_citations(db, conn, df, method, child_dup)
+            _insert_fos(db, conn, df, method, child_dup)
+            _insert_pdf_urls(db, conn, df, method, child_dup)
+            _insert_authors(db, conn, df, method)
+
+
+def _iter_parquet(file_list, batch_size=None):
+    for path_parquet in file_list:
+        logger.debug(f"Loading parquet file from {path_parquet}")
+        if batch_size is None:
+            with span('read_parquet', path_parquet) as current:
+                df = pd.read_parquet(path_parquet)
+                current.rows = df.shape[0]
+            yield df
+            continue
+        batches = pq.ParquetFile(path_parquet).iter_batches(
+            batch_size=batch_size
+        )
+        while True:
+            with span('read_parquet', path_parquet) as current:
+                batch = next(batches, None)
+                if batch is not None:
+                    df = batch.to_pandas()
+                    current.rows = df.shape[0]
+            if batch is None:
+                break
+            yield df
+
+
+def _chunk_to_frame(chunk):
+    """Parse a chunk of S2 JSON lines into a dataframe indexed by `id_`."""
+    table = _parse_s2_chunk(chunk)
+    with span('to_pandas', rows=table.num_rows):
+        return table.replace_schema_metadata(_pandas_metadata()).to_pandas()
+
+
+def _iter_s2_gzip(file_list, batch_size=None, queue_size=2):
+    """Stream S2 gzip files as dataframes ready to be written.
+
+    Decompressing and parsing run in their own threads, connected by queues
+    holding up to `queue_size` batches, so that both overlap with writing the
+    previous batches into the database while the memory stays bounded.
+    """
+    chunks = prefetch(
+        (
+            chunk for path in file_list
+            for chunk in _iter_gzip_chunks(path, batch_size)
+        ),
+        queue_size
+    )
+    return prefetch(map(_chunk_to_frame, chunks), queue_size)
+
+
+def _iter_data_files(file_list, batch_size=None, queue_size=2, n_threads=1):
+    """Stream the papers of parquet files and S2 gzip files.
+
+    Each file is read according to its extension: gzip files with
+    `_iter_s2_gzip` and the other ones with `_iter_parquet`.
     """
+    gzip_files = [path for path in file_list if path.endswith('.gz')]
+    parquet_files = [path for path in file_list if not path.endswith('.gz')]
+    if parquet_files:
+        dfs = _iter_parquet(parquet_files, batch_size)
+        yield from prefetch(dfs) if n_threads > 1 else dfs
+    if gzip_files:
+        yield from _iter_s2_gzip(gzip_files, batch_size, queue_size)
+
+
+def _mysql_engine(path_config, path_credentials, method, n_threads):
     import yaml
     from sqlalchemy import create_engine
-    from glob import glob
 
     with open(path_config, 'r') as file:
         config = yaml.safe_load(file)['mysql']
     with open(path_credentials, 'r') as file:
         credentials = yaml.safe_load(file)['mysql']
-    engine = create_engine(
+    return create_engine(
         "mysql+pymysql://{user}:{pw}@{server}/{db}?charset=utf8mb4".format(
             user=credentials['user'],
             pw=credentials['password'],
             server=config['server'],
             db=config['database']
-        ), pool_timeout=300
+        ), pool_timeout=300, pool_size=max(n_threads, 5),
+        # Required to read the files sent by LOAD DATA LOCAL INFILE
+        connect_args=dict(local_infile=method == 'load_data')
+    )
+
+
+def _sqlite_engine(path_db, n_threads=1, cache_size_mb=1024):
+    """Create an engine for a SQLite file, tuned for bulk loads.
+
+    Connections use a write-ahead log (so the database can be read during
+    the load), a page cache of `cache_size_mb` MB and `synchronous=OFF`, so
+    that commits do not wait for the disk. They are kept in a pool, so the
+    cache survives across batches. A crash during the load can corrupt the
+    database, which must then be loaded again.
+    """
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import QueuePool
+
+    engine = create_engine(
+        f'sqlite:///{path_db}', poolclass=QueuePool,
+        pool_size=max(n_threads, 5),
+        # SQLite has a single writer: other connections wait for the lock
+        connect_args=dict(check_same_thread=False, timeout=300)
     )
-    file_list = glob(path_data)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in _SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        # Negative sizes are in KiB
+        cursor.execute(f'PRAGMA cache_size = {-cache_size_mb * 1024}')
+        cursor.close()
+
+    return engine
+
+
+def _sync_sqlite(engine):
+    """Checkpoint the write-ahead log of a SQLite load, syncing it to disk.
+
+    Also updates the statistics used by the query planner.
+    """
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA synchronous = FULL')
+        conn.exec_driver_sql('PRAGMA optimize')
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def write_data_to_db(
+    path_data: str, path_config: Optional[str] = None,
+    path_credentials: Optional[str] = None, method: str = 'insert',
+    batch_size: Optional[int] = None, n_threads: int = 1,
+    upsert: bool = False, profile: str = 'default',
+    table_engine: Optional[str] = None, row_format: Optional[str] = None,
+    queue_size: int = 2, path_metrics: Optional[str] = None,
+    path_profile: Optional[str] = None, backend: str = 'mysql',
+    path_db: Optional[str] = None, cache_size_mb: int = 1024
+):
+    """Load papers from parquet files or S2 gzip files and write to database
+
+    Parquet files are the ones written by `parquetizer`. Gzip files (ending
+    with `.gz`) from the S2 corpus are loaded in a single pass, without the
+    parquet intermediate: each batch is decompressed, parsed into the layout
+    of `schema.PARQUET_SCHEMA` and written, with the three stages running
+    concurrently (see `_iter_s2_gzip`). Patterns can match both kinds of
+    files.
+
+    The data is written either into a MySQL server or, without any server,
+    into a SQLite file tuned for bulk loads (see `_sqlite_engine`):
+
+    ```bash
+        python -m smartbib.mysql_writer 'data/*.gz' --backend sqlite \\
+            --path_db papers.db --profile bulk_load
+    ```
+
+    Args:
+        path_data: Glob-like patter for input files.
+        path_config (optional): Path to the configuration file used to
+            access the MySQL database. Required with `backend='mysql'`.
+        path_credentials (optional): Path to the credentials file used to
+            access the MySQL database. Required with `backend='mysql'`.
+        method: Either 'insert' or 'load_data' (see `write_s2_data_to_db`).
+        batch_size (optional): Number of papers read from the files at a
+            time. If not set, each file is loaded at once.
+        n_threads: Number of connections used to write the data. When greater
+            than one, the tables of each file are written concurrently and
+            the next parquet file (or batch) is read while the current one
+            is written.
+        upsert: Whether papers already in the database should be updated
+            (see `write_s2_data_to_db`).
+        profile: Schema profile (see `PaperDatabase`). With 'bulk_load',
+            foreign keys and secondary indexes are only built after all the
+            files are loaded.
+        table_engine (optional): MySQL storage engine used for the tables.
+        row_format (optional): MySQL row format used for the tables (e.g.,
+            'COMPRESSED').
+        queue_size: Maximum number of batches waiting between the stages
+            reading gzip files.
+        path_metrics (optional): Path to a JSON file where the time, rows
+            and bytes of each stage (e.g., parsing, building the rows of each
+            table and executing the statements) are stored, along with the
+            peak RSS. They are also written in the Prometheus text format to
+            a file with the `.prom` extension.
+        path_profile (optional): Path where cProfile stats of the load are
+            stored (e.g., to profile the load of a single shard).
+        backend: Either 'mysql' or 'sqlite'.
+        path_db (optional): Path to the SQLite file. Required with
+            `backend='sqlite'`.
+        cache_size_mb: Size, in MB, of the page cache of each SQLite
+            connection.
+    """
+    from glob import glob
+
+    assert backend in BACKENDS, f"Unknown backend '{backend}'"
+    if backend == 'mysql':
+        assert path_config is not None and path_credentials is not None, (
+            "The MySQL backend requires `path_config` and `path_credentials`"
+        )
+        engine = _mysql_engine(
+            path_config, path_credentials, method, n_threads
+        )
+    else:
+        assert path_db is not None, "The SQLite backend requires `path_db`"
+        engine = _sqlite_engine(path_db, n_threads, cache_size_mb)
+    file_list = sorted(glob(path_data))
     logger.debug(
         f"Loading files from '{path_data}'. {len(file_list)} files found"
     )
-    for path_parquet in tqdm(file_list):
-        logger.debug(f"Loading parquet file from {path_parquet}")
-        df = (pd.read_parquet(path_parquet))
-        write_s2_data_to_db(df, engine)
+    db = PaperDatabase(profile, table_engine, row_format)
+    db.create_tables(engine)
+    dfs = _iter_data_files(file_list, batch_size, queue_size, n_threads)
+    with collect(sample_interval=1.) as metrics, profiled(path_profile):
+        for df in tqdm(
+            dfs, total=len(file_list) if batch_size is None else None
+        ):
+            with span('db.write', rows=df.shape[0]):
+                write_s2_data_to_db(df, engine, method, n_threads, upsert, db)
+        if profile == 'bulk_load':
+            with span('db.finalize'):
+                db.finalize(engine)
+        if backend == 'sqlite':
+            with span('db.sync'):
+                _sync_sqlite(engine)
+    engine.dispose()
+    if path_metrics is not None:
+        metrics.write(path_metrics)
 
 
 if __name__ == "__main__":
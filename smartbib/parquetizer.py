@@ -5,94 +5,609 @@ import pandas as pd
 import numpy as np
 import gzip
 import os
+from itertools import islice
+from functools import lru_cache
 import pickle
+from collections import Counter, deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ProcessPoolExecutor, wait
+)
+from concurrent.futures.process import BrokenProcessPool
 from typing import Optional
 from tqdm.auto import tqdm
-from smartbib.utils import id_str_to_bytes
+import json
+from smartbib.authors import author_ids
+from smartbib.dataset import _write_partitioned_dataset
+from smartbib.dedup import _find_duplicates
+from smartbib.metrics import collect, get_metrics, profiled, span, timed
+from smartbib.schema import PARQUET_SCHEMA, S2_JSON_SCHEMA, SCHEMA_VERSION
+from smartbib.utils import atomic_path, file_hash, ids_str_to_bytes_array
 import pyarrow as pa
-from multiprocessing import Pool, cpu_count
-
-
-PARQUET_SCHEMA = pa.schema([
-    ('title', pa.string()),
-    ('paperAbstract', pa.string()),
-    (
-        'authors', pa.list_(
-            pa.struct([
-                ('id_author', pa.int32()),
-                ('name', pa.string())
-            ])
+import pyarrow.compute as pc
+import pyarrow.json as pajson
+import pyarrow.parquet as pq
+from multiprocessing import cpu_count
+
+
+# Types forced when parsing with pandas, which would otherwise infer numbers
+# from some of the strings
+_PANDAS_DTYPES = dict(journalVolume=str, journalPages=str)
+
+# Name of the manifest stored next to the parquet files
+MANIFEST_NAME = '_manifest.json'
+
+# Ratio between the memory used to process a file and its (compressed) size
+MEMORY_FACTOR = 12
+# Approximate memory used per record when a file is read in batches
+MEMORY_PER_RECORD = 20_000
+
+# Conversion of the IDs, timed on its own as one of the costliest steps
+_ids_to_bytes = timed('transform.ids')(ids_str_to_bytes_array)
+
+
+def _list_ids_str_to_bytes(series):
+    """Convert a column of lists of hashes into lists of 20-bytes IDs.
+
+    The lists are flattened, so that all the IDs are converted in a single
+    vectorized call, and rebuilt using the original offsets.
+    """
+    lists = pa.array(series, type=pa.list_(pa.string()))
+    offsets = pc.subtract(lists.offsets, lists.offsets[0])
+    values = _ids_to_bytes(lists.flatten()).cast(pa.binary())
+    return pd.Series(
+        pa.ListArray.from_arrays(offsets, values).to_pandas(),
+        index=series.index
+    )
+
+
+@timed('transform.authors')
+def _convert_authors(authors):
+    """Convert the authors of the S2 records into `(id_author, name)` pairs.
+
+    The S2 ID is only kept when the author has a single one. Otherwise, a
+    surrogate ID derived from the name is used (see `surrogate_author_ids`).
+
+    Args:
+        authors: Arrow list array of S2 authors (see `S2_JSON_SCHEMA`).
+
+    Returns:
+        pa.ListArray: Authors following `PARQUET_SCHEMA`.
+    """
+    authors_flat = authors.flatten()
+    ids = authors_flat.field('ids')
+    has_single_id = (
+        pc.list_value_length(ids).fill_null(0).to_numpy() == 1
+    )
+    # Take the first value of the lists with a single ID (null otherwise)
+    single_id = pc.list_flatten(ids).take(pa.array(
+        _list_offsets(ids).to_numpy()[:-1], mask=~has_single_id
+    ))
+    return pa.ListArray.from_arrays(
+        _list_offsets(authors),
+        pa.StructArray.from_arrays(
+            [
+                author_ids(single_id, authors_flat.field('name')),
+                authors_flat.field('name')
+            ],
+            names=['id_author', 'name']
         )
-    ),
-    ('inCitations', pa.list_(pa.binary())),
-    ('year', pa.int16()),
-    ('s2Url', pa.string()),
-    ('venue', pa.string()),
-    ('fieldsOfStudy', pa.list_(pa.string())),
-    ('id_', pa.binary())
-])
+    )
 
-def _read_json_gzip(path_file):
-    with gzip.open(path_file, 'r') as file:
-        df_data = (
-            pd.read_json(file, lines=True)
-            # Drop deprecated fields (see api.semanticscholar.org/corpus)
-            # and other unused columns
-            .drop(
-                [
-                    'entities', 's2PdfUrl', 'doi', 'doiUrl',
-                    'journalVolume', 'journalPages', 'pmid', 'magId',
-                    'sources', 'pdfUrls', 'outCitations'
-                ],
-                axis=1
-            )
-            .assign(
-                # Convert the id to bytes
-                id_=lambda df: df['id'].apply(id_str_to_bytes),
-                # Convert hash IDs into integers
-                inCitations=lambda df: df.inCitations.apply(
-                    lambda el: [id_str_to_bytes(id_str) for id_str in el]
-                ),
-                # Get use the journalName when available, otherwise, use the
-                # value from venue
-                venue=lambda df: df['journalName'].where(
-                    df['journalName'] != '', df['venue']
-                ),
-                # Convert the year to int16
-                year=lambda df: df.year.fillna(-1).astype(np.int16),
-                # Convert the authors
-                authors=lambda df: df.authors.apply(
-                    lambda list_authors: [
-                        (
-                            int(aut['ids'][0]) if len(aut['ids']) == 1 else -1,
-                            aut['name']
-                        )
-                        for aut in list_authors
-                    ]
-                )
+
+@timed('transform')
+def _process_s2_frame(df):
+    """Transform a dataframe of raw S2 records into the parquet layout.
+
+    Args:
+        df: Pandas dataframe read from the Semantic Scholar JSON lines.
+
+    Returns:
+        pd.DataFrame: Dataframe indexed by `id_` following `PARQUET_SCHEMA`.
+    """
+    return (
+        # Drop deprecated fields (see api.semanticscholar.org/corpus)
+        # and other unused columns
+        df.drop(
+            [
+                'entities', 's2PdfUrl', 'doi', 'doiUrl',
+                'pmid', 'magId', 'sources', 'outCitations'
+            ],
+            axis=1
+        )
+        .assign(
+            # Convert the id to bytes
+            id_=lambda df: _ids_to_bytes(
+                df['id']
+            ).to_numpy(zero_copy_only=False),
+            # Convert hash IDs into bytes
+            inCitations=lambda df: _list_ids_str_to_bytes(df.inCitations),
+            # Get use the journalName when available, otherwise, use the
+            # value from venue
+            venue=lambda df: df['journalName'].where(
+                df['journalName'] != '', df['venue']
+            ),
+            # Convert the year to int16
+            year=lambda df: df.year.fillna(-1).astype(np.int16),
+            # Convert the authors
+            authors=lambda df: pd.Series(
+                _convert_authors(pa.array(
+                    df.authors, S2_JSON_SCHEMA.field('authors').type
+                )).to_pandas(),
+                index=df.index
             )
-            .drop(['id', 'journalName'], axis=1)
-            # Use the id column as index
-            .set_index(['id_'])
         )
+        .drop(['id', 'journalName'], axis=1)
+        # Use the id column as index
+        .set_index(['id_'])
+    )
+
+
+def _read_json_gzip(path_file):
+    with gzip.open(path_file, 'r') as file:
+        # Decompression is included in the parsing
+        with span('parse', path_file) as current:
+            df_data = pd.read_json(file, lines=True, dtype=_PANDAS_DTYPES)
+            current.rows = len(df_data)
+        df_data = _process_s2_frame(df_data)
         logger.debug(f"File loaded: '{path_file}'")
     return df_data
 
 
-def store_parquet(df, path_file, output_folder=None):
+def _iter_json_gzip(path_file, batch_size: int = 100_000):
+    """Read a gzip file from S2 in batches of records.
+
+    Only `batch_size` records are decompressed and parsed at a time, so the
+    memory used does not depend on the size of the file.
+
+    Args:
+        path_file: Path to the gzip file.
+        batch_size: Number of records (lines) per batch.
+
+    Yields:
+        pd.DataFrame: Batch of papers following `PARQUET_SCHEMA`.
+    """
+    with gzip.open(path_file, 'r') as file:
+        with pd.read_json(
+            file, lines=True, chunksize=batch_size, dtype=_PANDAS_DTYPES
+        ) as reader:
+            while True:
+                with span('parse', path_file) as current:
+                    df_batch = next(reader, None)
+                    if df_batch is not None:
+                        current.rows = len(df_batch)
+                if df_batch is None:
+                    break
+                yield _process_s2_frame(df_batch)
+    logger.debug(f"File loaded: '{path_file}'")
+
+
+def _list_offsets(lists):
+    """Offsets of a list array, starting at zero."""
+    offsets = lists.offsets
+    return pc.subtract(offsets, offsets[0])
+
+
+@timed('transform')
+def _process_s2_table(table):
+    """Transform a table of raw S2 records into the parquet layout.
+
+    Arrow counterpart of `_process_s2_frame`. Every column is transformed
+    using compute kernels over the flattened values and the list offsets, so
+    no Python objects are created.
+
+    Args:
+        table: Arrow table read from the Semantic Scholar JSON lines, following
+            `S2_JSON_SCHEMA`.
+
+    Returns:
+        pa.Table: Table following `PARQUET_SCHEMA`.
+    """
+    table = table.combine_chunks()
+    column = {name: table.column(name).chunk(0) for name in table.column_names}
+    # Convert hash IDs into bytes
+    in_citations = column['inCitations']
+    in_citations = pa.ListArray.from_arrays(
+        _list_offsets(in_citations),
+        _ids_to_bytes(in_citations.flatten()).cast(pa.binary())
+    )
+    # Get use the journalName when available, otherwise, use the value from
+    # venue
+    journal_name = column['journalName']
+    venue = pc.if_else(
+        pc.fill_null(pc.not_equal(journal_name, ''), False),
+        journal_name, column['venue']
+    )
+    return pa.Table.from_arrays(
+        [
+            column['title'],
+            column['paperAbstract'],
+            _convert_authors(column['authors']),
+            in_citations,
+            # Convert the year to int16
+            pc.fill_null(column['year'], -1).cast(pa.int16()),
+            column['s2Url'],
+            venue,
+            column['journalVolume'],
+            column['journalPages'],
+            column['pdfUrls'],
+            column['fieldsOfStudy'],
+            # Convert the id to bytes
+            _ids_to_bytes(column['id']).cast(pa.binary()),
+        ],
+        schema=PARQUET_SCHEMA
+    )
+
+
+@timed('parse')
+def _read_json_arrow(source):
+    return pajson.read_json(
+        source,
+        parse_options=pajson.ParseOptions(
+            explicit_schema=S2_JSON_SCHEMA,
+            unexpected_field_behavior='ignore'
+        )
+    )
+
+
+def _iter_gzip_chunks(path_file, batch_size: Optional[int] = None):
+    """Decompress a gzip file from S2, `batch_size` lines at a time.
+
+    Args:
+        path_file: Path to the gzip file.
+        batch_size (optional): Number of records (lines) per chunk. If not
+            set, the whole file is returned as a single chunk.
+
+    Yields:
+        bytes: Chunk of JSON lines.
+    """
+    with gzip.open(path_file, 'rb') as file:
+        while True:
+            with span('decompress', path_file) as current:
+                if batch_size is None:
+                    chunk = file.read()
+                else:
+                    lines = list(islice(file, batch_size))
+                    chunk = b''.join(lines)
+                current.n_bytes = len(chunk)
+            if not chunk:
+                break
+            yield chunk
+    logger.debug(f"File loaded: '{path_file}'")
+
+
+def _parse_s2_chunk(chunk):
+    """Parse a chunk of JSON lines into a table following `PARQUET_SCHEMA`."""
+    return _process_s2_table(_read_json_arrow(pa.BufferReader(chunk)))
+
+
+def _iter_json_gzip_arrow(path_file, batch_size: Optional[int] = None):
+    """Read a gzip file from S2 using the arrow engine.
+
+    Args:
+        path_file: Path to the gzip file.
+        batch_size (optional): Number of records (lines) per batch. If not
+            set, the whole file is read as a single batch.
+
+    Yields:
+        pa.Table: Batch of papers following `PARQUET_SCHEMA`.
+    """
+    for chunk in _iter_gzip_chunks(path_file, batch_size):
+        yield _parse_s2_chunk(chunk)
+
+
+def _get_parquet_path(path_file, output_folder=None):
     if output_folder is None:
         output_folder = os.path.dirname(path_file)
     path_file = path_file[:-3] if path_file.endswith('.gz') else path_file
     path_file = os.path.basename(path_file)
-    path_parquet = os.path.join(output_folder, path_file + '.parquet')
-    df.to_parquet(path_parquet, engine='pyarrow', schema=PARQUET_SCHEMA)
+    return os.path.join(output_folder, path_file + '.parquet')
+
+
+@lru_cache(maxsize=None)
+def _pandas_metadata():
+    """Pandas metadata of a dataframe following `PARQUET_SCHEMA`.
+
+    Attached to tables built by the arrow engine, so that they are read back
+    by pandas exactly like the ones written from dataframes.
+    """
+    df = PARQUET_SCHEMA.empty_table().to_pandas().set_index('id_')
+    return pa.Table.from_pandas(df, schema=PARQUET_SCHEMA).schema.metadata
+
+
+def store_parquet(df, path_file, output_folder=None):
+    path_parquet = _get_parquet_path(path_file, output_folder)
+    with atomic_path(path_parquet) as path_tmp:
+        with span('write_parquet', path_file, df.shape[0]) as current:
+            table = pa.Table.from_pandas(df, schema=PARQUET_SCHEMA)
+            current.n_bytes = table.nbytes
+            pq.write_table(table, path_tmp)
+    logger.debug(f"File stored as parquet: '{path_parquet}'")
+    return df.shape[0]
+
+
+def store_parquet_batches(batches, path_file, output_folder=None):
+    """Store batches of papers in a single parquet file.
+
+    Each batch is written as a row group, so only one batch has to be kept in
+    memory at a time.
+
+    Args:
+        batches: Iterable of dataframes (indexed by `id_`) or Arrow tables
+            following `PARQUET_SCHEMA`.
+        path_file: Path to the original gzip file.
+        output_folder (optional): In case you want to store the parquet file
+            in a different location.
+
+    Returns:
+        int: Number of rows written.
+    """
+    path_parquet = _get_parquet_path(path_file, output_folder)
+    num_rows = 0
+    with atomic_path(path_parquet) as path_tmp:
+        writer = None
+        try:
+            for batch in batches:
+                with span('write_parquet', path_file, len(batch)) as current:
+                    if isinstance(batch, pd.DataFrame):
+                        table = pa.Table.from_pandas(
+                            batch, schema=PARQUET_SCHEMA
+                        )
+                    else:
+                        table = batch.replace_schema_metadata(
+                            _pandas_metadata()
+                        )
+                    current.n_bytes = table.nbytes
+                    if writer is None:
+                        # The schema of the first batch carries the pandas
+                        # metadata, used to restore `id_` as the index when
+                        # reading the file
+                        writer = pq.ParquetWriter(path_tmp, table.schema)
+                    writer.write_table(table)
+                num_rows += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            pq.write_table(PARQUET_SCHEMA.empty_table(), path_tmp)
     logger.debug(f"File stored as parquet: '{path_parquet}'")
+    return num_rows
+
+
+def _process_file(
+    file_path, output_folder=None, batch_size=None, engine='pandas',
+    profile_shard=None
+):
+    """Convert a single S2 gzip file into a parquet file.
+
+    When `file_path` is `profile_shard`, the conversion is profiled and the
+    stats are stored next to the parquet file (with the `.pstats` extension).
+
+    Returns:
+        Dict: Manifest entry of the file, with the metrics of the conversion
+            (see `metrics.Metrics.snapshot`) under 'metrics'.
+    """
+    stat = os.stat(file_path)
+    path_parquet = _get_parquet_path(file_path, output_folder)
+    path_stats = None
+    if (
+        profile_shard is not None
+        and os.path.abspath(file_path) == os.path.abspath(profile_shard)
+    ):
+        path_stats = os.path.splitext(path_parquet)[0] + '.pstats'
+    with collect() as metrics, profiled(path_stats):
+        with span('file', file_path, n_bytes=stat.st_size) as current:
+            if engine == 'arrow':
+                num_rows = store_parquet_batches(
+                    _iter_json_gzip_arrow(file_path, batch_size),
+                    file_path, output_folder
+                )
+            elif batch_size is None:
+                df = _read_json_gzip(file_path)
+                num_rows = store_parquet(df, file_path, output_folder)
+            else:
+                num_rows = store_parquet_batches(
+                    _iter_json_gzip(file_path, batch_size), file_path,
+                    output_folder
+                )
+            current.rows = num_rows
+    return dict(
+        size=stat.st_size,
+        mtime=stat.st_mtime,
+        hash=file_hash(file_path),
+        output=os.path.abspath(path_parquet),
+        num_rows=num_rows,
+        schema_version=SCHEMA_VERSION,
+        metrics=metrics.snapshot(),
+    )
+
+
+def _get_manifest_path(path_file, output_folder=None):
+    """Path to the manifest registering the parquet file of `path_file`.
+
+    Each output folder has its own manifest, stored next to the parquet
+    files (patterns can match files in several folders).
+    """
+    path_parquet = os.path.abspath(_get_parquet_path(path_file, output_folder))
+    return os.path.join(os.path.dirname(path_parquet), MANIFEST_NAME)
+
+
+def _load_manifest(path_manifest):
+    if not os.path.exists(path_manifest):
+        return {}
+    with open(path_manifest, 'r') as file:
+        return json.load(file)
+
+
+def _store_manifest(manifest, path_manifest):
+    with atomic_path(path_manifest) as path_tmp:
+        with open(path_tmp, 'w') as file:
+            json.dump(manifest, file, indent=2, sort_keys=True)
+
+
+def _is_up_to_date(file_path, entry):
+    """Check if the parquet file registered in the manifest is up to date.
+
+    The content hash is only computed when the size matches but the
+    modification time does not (e.g., when a file is downloaded again). In
+    that case, the modification time of the entry is refreshed.
+    """
+    if (
+        entry is None
+        or entry['schema_version'] != SCHEMA_VERSION
+        or not os.path.exists(entry['output'])
+    ):
+        return False
+    stat = os.stat(file_path)
+    if stat.st_size != entry['size']:
+        return False
+    if stat.st_mtime != entry['mtime']:
+        if file_hash(file_path) != entry['hash']:
+            return False
+        entry['mtime'] = stat.st_mtime
+    return True
+
+
+def _estimate_memory(file_size, batch_size=None):
+    """Estimate the peak memory (in bytes) used to process a file."""
+    memory = file_size * MEMORY_FACTOR
+    if batch_size is not None:
+        memory = min(memory, batch_size * MEMORY_PER_RECORD)
+    return memory
+
+
+def _run_jobs(
+    file_list, job_kwargs, n_jobs=1, max_memory=None, max_retries=1,
+    on_success=None
+):
+    """Process a list of files, isolating the errors of each one.
+
+    Files are scheduled from the largest to the smallest, so that big files
+    do not end up running alone at the end. A new file only starts when its
+    estimated memory fits in `max_memory`, given the files already running
+    (at least one file always runs). Files that fail are retried up to
+    `max_retries` times.
+
+    When a worker dies (e.g., killed by the OOM killer), every file in the
+    pool fails, so the file responsible is unknown. These files are then
+    processed one at a time, and only the attempts made alone are counted.
+
+    Args:
+        file_list: List of paths to the gzip files.
+        job_kwargs: Keyword arguments passed to `_process_file`.
+        n_jobs: Number of worker processes.
+        max_memory (optional): Memory budget, in bytes, shared by the files
+            processed concurrently.
+        max_retries: Number of times a file is retried after failing.
+        on_success (optional): Function called in the main process with the
+            path and the result of each file processed successfully.
+
+    Returns:
+        Dict[str, str]: Error message of each file that could not be
+            processed.
+    """
+    sizes = {path: os.path.getsize(path) for path in file_list}
+    pending = deque(sorted(file_list, key=sizes.get, reverse=True))
+    attempts = Counter()
+    failures = {}
+    # Files running when a worker died, to be processed one at a time
+    suspects = deque()
+    pbar = tqdm(total=len(pending))
+
+    def handle_error(path, exc):
+        attempts[path] += 1
+        if attempts[path] <= max_retries:
+            logger.warning(f"Retrying '{path}' after error: {exc!r}")
+            pending.append(path)
+        else:
+            failures[path] = repr(exc)
+            pbar.update()
+
+    if n_jobs == 1:
+        while pending:
+            path = pending.popleft()
+            try:
+                result = _process_file(path, **job_kwargs)
+            except Exception as exc:
+                handle_error(path, exc)
+            else:
+                if on_success is not None:
+                    on_success(path, result)
+                pbar.update()
+    else:
+        running = {}
+        executor = ProcessPoolExecutor(n_jobs)
+        try:
+            while pending or running or suspects:
+                memory_used = sum(memory for _, memory in running.values())
+                if suspects and not running:
+                    path = suspects.popleft()
+                    future = executor.submit(_process_file, path, **job_kwargs)
+                    running[future] = (path, 0)
+                while not suspects and pending and len(running) < n_jobs:
+                    memory = _estimate_memory(
+                        sizes[pending[0]], job_kwargs.get('batch_size')
+                    )
+                    if (
+                        running and max_memory is not None
+                        and memory_used + memory > max_memory
+                    ):
+                        break
+                    path = pending.popleft()
+                    future = executor.submit(_process_file, path, **job_kwargs)
+                    running[future] = (path, memory)
+                    memory_used += memory
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = []
+                for future in done:
+                    path, _ = running.pop(future)
+                    exc = future.exception()
+                    if exc is None:
+                        if on_success is not None:
+                            on_success(path, future.result())
+                        pbar.update()
+                    elif isinstance(exc, BrokenProcessPool):
+                        broken.append(path)
+                    else:
+                        handle_error(path, exc)
+                if broken:
+                    # A worker died, which makes every file in the pool fail
+                    broken += [path for path, _ in running.values()]
+                    running = {}
+                    if len(broken) == 1:
+                        handle_error(broken[0], BrokenProcessPool(broken[0]))
+                    else:
+                        logger.warning(
+                            f"A worker died while processing {broken}. "
+                            "Retrying them one at a time"
+                        )
+                        suspects.extend(broken)
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(n_jobs)
+        finally:
+            executor.shutdown()
+    pbar.close()
+    for path, error in failures.items():
+        logger.error(f"Failed to process '{path}': {error}")
+    logger.info(
+        f"{len(file_list) - len(failures)} files processed, "
+        f"{len(failures)} failed"
+    )
+    return failures
 
 
 def generate_parquet_files(
     input_path_pattern: str,
     output_folder: Optional[str] = None,
     n_jobs: int = 1,
+    batch_size: Optional[int] = None,
+    engine: str = 'pandas',
+    max_memory: Optional[float] = None,
+    max_retries: int = 1,
+    force: bool = False,
+    path_duplicates: Optional[str] = None,
+    dataset_folder: Optional[str] = None,
+    path_metrics: Optional[str] = None,
+    profile_shard: Optional[str] = None,
 ):
     """Process Semantic Scholar files in a folder.
 
@@ -115,29 +630,124 @@ def generate_parquet_files(
         python -m recsearch.parquetizer destinationPath/s2-corpus*.gz
     ```
 
+    The files converted are registered in a manifest (`_manifest.json`)
+    stored next to the parquet files, so that running the command again only
+    processes new or modified files (e.g., after a crash or a new release).
+
     Args:
         input_path_pattern: Pattern to the files. It uses glob-like patterns.
         output_folder (optional): In case you want to store the parquet files
             in a different location.
-        n_jobs: Number of jobs to run in parallel.
+        n_jobs: Number of jobs to run in parallel. Use -1 to use all the
+            CPUs.
+        batch_size (optional): Number of records read at a time. When set,
+            each file is streamed and written in row groups of `batch_size`
+            records, so memory stays bounded regardless of the file size.
+            Otherwise, each file is loaded in a single pass.
+        engine: Library used to parse and transform the records. Either
+            'pandas' or 'arrow'. The latter uses `pyarrow.json` and compute
+            kernels, without creating Python objects for the records.
+        max_memory (optional): Memory budget in bytes (e.g., 16e9). Limits
+            the number of files decompressed concurrently, based on their
+            sizes, in addition to `n_jobs`.
+        max_retries: Number of times a file is retried after failing.
+        force: Process every file, even the ones registered as up to date in
+            the manifest.
+        path_duplicates (optional): If set, near-duplicate papers are
+            searched in all the parquet files (see `dedup.find_duplicates`)
+            after the conversion, and stored in this parquet file.
+        dataset_folder (optional): If set, all the parquet files are also
+            written to this folder as a partitioned dataset, sorted by `id_`
+            (see `dataset.write_partitioned_dataset`).
+        path_metrics (optional): Path to a JSON file where the time, rows
+            and bytes of each stage (and file) of the run are stored. The
+            same metrics are written in the Prometheus text format to a file
+            with the `.prom` extension (see `metrics.Metrics.write`).
+        profile_shard (optional): Path to a gzip file whose conversion is
+            profiled with cProfile (even if it is up to date). The stats are
+            stored next to its parquet file, with the `.pstats` extension.
+
+    Returns:
+        Dict[str, str]: Error message of each file that could not be
+            processed.
     """
+    with collect(sample_interval=1.) as metrics:
+        failures = _generate_parquet_files(
+            input_path_pattern, output_folder, n_jobs, batch_size, engine,
+            max_memory, max_retries, force, path_duplicates, dataset_folder,
+            profile_shard
+        )
+    if path_metrics is not None:
+        metrics.write(path_metrics)
+    return failures
+
+
+def _generate_parquet_files(
+    input_path_pattern, output_folder, n_jobs, batch_size, engine,
+    max_memory, max_retries, force, path_duplicates, dataset_folder,
+    profile_shard
+):
+    assert engine in ('pandas', 'arrow'), f"Unknown engine '{engine}'"
     file_list = glob(input_path_pattern)
+    all_files = file_list
     logger.debug(
         f"Loading files from '{input_path_pattern}'. "
         f"{len(file_list)} files found"
     )
-    if n_jobs != 1:
-        assert n_jobs > 0 or n_jobs == -1, 'Inconsistent n_jobs'
-        n_jobs = cpu_count() if n_jobs == -1 else n_jobs
-        with Pool(n_jobs) as p:
-            p.map(
-                _process_file,
-                zip(file_list, [output_folder] * len(file_list))
+    assert n_jobs > 0 or n_jobs == -1, 'Inconsistent n_jobs'
+    n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+
+    # The manifests keep track of the files already converted, so that only
+    # new or modified files are processed when running again
+    manifests = {}
+
+    def get_manifest(path):
+        path_manifest = _get_manifest_path(path, output_folder)
+        if path_manifest not in manifests:
+            manifests[path_manifest] = _load_manifest(path_manifest)
+        return path_manifest, manifests[path_manifest]
+
+    if not force:
+        file_list = [
+            path for path in file_list
+            if not _is_up_to_date(
+                path, get_manifest(path)[1].get(os.path.abspath(path))
             )
-    else:
-        for file_path in tqdm(file_list):
-            df = _read_json_gzip(file_path)
-            store_parquet(df, file_path, output_folder)
+        ]
+        logger.debug(f"{len(file_list)} files are new or modified")
+    if profile_shard is not None and profile_shard not in file_list:
+        file_list.append(profile_shard)
+    # Store the refreshed modification times
+    for path_manifest, manifest in manifests.items():
+        _store_manifest(manifest, path_manifest)
+
+    def update_manifest(path, entry):
+        get_metrics().merge(entry.pop('metrics'))
+        path_manifest, manifest = get_manifest(path)
+        manifest[os.path.abspath(path)] = entry
+        _store_manifest(manifest, path_manifest)
+
+    failures = _run_jobs(
+        file_list,
+        dict(
+            output_folder=output_folder, batch_size=batch_size,
+            engine=engine, profile_shard=profile_shard
+        ),
+        n_jobs=n_jobs, max_memory=max_memory, max_retries=max_retries,
+        on_success=update_manifest
+    )
+    parquet_files = [
+        _get_parquet_path(path, output_folder)
+        for path in sorted(all_files) if path not in failures
+    ]
+    parquet_files = [path for path in parquet_files if os.path.exists(path)]
+    if path_duplicates is not None:
+        with span('dedup'):
+            _find_duplicates(parquet_files, path_duplicates, n_jobs=n_jobs)
+    if dataset_folder is not None:
+        with span('dataset'):
+            _write_partitioned_dataset(parquet_files, dataset_folder)
+    return failures
 
 
 if __name__ == "__main__":
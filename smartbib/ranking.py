@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from typing import Optional
+import fire
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from smartbib.graph import CitationGraph
+from smartbib.utils import iter_parquet_batches
+
+
+def _segment_sum(values, indptr):
+    """Sum the values of each segment `values[indptr[i]:indptr[i + 1]]`."""
+    offsets = indptr - indptr[0]
+    starts = offsets[:-1]
+    # The extra zero keeps the starts of trailing empty segments valid
+    sums = np.add.reduceat(np.append(values, 0.), starts)
+    sums[starts == offsets[1:]] = 0.
+    return sums
+
+
+def _spmv(graph, weights, n_threads=1, block_size=1_000_000):
+    """Sum the weights of the citers of each node.
+
+    Computes the product between the adjacency matrix given by the `in_*`
+    arrays of the graph and the vector `weights`. With `n_threads > 1`, the
+    nodes are split in blocks processed in parallel (NumPy releases the GIL
+    in the gather and reduce kernels).
+    """
+    def block_product(start):
+        end = min(start + block_size, graph.n_nodes)
+        indptr = graph.in_indptr[start:end + 1]
+        citers = graph.in_indices[indptr[0]:indptr[-1]]
+        return _segment_sum(weights.take(citers), indptr)
+
+    starts = range(0, graph.n_nodes, block_size)
+    if n_threads > 1:
+        with ThreadPoolExecutor(n_threads) as executor:
+            blocks = list(executor.map(block_product, starts))
+    else:
+        blocks = [block_product(start) for start in starts]
+    return np.concatenate(blocks) if blocks else np.empty(0)
+
+
+def pagerank(
+    graph: CitationGraph,
+    damping: float = 0.85,
+    tol: float = 1e-6,
+    max_iter: int = 100,
+    n_threads: int = 1,
+) -> np.ndarray:
+    """Compute the PageRank of the papers in the citation graph.
+
+    Each paper distributes its rank among the papers it cites. The rank of
+    papers without references (dangling nodes) is distributed uniformly
+    over all the papers.
+
+    Args:
+        graph: Citation graph.
+        damping: Probability of following a citation.
+        tol: The iterations stop when the L1 norm of the change in the ranks
+            is smaller than `tol`.
+        max_iter: Maximum number of iterations.
+        n_threads: Number of threads used in the sparse matrix-vector
+            products.
+
+    Returns:
+        np.ndarray: PageRank of each node (summing to one).
+    """
+    n_nodes = graph.n_nodes
+    if not n_nodes:
+        return np.empty(0)
+    out_degree = graph.out_degree()
+    dangling = out_degree == 0
+    inv_out_degree = np.zeros(n_nodes)
+    np.divide(1., out_degree, out=inv_out_degree, where=~dangling)
+    ranks = np.full(n_nodes, 1. / n_nodes)
+    for i in range(max_iter):
+        dangling_mass = ranks[dangling].sum()
+        new_ranks = damping * _spmv(graph, ranks * inv_out_degree, n_threads)
+        new_ranks += (1. - damping + damping * dangling_mass) / n_nodes
+        error = np.abs(new_ranks - ranks).sum()
+        ranks = new_ranks
+        logger.debug(f"PageRank iteration {i + 1}: error {error:.3e}")
+        if error < tol:
+            break
+    else:
+        logger.warning(f"PageRank did not converge in {max_iter} iterations")
+    return ranks
+
+
+def citation_score(
+    graph: CitationGraph,
+    years: np.ndarray,
+    half_life: Optional[float] = 10.,
+    current_year: Optional[int] = None,
+    n_threads: int = 1,
+) -> np.ndarray:
+    """Compute the number of citations of each paper, weighted by their age.
+
+    A citation made `age` years ago weighs `0.5 ** (age / half_life)`.
+    Citations from papers without year (-1) weigh 1.
+
+    Args:
+        graph: Citation graph.
+        years: Year of each node (see `node_years`).
+        half_life (optional): Age, in years, at which a citation counts half.
+            If None, all the citations weigh 1 (plain citation count).
+        current_year (optional): Year used to compute the ages. By default,
+            the most recent year in `years`.
+        n_threads: Number of threads used in the sparse matrix-vector
+            product.
+
+    Returns:
+        np.ndarray: Score of each node.
+    """
+    weights = np.ones(graph.n_nodes)
+    known_year = years >= 0
+    if half_life is not None and known_year.any():
+        if current_year is None:
+            current_year = years[known_year].max()
+        age = np.maximum(current_year - years[known_year], 0)
+        weights[known_year] = 0.5 ** (age / half_life)
+    return _spmv(graph, weights, n_threads)
+
+
+def node_years(graph: CitationGraph, path_pattern: str) -> np.ndarray:
+    """Read the year of each node of the graph from parquet files.
+
+    Args:
+        graph: Citation graph.
+        path_pattern: Glob-like pattern for the parquet files.
+
+    Returns:
+        np.ndarray: Year (int16) of each node, or -1 when unknown.
+    """
+    years = np.full(graph.n_nodes, -1, dtype=np.int16)
+    file_list = sorted(glob(path_pattern))
+    for batch in iter_parquet_batches(file_list, ['id_', 'year']):
+        nodes = graph.node_index(batch.column('id_'))
+        found = nodes >= 0
+        batch_years = batch.column('year').fill_null(-1).to_numpy()
+        years[nodes[found]] = batch_years[found]
+    return years
+
+
+def store_scores(path_parquet: str, graph: CitationGraph, **scores):
+    """Store scores of the nodes in a parquet file keyed by `id_`.
+
+    Args:
+        path_parquet: Path to the output file.
+        graph: Citation graph.
+        **scores: Arrays with the score of each node, stored as columns.
+    """
+    id_bytes = np.ascontiguousarray(graph.ids).view(np.uint8)
+    ids = pa.FixedSizeBinaryArray.from_buffers(
+        pa.binary(20), graph.n_nodes, [None, pa.py_buffer(id_bytes)]
+    ).cast(pa.binary())
+    table = pa.table(dict(id_=ids, **{
+        name: pa.array(values) for name, values in scores.items()
+    }))
+    pq.write_table(table, path_parquet)
+    logger.debug(f"Scores stored as parquet: '{path_parquet}'")
+
+
+def compute_scores(
+    input_path_pattern: str,
+    path_output: str,
+    path_graph: Optional[str] = None,
+    damping: float = 0.85,
+    tol: float = 1e-6,
+    max_iter: int = 100,
+    half_life: float = 10.,
+    n_threads: int = 1,
+):
+    """Compute importance scores for the papers in the parquet files.
+
+    The scores (`pagerank` and `citation_score`) are stored in a parquet file
+    keyed by `id_`.
+
+    Args:
+        input_path_pattern: Glob-like pattern for the parquet files.
+        path_output: Path to the output parquet file.
+        path_graph (optional): Folder with a graph stored by
+            `CitationGraph.save`. If not set, the graph is built from the
+            parquet files.
+        damping: Damping factor of the PageRank.
+        tol: Convergence tolerance of the PageRank.
+        max_iter: Maximum number of PageRank iterations.
+        half_life: Half-life, in years, of the citations in `citation_score`.
+        n_threads: Number of threads used in the sparse products.
+    """
+    if path_graph is None:
+        graph = CitationGraph.from_parquet(input_path_pattern)
+    else:
+        graph = CitationGraph.load(path_graph)
+    years = node_years(graph, input_path_pattern)
+    store_scores(
+        path_output, graph,
+        pagerank=pagerank(graph, damping, tol, max_iter, n_threads),
+        citation_score=citation_score(
+            graph, years, half_life, n_threads=n_threads
+        ),
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(compute_scores)
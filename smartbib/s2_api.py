@@ -0,0 +1,584 @@
+import asyncio
+import gzip
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterable, List, Optional, Union
+from urllib.parse import quote, urlencode, urljoin, urlsplit
+import fire
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from tqdm.auto import tqdm
+from smartbib.parquetizer import (
+    PARQUET_SCHEMA, S2_JSON_SCHEMA, _pandas_metadata, _process_s2_table
+)
+from smartbib.utils import atomic_path
+
+# Base URL of the Semantic Scholar Academic Graph API
+S2_API_URL = 'https://api.semanticscholar.org/graph/v1'
+# Fields of the papers requested to the API
+PAPER_FIELDS = (
+    'paperId', 'title', 'abstract', 'year', 'venue', 'journal', 'url',
+    'authors', 'fieldsOfStudy', 'citationCount'
+)
+# Status codes of the responses that are retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Status codes of the redirections followed by the client
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+# Maximum number of redirections followed by a request
+MAX_REDIRECTS = 5
+
+
+class TokenBucket:
+    """Token bucket rate limiter for coroutines.
+
+    Tokens are added at `rate` tokens per second, up to `capacity` tokens,
+    and each request consumes one token.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        """Create a bucket, initially full.
+
+        Args:
+            rate: Number of tokens added per second.
+            capacity: Maximum number of tokens (i.e., the size of a burst).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and consume it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class HTTPError(Exception):
+    """Response with an unexpected status code."""
+
+    def __init__(self, status: int, body: bytes) -> None:
+        super().__init__(f"HTTP {status}: {body[:200]!r}")
+        self.status = status
+
+
+def _retry_after(value: str, default: float) -> float:
+    """Seconds to wait before a retry, given a `Retry-After` header.
+
+    The header holds either a number of seconds or an HTTP date. The
+    `default` delay is used when it is neither.
+    """
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.)
+
+
+class _ConnectionPool:
+    """Pool of persistent HTTP/1.1 connections to a single host.
+
+    Uses the asyncio streams, so no HTTP library is required. Responses are
+    read using their `Content-Length`, chunked transfer encoding or, when
+    neither is set, until the server closes the connection. They are
+    decompressed when gzip encoded. Redirections are followed, using a new
+    pool when they point to another host.
+    """
+
+    def __init__(self, url, max_connections=10, timeout=30.):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.ssl = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(max_connections)
+
+    @property
+    def origin(self):
+        return f'{self.scheme}://{self.host}:{self.port}'
+
+    async def _open(self):
+        return await asyncio.open_connection(
+            self.host, self.port, ssl=self.ssl or None
+        )
+
+    async def _send(self, connection, target, headers):
+        """Send a request and read its response.
+
+        Returns:
+            Tuple[int, Dict[str, str], bytes, bool]: The status, headers,
+                body and whether the connection can be reused.
+        """
+        reader, writer = connection
+        lines = [
+            f'GET {target} HTTP/1.1',
+            f'Host: {self.host}',
+            'Accept: application/json',
+            'Accept-Encoding: gzip',
+            *[f'{name}: {value}' for name, value in headers.items()],
+        ]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+        status_line = await reader.readuntil(b'\r\n')
+        version, status = status_line.split()[:2]
+        status = int(status)
+        response_headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        connection_header = response_headers.get('connection', '').lower()
+        reusable = (
+            connection_header != 'close'
+            and (version == b'HTTP/1.1' or connection_header == 'keep-alive')
+        )
+        if status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif response_headers.get('transfer-encoding', '') == 'chunked':
+            chunks = []
+            while True:
+                size_line = await reader.readuntil(b'\r\n')
+                size = int(size_line.split(b';')[0], 16)
+                if not size:
+                    # Skip the trailers
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            body = await reader.readexactly(
+                int(response_headers['content-length'])
+            )
+        else:
+            # The body ends when the server closes the connection
+            body = await reader.read()
+            reusable = False
+        if response_headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return status, response_headers, body, reusable
+
+    async def _request(self, target, headers):
+        async with self._semaphore:
+            while True:
+                reused = bool(self._idle)
+                connection = self._idle.pop() if reused else await self._open()
+                try:
+                    *response, reusable = await asyncio.wait_for(
+                        self._send(connection, target, headers),
+                        self.timeout
+                    )
+                except (OSError, asyncio.IncompleteReadError):
+                    connection[1].close()
+                    # The server may have closed an idle connection
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    connection[1].close()
+                    raise
+                if reusable:
+                    self._idle.append(connection)
+                else:
+                    connection[1].close()
+                return response
+
+    async def get(self, path, headers=None):
+        """Send a GET request, reusing an idle connection when possible.
+
+        Args:
+            path: Path (and query) of the request, relative to the URL of the
+                pool.
+            headers (optional): Headers of the request.
+
+        Returns:
+            Tuple[int, Dict[str, str], bytes]: The status, headers (with
+                lowercase names) and body of the response.
+        """
+        headers = headers or {}
+        pool, target = self, f'{self.base_path}{path}'
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                status, response_headers, body = await pool._request(
+                    target, headers
+                )
+                location = response_headers.get('location')
+                if status not in REDIRECT_STATUS or location is None:
+                    break
+                url = urljoin(pool.origin + target, location)
+                parts = urlsplit(url)
+                target = parts.path
+                if parts.query:
+                    target += f'?{parts.query}'
+                redirected = _ConnectionPool(
+                    url, self.max_connections, self.timeout
+                )
+                if redirected.origin != pool.origin:
+                    if pool is not self:
+                        await pool.close()
+                    pool = (
+                        self if redirected.origin == self.origin
+                        else redirected
+                    )
+            else:
+                raise HTTPError(status, b'Too many redirections')
+        finally:
+            if pool is not self:
+                await pool.close()
+        return status, response_headers, body
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+
+class S2Client:
+    """Asynchronous client of the Semantic Scholar API.
+
+    Requests share a token bucket (`rate` requests per second) and a pool of
+    persistent connections. Failed requests (connection errors, timeouts and
+    the status codes in `RETRY_STATUS`) are retried with exponential backoff,
+    honoring the `Retry-After` header.
+
+    Use it as an async context manager:
+
+    ```python
+        async with S2Client(rate=1.) as client:
+            paper = await client.get_paper(paper_id)
+    ```
+    """
+
+    def __init__(
+        self,
+        base_url: str = S2_API_URL,
+        api_key: Optional[str] = None,
+        rate: float = 1.,
+        burst: int = 1,
+        max_connections: int = 10,
+        max_retries: int = 5,
+        backoff: float = 1.,
+        timeout: float = 30.,
+    ) -> None:
+        """Create a client.
+
+        Args:
+            base_url: Base URL of the API.
+            api_key (optional): Key sent in the `x-api-key` header.
+            rate: Maximum number of requests per second.
+            burst: Maximum number of requests sent at once (capacity of the
+                token bucket).
+            max_connections: Maximum number of concurrent connections.
+            max_retries: Number of times a failed request is retried.
+            backoff: Initial waiting time, in seconds, before a retry. It
+                doubles after each retry.
+            timeout: Timeout, in seconds, of each request.
+        """
+        self.base_url = base_url
+        self.headers = {} if api_key is None else {'x-api-key': api_key}
+        self.rate = rate
+        self.burst = burst
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.n_requests = 0
+        self.n_retries = 0
+
+    async def __aenter__(self) -> 'S2Client':
+        # Created here, as they are bound to the running event loop
+        self._bucket = TokenBucket(self.rate, self.burst)
+        self._pool = _ConnectionPool(
+            self.base_url, self.max_connections, self.timeout
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._pool.close()
+
+    async def get_json(self, path: str, params: Optional[dict] = None):
+        """Send a GET request and decode its JSON response.
+
+        Args:
+            path: Path of the endpoint, relative to the base URL.
+            params (optional): Query parameters.
+
+        Returns:
+            The decoded response, or None if the resource was not found.
+        """
+        if params:
+            path = f'{path}?{urlencode(params)}'
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            self.n_requests += 1
+            delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+            try:
+                status, headers, body = await self._pool.get(
+                    path, self.headers
+                )
+            except (OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError) as exc:
+                error = exc
+            else:
+                if status == 200:
+                    return json.loads(body)
+                if status == 404:
+                    return None
+                error = HTTPError(status, body)
+                if status not in RETRY_STATUS:
+                    raise error
+                if 'retry-after' in headers:
+                    delay = _retry_after(headers['retry-after'], delay)
+            if attempt < self.max_retries:
+                logger.debug(f"Retrying '{path}' in {delay:.1f}s: {error!r}")
+                self.n_retries += 1
+                await asyncio.sleep(delay)
+        raise error
+
+    async def get_paper(
+        self, paper_id: str, fields: Iterable[str] = PAPER_FIELDS
+    ) -> Optional[dict]:
+        """Get a paper (or None if it does not exist)."""
+        return await self.get_json(
+            f'/paper/{quote(paper_id, safe=":")}',
+            dict(fields=','.join(fields))
+        )
+
+    async def get_citations(
+        self,
+        paper_id: str,
+        n_citations: Optional[int] = None,
+        page_size: int = 1_000,
+    ) -> List[str]:
+        """Get the IDs of the papers citing a paper.
+
+        When the number of citations is known, all the pages are requested
+        concurrently. Otherwise (or if there are more citations than
+        expected), the pages are followed one at a time.
+
+        Args:
+            paper_id: ID of the paper.
+            n_citations (optional): Expected number of citations (e.g., the
+                `citationCount` of the paper).
+            page_size: Number of citations per page.
+
+        Returns:
+            List[str]: IDs of the citing papers.
+        """
+        path = f'/paper/{quote(paper_id, safe=":")}/citations'
+
+        def get_page(offset):
+            return self.get_json(path, dict(
+                fields='paperId', offset=offset, limit=page_size
+            ))
+
+        offsets = range(0, max(n_citations or 0, 1), page_size)
+        pages = list(await asyncio.gather(*map(get_page, offsets)))
+        while pages[-1] is not None and 'next' in pages[-1]:
+            pages.append(await get_page(pages[-1]['next']))
+        return [
+            item['citingPaper']['paperId']
+            for page in pages if page is not None
+            for item in page.get('data', [])
+            if item['citingPaper'].get('paperId')
+        ]
+
+
+def _to_corpus_record(paper, citations):
+    """Convert a paper from the API into a record of the S2 corpus."""
+    journal = paper.get('journal') or {}
+    return dict(
+        id=paper['paperId'],
+        title=paper.get('title'),
+        paperAbstract=paper.get('abstract'),
+        authors=[
+            dict(
+                name=author.get('name'),
+                ids=[author['authorId']] if author.get('authorId') else []
+            )
+            for author in paper.get('authors') or []
+        ],
+        inCitations=citations,
+        year=paper.get('year'),
+        s2Url=paper.get('url'),
+        venue=paper.get('venue'),
+        journalName=journal.get('name'),
+        journalVolume=journal.get('volume'),
+        journalPages=journal.get('pages'),
+        fieldsOfStudy=paper.get('fieldsOfStudy') or [],
+    )
+
+
+async def ingest(
+    client: S2Client,
+    paper_ids: Iterable[str],
+    sink: Callable[[pa.Table], None],
+    n_workers: int = 10,
+    batch_size: int = 1_000,
+    page_size: int = 1_000,
+) -> int:
+    """Fetch papers and their citations, streaming them into `sink`.
+
+    `n_workers` papers are fetched concurrently. The papers are converted
+    into the parquet layout (see `PARQUET_SCHEMA`) in batches of `batch_size`
+    papers, passed to `sink` in a worker thread, so that writing a batch
+    overlaps with fetching the next ones. Papers not found are skipped.
+
+    Args:
+        client: Client used to send the requests (already entered).
+        paper_ids: IDs of the papers.
+        sink: Function receiving each batch (an Arrow table). For example,
+            `ParquetWriter.write_table`, or a function calling
+            `mysql_writer.write_s2_data_to_db` with
+            `table.to_pandas().set_index('id_')`.
+        n_workers: Number of papers fetched concurrently.
+        batch_size: Number of papers per batch.
+        page_size: Number of citations requested per page.
+
+    Returns:
+        int: Number of papers written.
+    """
+    paper_ids = iter(paper_ids)
+    records = []
+    n_papers = 0
+    loop = asyncio.get_event_loop()
+    # A single thread runs the sink, so batches are written one at a time and
+    # in order, while the workers keep fetching
+    sink_executor = ThreadPoolExecutor(1)
+    progress = tqdm(desc='Papers fetched')
+
+    def write(batch):
+        table = _process_s2_table(
+            pa.Table.from_pylist(batch, schema=S2_JSON_SCHEMA)
+        )
+        sink(table)
+        return table.num_rows
+
+    async def flush(n_min):
+        nonlocal records, n_papers
+        if len(records) < max(n_min, 1):
+            return
+        # Swapped before awaiting, so other workers fill a new buffer
+        batch, records = records, []
+        n_rows = await loop.run_in_executor(sink_executor, write, batch)
+        n_papers += n_rows
+
+    async def worker():
+        for paper_id in paper_ids:
+            paper = await client.get_paper(paper_id)
+            progress.update()
+            if paper is None:
+                logger.warning(f"Paper '{paper_id}' not found")
+                continue
+            citations = await client.get_citations(
+                paper['paperId'], paper.get('citationCount'), page_size
+            )
+            records.append(_to_corpus_record(paper, citations))
+            await flush(batch_size)
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(n_workers)])
+        await flush(1)
+    finally:
+        progress.close()
+        sink_executor.shutdown()
+    logger.debug(
+        f"{n_papers} papers ingested with {client.n_requests} requests "
+        f"({client.n_retries} retries)"
+    )
+    return n_papers
+
+
+def ingest_papers(
+    paper_ids: Union[str, List[str]],
+    path_output: str,
+    base_url: str = S2_API_URL,
+    api_key: Optional[str] = None,
+    rate: float = 1.,
+    burst: int = 1,
+    n_workers: int = 10,
+    max_connections: int = 10,
+    batch_size: int = 1_000,
+    page_size: int = 1_000,
+) -> int:
+    """Fetch papers from the Semantic Scholar API into a parquet file.
+
+    The file follows `PARQUET_SCHEMA`, like the ones created by
+    `parquetizer.generate_parquet_files`, with the `inCitations` column
+    filled using the citations endpoint.
+
+    Args:
+        paper_ids: IDs of the papers, or path to a text file with one ID per
+            line.
+        path_output: Path to the parquet file.
+        base_url: Base URL of the API (e.g., of a `s2_stub` server).
+        api_key (optional): Key of the API.
+        rate: Maximum number of requests per second.
+        burst: Maximum number of requests sent at once.
+        n_workers: Number of papers fetched concurrently.
+        max_connections: Maximum number of concurrent connections.
+        batch_size: Number of papers per row group.
+        page_size: Number of citations requested per page.
+
+    Returns:
+        int: Number of papers written.
+    """
+    if isinstance(paper_ids, str):
+        with open(paper_ids, 'r') as file:
+            paper_ids = [line.strip() for line in file if line.strip()]
+    # The pandas metadata restores `id_` as the index when reading the file
+    schema = PARQUET_SCHEMA.with_metadata(_pandas_metadata())
+    with atomic_path(path_output) as path_tmp:
+        with pq.ParquetWriter(path_tmp, schema) as writer:
+
+            async def run():
+                async with S2Client(
+                    base_url, api_key, rate, burst, max_connections
+                ) as client:
+                    return await ingest(
+                        client, paper_ids,
+                        lambda table: writer.write_table(
+                            table.replace_schema_metadata(schema.metadata)
+                        ),
+                        n_workers, batch_size, page_size
+                    )
+
+            loop = asyncio.new_event_loop()
+            try:
+                n_papers = loop.run_until_complete(run())
+            finally:
+                loop.close()
+    logger.debug(f"{n_papers} papers stored in '{path_output}'")
+    return n_papers
+
+
+if __name__ == "__main__":
+    fire.Fire(ingest_papers)
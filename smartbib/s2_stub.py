@@ -0,0 +1,237 @@
+import gzip
+import json
+import re
+import threading
+import time
+from glob import glob
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+import fire
+from loguru import logger
+
+# Routes of the API served by the stub
+_PAPER_ROUTE = re.compile(
+    r'^/paper/(?P<paper_id>[^/]+)(?P<citations>/citations)?$'
+)
+# Paths starting with this prefix are redirected to the rest of the path
+_REDIRECT_PREFIX = '/redirect'
+
+
+def fixtures_from_corpus(input_path_pattern: str, path_fixtures: str):
+    """Record fixtures for the stub server from S2 corpus files.
+
+    The papers of the gzip files are converted into the format returned by
+    the API, and their `inCitations` are served by the citations endpoint.
+
+    Args:
+        input_path_pattern: Glob-like pattern for the gzip files.
+        path_fixtures: Path to the JSON file with the fixtures.
+    """
+    papers, citations = {}, {}
+    for path_file in sorted(glob(input_path_pattern)):
+        with gzip.open(path_file, 'rt') as file:
+            for line in file:
+                record = json.loads(line)
+                papers[record['id']] = dict(
+                    paperId=record['id'],
+                    title=record.get('title'),
+                    abstract=record.get('paperAbstract'),
+                    year=record.get('year'),
+                    venue=record.get('venue'),
+                    journal=dict(
+                        name=record.get('journalName'),
+                        volume=record.get('journalVolume'),
+                        pages=record.get('journalPages'),
+                    ),
+                    url=record.get('s2Url'),
+                    authors=[
+                        dict(
+                            authorId=(author.get('ids') or [None])[0],
+                            name=author.get('name')
+                        )
+                        for author in record.get('authors', [])
+                    ],
+                    fieldsOfStudy=record.get('fieldsOfStudy'),
+                    citationCount=len(record.get('inCitations', [])),
+                )
+                citations[record['id']] = record.get('inCitations', [])
+    with open(path_fixtures, 'w') as file:
+        json.dump(dict(papers=papers, citations=citations), file)
+    logger.debug(f"Fixtures of {len(papers)} papers stored in {path_fixtures}")
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Persistent connections, as in the real API
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if self.server.close_delimited:
+            # The end of the body is given by closing the connection
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.n_requests += 1
+            n_requests = server.n_requests
+        if server.latency:
+            time.sleep(server.latency)
+        if server.error_every and n_requests % server.error_every == 0:
+            self._respond(429, dict(message='Too Many Requests'), {
+                'Retry-After': '0'
+            })
+            return
+        url = urlsplit(self.path)
+        path = url.path[len(server.prefix):]
+        if path.startswith(_REDIRECT_PREFIX):
+            location = server.prefix + path[len(_REDIRECT_PREFIX):]
+            if url.query:
+                location += f'?{url.query}'
+            self._respond(307, dict(message='Moved'), dict(Location=location))
+            return
+        match = _PAPER_ROUTE.match(path)
+        paper_id = match and unquote(match['paper_id'])
+        if not match or paper_id not in server.fixtures['papers']:
+            self._respond(404, dict(error='Paper not found'))
+            return
+        if not match['citations']:
+            self._respond(200, server.fixtures['papers'][paper_id])
+            return
+        params = parse_qs(url.query)
+        offset = int(params.get('offset', [0])[0])
+        limit = int(params.get('limit', [100])[0])
+        citers = server.fixtures['citations'].get(paper_id, [])
+        page = dict(offset=offset, data=[
+            dict(citingPaper=dict(paperId=citer))
+            for citer in citers[offset:offset + limit]
+        ])
+        if offset + limit < len(citers):
+            page['next'] = offset + limit
+        self._respond(200, page)
+
+
+class StubServer:
+    """Local HTTP server mimicking the Semantic Scholar API.
+
+    Serves the papers (`/paper/<id>`) and paginated citations
+    (`/paper/<id>/citations`) of recorded fixtures (see
+    `fixtures_from_corpus`), so that the ingestion can be tested and
+    benchmarked offline. It can also simulate latency and rate limiting.
+    Requests to `<prefix>/redirect/<path>` are redirected to
+    `<prefix>/<path>`.
+
+    Use it as a context manager, which runs the server in a background
+    thread:
+
+    ```python
+        with StubServer('fixtures.json') as server:
+            ingest_papers(paper_ids, 'papers.parquet', base_url=server.url)
+    ```
+    """
+
+    def __init__(
+        self,
+        path_fixtures: str,
+        port: int = 0,
+        latency: float = 0.,
+        error_every: int = 0,
+        prefix: str = '/graph/v1',
+        close_delimited: bool = False,
+    ) -> None:
+        """Create a server.
+
+        Args:
+            path_fixtures: Path to the JSON file with the fixtures.
+            port: Port of the server. Use 0 to pick a free port.
+            latency: Time, in seconds, taken to answer each request.
+            error_every (optional): If positive, every `error_every`-th
+                request is answered with HTTP 429 (Too Many Requests).
+            prefix: Prefix of the paths of the API.
+            close_delimited: Whether responses are sent without
+                `Content-Length`, closing the connection after the body.
+        """
+        self.server = _ThreadingHTTPServer(('127.0.0.1', port), _StubHandler)
+        with open(path_fixtures, 'r') as file:
+            self.server.fixtures = json.load(file)
+        self.server.latency = latency
+        self.server.error_every = error_every
+        self.server.prefix = prefix
+        self.server.close_delimited = close_delimited
+        self.server.lock = threading.Lock()
+        self.server.n_requests = 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}{self.server.prefix}'
+
+    @property
+    def n_requests(self) -> int:
+        return self.server.n_requests
+
+    def __enter__(self) -> 'StubServer':
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+
+def serve(
+    path_fixtures: str,
+    port: int = 8000,
+    latency: float = 0.,
+    error_every: int = 0,
+    path_corpus: Optional[str] = None,
+):
+    """Run the stub server until interrupted.
+
+    Args:
+        path_fixtures: Path to the JSON file with the fixtures.
+        port: Port of the server.
+        latency: Time, in seconds, taken to answer each request.
+        error_every: If positive, every `error_every`-th request is answered
+            with HTTP 429.
+        path_corpus (optional): Glob-like pattern for S2 corpus gzip files.
+            If set, the fixtures are first recorded from them.
+    """
+    if path_corpus is not None:
+        fixtures_from_corpus(path_corpus, path_fixtures)
+    stub = StubServer(path_fixtures, port, latency, error_every)
+    logger.info(f"Serving the S2 API stub at {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
+
+
+if __name__ == "__main__":
+    fire.Fire(serve)
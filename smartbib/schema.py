@@ -0,0 +1,66 @@
+import pyarrow as pa
+
+# Version of the layout of the papers (`PARQUET_SCHEMA`). Parquet files
+# registered in the manifest with a different version are processed again
+SCHEMA_VERSION = 3
+
+# Fields read from the S2 JSON lines. Other fields are ignored while parsing
+S2_JSON_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('title', pa.string()),
+    ('paperAbstract', pa.string()),
+    (
+        'authors', pa.list_(
+            pa.struct([
+                ('name', pa.string()),
+                ('ids', pa.list_(pa.string()))
+            ])
+        )
+    ),
+    ('inCitations', pa.list_(pa.string())),
+    ('year', pa.int64()),
+    ('s2Url', pa.string()),
+    ('venue', pa.string()),
+    ('journalName', pa.string()),
+    ('journalVolume', pa.string()),
+    ('journalPages', pa.string()),
+    ('pdfUrls', pa.list_(pa.string())),
+    ('fieldsOfStudy', pa.list_(pa.string())),
+])
+
+# Layout of the papers once processed, shared by the parquet files and the
+# batches written into the database
+PARQUET_SCHEMA = pa.schema([
+    ('title', pa.string()),
+    ('paperAbstract', pa.string()),
+    (
+        'authors', pa.list_(
+            pa.struct([
+                ('id_author', pa.int64()),
+                ('name', pa.string())
+            ])
+        )
+    ),
+    ('inCitations', pa.list_(pa.binary())),
+    ('year', pa.int16()),
+    ('s2Url', pa.string()),
+    ('venue', pa.string()),
+    ('journalVolume', pa.string()),
+    ('journalPages', pa.string()),
+    ('pdfUrls', pa.list_(pa.string())),
+    ('fieldsOfStudy', pa.list_(pa.string())),
+    ('id_', pa.binary())
+])
+
+# Columns of the `papers` table (see `model.PaperDatabase`) filled from each
+# field of `PARQUET_SCHEMA`. The list fields go to their own tables
+PAPER_COLUMNS = dict(
+    id_='id_',
+    title='title',
+    paperAbstract='paper_abstract',
+    year='year',
+    s2Url='s2_url',
+    venue='venue',
+    journalVolume='journal_volume',
+    journalPages='journal_pages',
+)
@@ -0,0 +1,429 @@
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from multiprocessing import cpu_count
+from typing import List, Optional, Sequence, Tuple
+import fire
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+from tqdm.auto import tqdm
+from smartbib.utils import (
+    atomic_path, hash_tokens, ids_bytes_to_numpy, search_ids, tokenize
+)
+
+# Arrays stored for each shard of the index
+_SHARD_ARRAYS = ('ids', 'doc_length', 'indptr', 'docs', 'tf')
+# File describing the index and the parquet file of each shard
+_INDEX_META = 'index.json'
+
+
+def _term_frequencies(texts, n_features):
+    """Count the features of each text.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The text,
+            feature and frequency of each distinct (text, feature) pair,
+            sorted by text, and the number of tokens of each text.
+    """
+    owners, tokens = tokenize(texts)
+    features = hash_tokens(tokens, n_features)
+    keys, tf = np.unique(
+        owners * n_features + features, return_counts=True
+    )
+    doc_length = np.bincount(owners, minlength=len(texts))
+    return keys // n_features, keys % n_features, tf, doc_length
+
+
+def _index_shard(path_parquet, path_shard, n_features, batch_size):
+    """Build the inverted index of a parquet file.
+
+    The file is read in batches, so only the term frequencies (and not the
+    text) of the shard are kept in memory.
+
+    Returns:
+        Dict[str, int]: The number of documents and tokens of the shard.
+    """
+    parquet_file = pq.ParquetFile(path_parquet)
+    ids, docs, features, tf, doc_length = [], [], [], [], []
+    n_docs = 0
+    for batch in parquet_file.iter_batches(
+        batch_size=batch_size, columns=['id_', 'title', 'paperAbstract']
+    ):
+        texts = pc.binary_join_element_wise(
+            batch.column('title'), batch.column('paperAbstract'), ' ',
+            null_handling='replace'
+        )
+        batch_docs, batch_features, batch_tf, batch_length = (
+            _term_frequencies(texts, n_features)
+        )
+        ids.append(ids_bytes_to_numpy(batch.column('id_')).copy())
+        docs.append(batch_docs + n_docs)
+        features.append(batch_features)
+        tf.append(batch_tf)
+        doc_length.append(batch_length)
+        n_docs += batch.num_rows
+    features = np.concatenate(features or [np.empty(0, dtype=np.int32)])
+    # Postings sorted by feature (and by document within each feature)
+    order = np.argsort(features, kind='stable')
+    indptr = np.zeros(n_features + 1, dtype=np.int64)
+    np.cumsum(np.bincount(features, minlength=n_features), out=indptr[1:])
+    arrays = dict(
+        ids=np.concatenate(ids or [np.empty(0, dtype='S20')]),
+        doc_length=np.concatenate(
+            doc_length or [np.empty(0, dtype=np.int64)]
+        ).astype(np.int32),
+        indptr=indptr,
+        docs=np.concatenate(
+            docs or [np.empty(0, dtype=np.int64)]
+        )[order].astype(np.int32),
+        tf=np.minimum(
+            np.concatenate(tf or [np.empty(0, dtype=np.int64)])[order],
+            np.iinfo(np.uint16).max
+        ).astype(np.uint16),
+    )
+    os.makedirs(path_shard, exist_ok=True)
+    for name, array in arrays.items():
+        path_array = os.path.join(path_shard, f'{name}.npy')
+        with atomic_path(path_array) as path_tmp:
+            with open(path_tmp, 'wb') as file:
+                np.save(file, array)
+    return dict(n_docs=n_docs, n_tokens=int(arrays['doc_length'].sum()))
+
+
+class TextShard:
+    """Inverted index of the papers of one parquet file.
+
+    The postings of feature `f` are `docs[indptr[f]:indptr[f + 1]]`, with
+    the term frequencies in `tf`. Documents are the rows of the file.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        doc_length: np.ndarray,
+        indptr: np.ndarray,
+        docs: np.ndarray,
+        tf: np.ndarray,
+    ) -> None:
+        """Create a shard from its arrays.
+
+        Args:
+            ids: 20-bytes ID (dtype `S20`) of each document.
+            doc_length: Number of tokens of each document.
+            indptr: Offsets of the postings of each feature.
+            docs: Document of each posting.
+            tf: Term frequency of each posting.
+        """
+        self.ids = ids
+        self.doc_length = doc_length
+        self.indptr = indptr
+        self.docs = docs
+        self.tf = tf
+        self.prior = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def load(
+        cls, folder: str, mmap_mode: Optional[str] = 'r'
+    ) -> 'TextShard':
+        """Load a shard stored in `folder` (see `np.load` for `mmap_mode`)."""
+        return cls(*[
+            np.load(os.path.join(folder, f'{name}.npy'), mmap_mode=mmap_mode)
+            for name in _SHARD_ARRAYS
+        ])
+
+
+class TextIndex:
+    """BM25 index over the title and abstract of the papers.
+
+    Tokens are hashed into `n_features` features (the hashing trick), so the
+    index needs no vocabulary. The index is split in shards, one per parquet
+    file, built independently and memory-mapped when loaded. Queries are
+    scored in batches with vectorized gathers over the postings.
+    """
+
+    def __init__(
+        self,
+        shards: List[TextShard],
+        n_features: int,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> None:
+        """Create an index from its shards.
+
+        Args:
+            shards: Shards of the index.
+            n_features: Number of features the tokens are hashed into.
+            k1: BM25 term frequency saturation.
+            b: BM25 document length normalization.
+        """
+        self.shards = shards
+        self.n_features = n_features
+        self.k1 = k1
+        self.b = b
+        n_docs = sum(len(shard) for shard in shards)
+        df = np.zeros(n_features, dtype=np.int64)
+        n_tokens = 0
+        for shard in shards:
+            df += np.diff(shard.indptr)
+            n_tokens += int(shard.doc_length.sum())
+        self.n_docs = n_docs
+        self.avg_doc_length = n_tokens / max(n_docs, 1)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+        self.prior_weight = 0.
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    @classmethod
+    def load(
+        cls,
+        folder: str,
+        mmap_mode: Optional[str] = 'r',
+        k1: float = 1.2,
+        b: float = 0.75,
+    ) -> 'TextIndex':
+        """Load an index built by `build_text_index`.
+
+        Args:
+            folder: Folder containing the index.
+            mmap_mode (optional): Mode used to memory-map the arrays (see
+                `np.load`). Use None to load them in memory.
+            k1: BM25 term frequency saturation.
+            b: BM25 document length normalization.
+
+        Returns:
+            TextIndex: The index.
+        """
+        meta = _load_meta(folder)
+        shards = [
+            TextShard.load(os.path.join(folder, entry['shard']), mmap_mode)
+            for _, entry in sorted(meta['shards'].items())
+        ]
+        return cls(shards, meta['n_features'], k1, b)
+
+    def set_prior(self, ids, scores: np.ndarray, weight: float = 1.):
+        """Blend a per-paper score (e.g., from `ranking`) into the searches.
+
+        The score of each paper is multiplied by `weight` and added to its
+        BM25 score. Papers missing from `ids` get a prior of zero.
+
+        Args:
+            ids: Array (or sequence) of IDs represented as bytes.
+            scores: Score of each paper in `ids`.
+            weight: Weight of the prior.
+        """
+        ids = ids_bytes_to_numpy(ids)
+        order = np.argsort(ids, kind='stable')
+        ids, scores = ids[order], np.asarray(scores, dtype=float)[order]
+        for shard in self.shards:
+            if not len(ids):
+                shard.prior = np.zeros(len(shard.ids))
+                continue
+            positions = search_ids(ids, shard.ids)
+            shard.prior = np.where(positions >= 0, scores[positions], 0.)
+        self.prior_weight = weight
+
+    def _query_features(self, queries):
+        """Distinct (query, feature) pairs of a batch of queries."""
+        owners, features, _, _ = _term_frequencies(
+            pa.array(queries, pa.string()), self.n_features
+        )
+        return owners, features
+
+    def _search_shard(self, shard, owners, features, k):
+        """Top-k documents of a shard for each query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The query, document
+                and score of the results, sorted by query and decreasing
+                score.
+        """
+        starts = shard.indptr[features]
+        lengths = shard.indptr[features + 1] - starts
+        hits = np.repeat(np.arange(len(features)), lengths)
+        first = np.cumsum(lengths) - lengths
+        positions = (
+            np.arange(lengths.sum()) + np.repeat(starts - first, lengths)
+        )
+        docs = shard.docs[positions].astype(np.int64)
+        tf = shard.tf[positions].astype(float)
+        norm = self.k1 * (
+            1. - self.b
+            + self.b * shard.doc_length[docs] / self.avg_doc_length
+        )
+        weights = self.idf[features[hits]] * tf * (self.k1 + 1.) / (tf + norm)
+        # Aggregate the postings by (query, document)
+        keys, inverse = np.unique(
+            owners[hits] * len(shard) + docs, return_inverse=True
+        )
+        scores = np.bincount(inverse, weights=weights)
+        queries, docs = keys // max(len(shard), 1), keys % max(len(shard), 1)
+        if shard.prior is not None and self.prior_weight:
+            scores += self.prior_weight * shard.prior[docs]
+        order = np.lexsort((docs, -scores, queries))
+        queries, docs, scores = queries[order], docs[order], scores[order]
+        # Keep the first k results of each query
+        starts = np.searchsorted(queries, queries)
+        keep = np.arange(len(queries)) - starts < k
+        return queries[keep], docs[keep], scores[keep]
+
+    def search_batch(
+        self, queries: Sequence[str], k: int = 10
+    ) -> List[List[Tuple[bytes, float]]]:
+        """Search a batch of queries.
+
+        Args:
+            queries: Text of each query.
+            k: Number of papers returned per query.
+
+        Returns:
+            List[List[Tuple[bytes, float]]]: The 20-bytes ID and score of the
+                papers found for each query, sorted by decreasing score.
+        """
+        owners, features = self._query_features(queries)
+        results = [
+            (i, *self._search_shard(shard, owners, features, k))
+            for i, shard in enumerate(self.shards)
+        ]
+        shard = np.concatenate(
+            [np.full(len(result[1]), result[0]) for result in results]
+            or [np.empty(0, dtype=np.int64)]
+        )
+        query, doc, score = [
+            np.concatenate([result[j] for result in results] or [[]])
+            for j in (1, 2, 3)
+        ]
+        # Merge the results of the shards
+        order = np.lexsort((doc, shard, -score, query))
+        found = [[] for _ in queries]
+        for i in order:
+            if len(found[query[i]]) < k:
+                # NumPy strips the trailing null bytes of the IDs
+                id_ = self.shards[shard[i]].ids[doc[i]].ljust(20, b'\0')
+                found[query[i]].append((id_, float(score[i])))
+        return found
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[bytes, float]]:
+        """Search papers matching a query.
+
+        Args:
+            query: Text of the query.
+            k: Number of papers returned.
+
+        Returns:
+            List[Tuple[bytes, float]]: The 20-bytes ID and score of the papers
+                found, sorted by decreasing score.
+        """
+        return self.search_batch([query], k)[0]
+
+
+def _load_meta(folder):
+    path_meta = os.path.join(folder, _INDEX_META)
+    if not os.path.exists(path_meta):
+        return {}
+    with open(path_meta, 'r') as file:
+        return json.load(file)
+
+
+def _store_meta(meta, folder):
+    with atomic_path(os.path.join(folder, _INDEX_META)) as path_tmp:
+        with open(path_tmp, 'w') as file:
+            json.dump(meta, file, indent=2, sort_keys=True)
+
+
+def _shard_name(path):
+    """Name of the shard of a parquet file, unique for its absolute path.
+
+    Files in different folders can share their name (e.g., the partitions of
+    a dataset written by `dataset.write_dataset`), so the name of the file is
+    suffixed with a hash of its path.
+    """
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return f'{os.path.splitext(os.path.basename(path))[0]}-{digest[:12]}'
+
+
+def build_text_index(
+    input_path_pattern: str,
+    output_folder: str,
+    n_features: int = 2 ** 20,
+    n_jobs: int = 1,
+    batch_size: int = 100_000,
+    force: bool = False,
+):
+    """Build a BM25 index over the title and abstract of the papers.
+
+    Each parquet file is indexed independently (in parallel with
+    `n_jobs > 1`) into a shard stored as `.npy` files. Shards of files that
+    were not modified since the last run are kept, so the index can be
+    updated incrementally. Load the index with `TextIndex.load`.
+
+    Args:
+        input_path_pattern: Glob-like pattern for the parquet files.
+        output_folder: Folder where the index is stored.
+        n_features: Number of features the tokens are hashed into.
+        n_jobs: Number of shards built in parallel. Use -1 to use all the
+            CPUs.
+        batch_size: Number of papers read at a time from each file.
+        force: Build every shard, even the ones that are up to date.
+    """
+    assert n_jobs > 0 or n_jobs == -1, 'Inconsistent n_jobs'
+    n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+    file_list = sorted(
+        os.path.abspath(path) for path in glob(input_path_pattern)
+    )
+    os.makedirs(output_folder, exist_ok=True)
+    meta = _load_meta(output_folder)
+    if meta.get('n_features') != n_features:
+        meta = dict(n_features=n_features, shards={})
+    # Drop the shards of files that are gone
+    for path in set(meta['shards']) - set(file_list):
+        shutil.rmtree(
+            os.path.join(output_folder, meta['shards'].pop(path)['shard']),
+            ignore_errors=True
+        )
+    jobs = []
+    for i, path in enumerate(file_list):
+        stat = os.stat(path)
+        entry = meta['shards'].get(path)
+        if (
+            force or entry is None
+            or (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime)
+        ):
+            shard = _shard_name(path)
+            if entry is not None and entry['shard'] != shard:
+                shutil.rmtree(
+                    os.path.join(output_folder, entry['shard']),
+                    ignore_errors=True
+                )
+            jobs.append((path, shard, stat))
+    logger.debug(
+        f"{len(jobs)} of {len(file_list)} shards to be (re)built"
+    )
+    args = [
+        (path, os.path.join(output_folder, shard), n_features, batch_size)
+        for path, shard, _ in jobs
+    ]
+    if n_jobs > 1 and args:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            results = executor.map(_index_shard, *zip(*args))
+            results = list(tqdm(results, total=len(args)))
+    else:
+        results = [_index_shard(*job_args) for job_args in tqdm(args)]
+    for (path, shard, stat), result in zip(jobs, results):
+        meta['shards'][path] = dict(
+            shard=shard, size=stat.st_size, mtime=stat.st_mtime, **result
+        )
+    _store_meta(meta, output_folder)
+
+
+if __name__ == "__main__":
+    fire.Fire(build_text_index)
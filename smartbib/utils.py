@@ -1,4 +1,24 @@
-from typing import Union
+from typing import Optional, Tuple, Union
+from contextlib import contextmanager
+import hashlib
+import os
+import zlib
+from queue import Full, Queue
+from threading import Event, Thread
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tqdm.auto import tqdm
+
+# Lookup tables used by the vectorized ID conversion
+_HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b'0123456789', dtype=np.uint8)] = np.arange(10)
+_HEX_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
+_HEX_VALUES[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+# Tokens are the maximal sequences of letters and digits
+_TOKEN_SEPARATOR = r'[^\pL\pN]+'
 
 def id_str_to_bytes(id_str: str) -> bytes:
     """Convert a 40 characters hash into a byte array.
@@ -27,6 +47,235 @@ def id_bytes_to_str(id_bytes: bytes) -> str:
     return hex(int.from_bytes(id_bytes, byteorder='big'))[2:]
 
 
+def _to_arrow_array(values, type_) -> pa.Array:
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if not isinstance(values, pa.Array):
+        values = pa.array(values, type=type_)
+    if values.null_count:
+        raise ValueError('IDs cannot be null')
+    return values
+
+
+def ids_str_to_bytes_array(ids) -> pa.FixedSizeBinaryArray:
+    """Convert an array of 40 characters hashes into 20-bytes IDs.
+
+    Vectorized version of `id_str_to_bytes`. The whole array is converted at
+    once, without creating Python objects for each element. A `ValueError`
+    is raised for null, empty or non-hexadecimal IDs. List columns can
+    be converted by flattening them first (e.g., using `ListArray.flatten`)
+    and rebuilding the lists from the original offsets.
+
+    Args:
+        ids: NumPy/Arrow array (or any sequence) of hash strings.
+
+    Returns:
+        pa.FixedSizeBinaryArray: The IDs converted to `binary(20)`.
+    """
+    ids = _to_arrow_array(ids, pa.string()).cast(pa.string())
+    n_ids = len(ids)
+    if n_ids:
+        # Lengths in bytes, so non-ASCII characters cannot shift the hashes
+        lengths = pc.min_max(pc.binary_length(ids)).as_py()
+        if lengths['min'] == 0:
+            raise ValueError('IDs cannot be empty')
+        if lengths['max'] > 40:
+            raise ValueError('IDs cannot be longer than 40 characters')
+    # Left-pad with zeros, so that every hash has exactly 40 characters
+    ids = pc.utf8_lpad(ids, width=40, padding='0')
+    offsets = np.frombuffer(ids.buffers()[1], dtype=np.int32)
+    start = offsets[ids.offset]
+    chars = np.frombuffer(
+        ids.buffers()[2], dtype=np.uint8, count=40 * n_ids, offset=start
+    )
+    nibbles = _HEX_VALUES[chars].reshape(n_ids, 40)
+    if (nibbles == 255).any():
+        raise ValueError('IDs must be hexadecimal strings')
+    id_bytes = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    return pa.FixedSizeBinaryArray.from_buffers(
+        pa.binary(20), n_ids, [None, pa.py_buffer(id_bytes)]
+    )
+
+
+def _ids_bytes_buffer(ids) -> np.ndarray:
+    """Bytes of an array of 20-bytes IDs, as a flat array of uint8."""
+    if isinstance(ids, np.ndarray) and ids.dtype == np.dtype('S20'):
+        return np.ascontiguousarray(ids).view(np.uint8).ravel()
+    ids = _to_arrow_array(ids, pa.binary(20))
+    n_ids = len(ids)
+    if pa.types.is_fixed_size_binary(ids.type):
+        if ids.type.byte_width != 20:
+            raise ValueError('IDs must have 20 bytes')
+        start = ids.offset * 20
+    else:
+        ids = ids.cast(pa.binary())
+        if n_ids and pc.any(pc.not_equal(pc.binary_length(ids), 20)).as_py():
+            raise ValueError('IDs must have 20 bytes')
+        offsets = np.frombuffer(ids.buffers()[1], dtype=np.int32)
+        start = offsets[ids.offset]
+    return np.frombuffer(
+        ids.buffers()[-1], dtype=np.uint8, count=20 * n_ids, offset=start
+    )
+
+
+def ids_bytes_to_numpy(ids) -> np.ndarray:
+    """Convert an array of 20-bytes IDs into a NumPy array of dtype `S20`.
+
+    Fixed-width arrays can be sorted, searched (`np.searchsorted`) and
+    stored as `.npy` files. Notice that NumPy strips trailing null bytes
+    when converting an element into `bytes`, so elements should be padded
+    back to 20 bytes (e.g., `bytes(id_).ljust(20, b'\\0')`).
+
+    Args:
+        ids: NumPy/Arrow array (or any sequence) of IDs represented as bytes.
+
+    Returns:
+        np.ndarray: The IDs as fixed-width byte strings.
+    """
+    return _ids_bytes_buffer(ids).view('S20')
+
+
+def id_prefixes(ids: np.ndarray) -> np.ndarray:
+    """First 8 bytes of each ID as (big-endian) unsigned integers.
+
+    Prefixes keep the order of the IDs and are much faster to compare, which
+    makes them useful to speed up searches (see `search_ids`).
+
+    Args:
+        ids: Array (dtype `S20`) of IDs.
+
+    Returns:
+        np.ndarray: Array of uint64.
+    """
+    id_bytes = np.ascontiguousarray(ids).view(np.uint8).reshape(-1, 20)
+    return (
+        np.ascontiguousarray(id_bytes[:, :8]).view('>u8').ravel()
+        .astype(np.uint64)
+    )
+
+
+def search_ids(
+    sorted_ids: np.ndarray,
+    ids: np.ndarray,
+    sorted_prefixes: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Find the position of IDs in a sorted array of IDs.
+
+    Args:
+        sorted_ids: Sorted array (dtype `S20`) of IDs.
+        ids: Array (dtype `S20`) of IDs to search.
+        sorted_prefixes (optional): Output of `id_prefixes(sorted_ids)`. If
+            given, the IDs are sorted and searched by their prefixes, falling
+            back to the full IDs only for prefixes shared by several IDs,
+            which is several times faster for large batches.
+
+    Returns:
+        np.ndarray: Position of each ID in `sorted_ids`, or -1 for IDs not
+            found.
+    """
+    n_sorted = len(sorted_ids)
+    if not n_sorted:
+        return np.full(len(ids), -1, dtype=np.int64)
+    if sorted_prefixes is None:
+        positions = np.searchsorted(sorted_ids, ids)
+    else:
+        prefixes = id_prefixes(ids)
+        # Searching sorted keys makes the memory accesses mostly sequential
+        order = np.argsort(prefixes)
+        positions = np.empty(len(ids), dtype=np.int64)
+        positions[order] = np.searchsorted(sorted_prefixes, prefixes[order])
+        clipped = np.minimum(positions, n_sorted - 1)
+        shared = (
+            (sorted_prefixes[clipped] == prefixes)
+            & (sorted_ids[clipped] != ids)
+        )
+        if shared.any():
+            positions[shared] = np.searchsorted(sorted_ids, ids[shared])
+    found = sorted_ids[np.minimum(positions, n_sorted - 1)] == ids
+    return np.where(found, positions, -1)
+
+
+def ids_bytes_to_str_array(ids) -> pa.StringArray:
+    """Convert an array of 20-bytes IDs back into hash strings.
+
+    Vectorized version of `id_bytes_to_str`. Unlike the latter, leading zeros
+    are kept, so every hash has exactly 40 characters.
+
+    Args:
+        ids: NumPy/Arrow array (or any sequence) of IDs represented as bytes.
+
+    Returns:
+        pa.StringArray: Hashes as strings.
+    """
+    id_bytes = _ids_bytes_buffer(ids)
+    n_ids = len(id_bytes) // 20
+    chars = _HEX_DIGITS[np.stack([id_bytes >> 4, id_bytes & 15], axis=-1)]
+    offsets = np.arange(0, 40 * (n_ids + 1), 40, dtype=np.int32)
+    return pa.StringArray.from_buffers(
+        n_ids, pa.py_buffer(offsets), pa.py_buffer(chars)
+    )
+
+
+def iter_parquet_batches(file_list, columns=None, batch_size=1_000_000):
+    """Iterate over the record batches of a list of parquet files.
+
+    Args:
+        file_list: Paths to the parquet files.
+        columns (optional): Columns to read. By default, all of them.
+        batch_size: Maximum number of rows per batch.
+
+    Yields:
+        pa.RecordBatch: Batch of rows.
+    """
+    for path_parquet in tqdm(file_list):
+        parquet_file = pq.ParquetFile(path_parquet)
+        for batch in parquet_file.iter_batches(
+            batch_size=batch_size, columns=columns
+        ):
+            yield batch
+
+
+def tokenize(texts) -> Tuple[np.ndarray, pa.Array]:
+    """Split texts into lowercase tokens.
+
+    Args:
+        texts: Arrow array of strings (nulls are treated as empty texts).
+
+    Returns:
+        Tuple[np.ndarray, pa.Array]: The position of the text of each token
+            and the tokens.
+    """
+    tokens = pc.split_pattern_regex(
+        pc.utf8_lower(texts.fill_null('')), _TOKEN_SEPARATOR
+    )
+    lengths = pc.list_value_length(tokens).to_numpy()
+    owners = np.repeat(np.arange(len(texts)), lengths)
+    tokens = pc.list_flatten(tokens)
+    # Leading and trailing separators produce empty tokens
+    keep = pc.not_equal(tokens, '')
+    return owners[keep.to_numpy(zero_copy_only=False)], tokens.filter(keep)
+
+
+def hash_tokens(tokens, n_buckets: int) -> np.ndarray:
+    """Map tokens into buckets with a stable hash (CRC-32).
+
+    Only the distinct tokens are hashed in Python.
+
+    Args:
+        tokens: Arrow array of strings.
+        n_buckets: Number of buckets (at most 2 ** 31).
+
+    Returns:
+        np.ndarray: Bucket (int32) of each token.
+    """
+    encoded = pc.dictionary_encode(tokens)
+    hashes = np.array([
+        zlib.crc32(token.encode())
+        for token in encoded.dictionary.to_pylist()
+    ], dtype=np.int64) % n_buckets
+    return hashes[encoded.indices.to_numpy()].astype(np.int32)
+
+
 def chunks(lst: Union[list, tuple], n: int = 5_000):
     """Yield successive n-sized chunks from list.
 
@@ -36,3 +285,97 @@ def chunks(lst: Union[list, tuple], n: int = 5_000):
     """
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
+
+
+@contextmanager
+def atomic_path(path: str):
+    """Context manager used to write a file atomically.
+
+    Yields a temporary path in the same folder as `path`. The temporary file
+    is renamed to `path` only when the block finishes without errors, so a
+    process killed while writing never leaves a partially written file.
+
+    Args:
+        path: Final path of the file.
+    """
+    path_tmp = os.path.join(
+        os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.tmp"
+    )
+    try:
+        yield path_tmp
+        os.replace(path_tmp, path)
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """Compute the SHA-1 hash of the content of a file.
+
+    Args:
+        path: Path to the file.
+        block_size: Number of bytes read at a time.
+
+    Returns:
+        str: Hexadecimal digest of the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def prefetch(iterable, size: int = 1):
+    """Iterate over `iterable` in a background thread.
+
+    Up to `size` items are produced ahead of the consumer, so that producing
+    the next item (e.g., reading a file) overlaps with processing the current
+    one. Errors raised by the producer are raised in the consumer. When the
+    consumer stops early (e.g., on an error or when the generator is
+    closed), the producer stops after its current item.
+
+    Args:
+        iterable: Iterable to consume.
+        size: Maximum number of items ready to be consumed.
+    """
+    queue = Queue(size)
+    stop = Event()
+    end = object()
+
+    def put(item):
+        """Wait for room in the queue, unless the consumer is gone."""
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as exc:
+            put((None, exc))
+            return
+        finally:
+            # Release the resources of the iterable (e.g., open files)
+            close = getattr(iterable, 'close', None)
+            if stop.is_set() and close is not None:
+                close()
+        put((end, None))
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, exc = queue.get()
+            if exc is not None:
+                raise exc
+            if item is end:
+                return
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,42 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+from smartbib.authors import (
+    UNKNOWN_AUTHOR_ID, author_ids, build_author_tables
+)
+from smartbib.parquetizer import generate_parquet_files
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_author_ids():
+    ids = author_ids(
+        pa.array([None, 7, None, None]),
+        pa.array(['Ann  Smith', 'Bo Li', 'ann smith', 'Bo Li'])
+    ).to_pylist()
+    # Surrogate IDs are negative and only depend on the normalized name
+    assert ids[0] == ids[2] < 0
+    assert ids[1] == 7 and ids[3] < 0 and ids[3] != ids[0]
+
+
+def test_author_ids_unknown_names():
+    ids = author_ids(
+        pa.array([3, None, None, None, None]),
+        pa.array([None, None, '', '???', 'Ann Smith'])
+    ).to_pylist()
+    # Names without letters nor digits are not hashed into a shared author
+    assert ids[:4] == [3] + [UNKNOWN_AUTHOR_ID] * 3
+    assert ids[4] < UNKNOWN_AUTHOR_ID
+
+
+def test_build_author_tables(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    build_author_tables(str(tmp_path / '*.parquet'), str(tmp_path))
+    # The tables written by the first run are not read again
+    build_author_tables(str(tmp_path / '*.parquet'), str(tmp_path))
+    authors = pq.read_table(tmp_path / 'authors.parquet')
+    authorship = pq.read_table(tmp_path / 'authorship.parquet')
+    assert pa.types.is_dictionary(authors.schema.field('name').type)
+    assert authors.column('n_papers').to_numpy().sum() == authorship.num_rows
+    assert set(authorship.column('id_author').to_pylist()) == set(
+        authors.column('id_author').to_pylist()
+    )
@@ -0,0 +1,41 @@
+import gzip
+import json
+import pandas as pd
+from smartbib.benchmark import compare_results, generate_corpus, run_benchmarks
+from smartbib.parquetizer import _read_json_gzip
+
+
+def test_generate_corpus(tmp_path):
+    file_list = generate_corpus(
+        str(tmp_path), n_papers=50, n_files=2, fan_out=3, abstract_length=20
+    )
+    assert len(file_list) == 2
+    df = pd.concat([_read_json_gzip(path) for path in file_list])
+    assert len(df) == 50
+    assert df.index.is_unique
+    # Same arguments, same papers
+    file_list_again = generate_corpus(
+        str(tmp_path / 'again'), n_papers=50, n_files=2, fan_out=3,
+        abstract_length=20
+    )
+    for path, path_again in zip(file_list, file_list_again):
+        with gzip.open(path) as file, gzip.open(path_again) as file_again:
+            assert file.read() == file_again.read()
+
+
+def test_run_benchmarks(tmp_path):
+    path_results = str(tmp_path / 'benchmarks.jsonl')
+    for _ in range(2):
+        run_benchmarks(
+            path_results=path_results, benchmarks='ids,db_load', repeat=1,
+            n_papers=100
+        )
+    entries = [
+        json.loads(line) for line in open(path_results).read().splitlines()
+    ]
+    assert len(entries) == 2
+    assert set(entries[0]['results']) == {'ids', 'db_load'}
+    assert entries[0]['results']['db_load']['n_records'] == 100
+    assert entries[0]['results']['ids']['peak_rss_mb'] > 0
+    ratios = compare_results(path_results)
+    assert set(ratios) == {'ids', 'db_load'}
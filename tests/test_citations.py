@@ -0,0 +1,43 @@
+import gzip
+import json
+import shutil
+from glob import glob
+import pyarrow.parquet as pq
+from smartbib.citations import clean_citations
+from smartbib.parquetizer import generate_parquet_files
+from smartbib.utils import ids_bytes_to_str_array
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_clean_citations(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    # A copy of the shard duplicates all the citations
+    path_parquet, = glob(str(tmp_path / '*.parquet'))
+    shutil.copy(path_parquet, str(tmp_path / 'copy.parquet'))
+    with gzip.open(PATH_SAMPLE, 'rt') as file:
+        papers = [json.loads(line) for line in file]
+    paper_ids = {paper['id'] for paper in papers}
+    expected = sorted(
+        (paper['id'], citer) for paper in papers
+        for citer in set(paper['inCitations']) if citer in paper_ids
+    )
+    # A budget of a few records forces several runs
+    n_edges = clean_citations(
+        str(tmp_path / '*.parquet'), str(tmp_path / 'citations'),
+        memory_budget_mb=1e-3, n_partitions=4, batch_size=3,
+        spill_folder=str(tmp_path)
+    )
+    assert n_edges == len(expected)
+    edges = []
+    for partition in range(4):
+        table = pq.read_table(
+            str(tmp_path / 'citations' / f'citations-{partition:03d}.parquet')
+        )
+        cited = ids_bytes_to_str_array(table.column('id_cited')).to_pylist()
+        assert all(int(id_[:4], 16) * 4 >> 16 == partition for id_ in cited)
+        edges += zip(
+            cited,
+            ids_bytes_to_str_array(table.column('id_citer')).to_pylist()
+        )
+    assert edges == expected
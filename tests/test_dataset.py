@@ -0,0 +1,51 @@
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from smartbib.dataset import write_partitioned_dataset
+from smartbib.parquetizer import generate_parquet_files
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_partitioned_dataset(tmp_path):
+    path_dataset = tmp_path / 'dataset'
+    generate_parquet_files(
+        PATH_SAMPLE, str(tmp_path), dataset_folder=str(path_dataset)
+    )
+    assert pq.read_metadata(path_dataset / '_metadata').num_rows == 10
+    dataset = ds.dataset(
+        str(path_dataset), format='parquet', partitioning='hive',
+        exclude_invalid_files=True
+    )
+    table = dataset.to_table(filter=ds.field('year_bucket') == 2000)
+    # The paper without year is stored in the partition of unknown years
+    assert table.num_rows == 9
+    assert set(table.column('field_of_study').to_pylist()) == {
+        'Computer Science'
+    }
+    for fragment in dataset.get_fragments():
+        column = fragment.metadata.row_group(0).column(
+            fragment.physical_schema.get_field_index('id_')
+        )
+        assert column.compression == 'ZSTD'
+        ids = fragment.to_table(columns=['id_']).column('id_').to_pylist()
+        assert ids == sorted(ids)
+
+
+def test_partitioned_dataset_refuses_other_folders(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    path_dataset = tmp_path / 'dataset'
+    path_dataset.mkdir()
+    (path_dataset / 'notes.txt').write_text('not a dataset')
+    with pytest.raises(FileExistsError):
+        write_partitioned_dataset(
+            str(tmp_path / '*.parquet'), str(path_dataset)
+        )
+    assert (path_dataset / 'notes.txt').exists()
+    write_partitioned_dataset(
+        str(tmp_path / '*.parquet'), str(path_dataset), overwrite=True
+    )
+    # A previous dataset is replaced
+    write_partitioned_dataset(str(tmp_path / '*.parquet'), str(path_dataset))
+    assert pq.read_metadata(path_dataset / '_metadata').num_rows == 10
+    assert not (path_dataset / 'notes.txt').exists()
@@ -0,0 +1,60 @@
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
+from smartbib.dedup import find_duplicates
+from smartbib.parquetizer import PARQUET_SCHEMA, generate_parquet_files
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def _write_papers(path, papers):
+    pq.write_table(pa.table({
+        'id_': [hashlib.sha1(str(i).encode()).digest() for i, _, _ in papers],
+        'title': [title for _, title, _ in papers],
+        'authors': pa.array([
+            None if names is None
+            else [dict(id_author=-1, name=name) for name in names]
+            for _, _, names in papers
+        ], PARQUET_SCHEMA.field('authors').type),
+    }), path)
+
+
+def test_find_duplicates(tmp_path):
+    _write_papers(tmp_path / 'papers-0.parquet', [
+        (0, 'Deep learning for citation graphs', ['Ann Smith', 'Bo Li']),
+        (1, 'A survey of protein folding', ['C. Doe']),
+        (2, None, None),
+    ])
+    _write_papers(tmp_path / 'papers-1.parquet', [
+        (3, 'Deep Learning for Citation Graphs.', ['Ann Smith', 'Bo Li']),
+        (4, 'A survey of protein folding methods', ['X. Y.']),
+    ])
+    path_output = str(tmp_path / 'duplicates.pq')
+    n_duplicates = find_duplicates(
+        str(tmp_path / '*.parquet'), path_output, n_jobs=2
+    )
+    assert n_duplicates == 1
+    # Paper 3 has the smallest ID of the pair
+    assert pq.read_table(path_output).to_pylist() == [dict(
+        id_=hashlib.sha1(b'0').digest(),
+        id_canonical=hashlib.sha1(b'3').digest()
+    )]
+
+
+def test_find_duplicates_generic_titles(tmp_path):
+    _write_papers(tmp_path / 'papers.parquet', [
+        (0, 'Editorial', None),
+        (1, 'Editorial', None),
+        (2, 'Erratum', []),
+        (3, 'Erratum', []),
+    ])
+    path_output = str(tmp_path / 'duplicates.pq')
+    assert find_duplicates(str(tmp_path / '*.parquet'), path_output) == 0
+
+
+def test_parquetizer_duplicates(tmp_path):
+    path_output = str(tmp_path / 'duplicates.pq')
+    generate_parquet_files(
+        PATH_SAMPLE, str(tmp_path), path_duplicates=path_output
+    )
+    assert pq.read_table(path_output).num_rows == 0
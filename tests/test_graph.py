@@ -0,0 +1,36 @@
+import gzip
+import json
+import numpy as np
+from smartbib.graph import CitationGraph
+from smartbib.parquetizer import generate_parquet_files
+from smartbib.utils import ids_str_to_bytes_array
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_citation_graph(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    graph = CitationGraph.from_parquet(
+        str(tmp_path / '*.parquet'), spill_folder=str(tmp_path)
+    )
+    with gzip.open(PATH_SAMPLE, 'rt') as file:
+        papers = [json.loads(line) for line in file]
+    paper_ids = {paper['id'] for paper in papers}
+    assert graph.n_nodes == len(papers)
+    assert graph.n_edges == sum(
+        citer in paper_ids for paper in papers
+        for citer in paper['inCitations']
+    )
+    nodes = graph.node_index(ids_str_to_bytes_array(
+        [paper['id'] for paper in papers]
+    ))
+    citers = graph.node_index(ids_str_to_bytes_array(
+        [citer for citer in papers[0]['inCitations'] if citer in paper_ids]
+    ))
+    assert sorted(graph.citers(nodes[0])) == sorted(citers)
+    assert all(nodes[0] in graph.references(citer) for citer in citers)
+    assert graph.in_degree().sum() == graph.out_degree().sum()
+
+    graph.save(str(tmp_path / 'graph'))
+    graph_loaded = CitationGraph.load(str(tmp_path / 'graph'))
+    assert np.array_equal(graph_loaded.in_indices, graph.in_indices)
@@ -0,0 +1,21 @@
+from smartbib.index import PaperIndex
+from smartbib.parquetizer import generate_parquet_files
+from smartbib.utils import id_str_to_bytes
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_paper_index(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path), batch_size=4)
+    index = PaperIndex.from_parquet(str(tmp_path / '*.parquet'))
+    index.save(str(tmp_path / 'index'))
+    index = PaperIndex.load(str(tmp_path / 'index'))
+    assert len(index) == 10
+
+    assert index.read([], columns=['id_']).num_rows == 0
+    ids = [id_.ljust(20, b'\0') for id_ in index.ids[[7, 2, 5]].tolist()]
+    missing_id = id_str_to_bytes('f' * 40)
+    shard, row_group, row = index.lookup(ids + [missing_id])
+    assert shard.tolist() == [0, 0, 0, -1]
+    table = index.read(ids + [missing_id], columns=['id_', 'title'])
+    assert table.column('id_').to_pylist() == ids
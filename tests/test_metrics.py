@@ -0,0 +1,40 @@
+import json
+import shutil
+from smartbib.metrics import collect, span
+from smartbib.parquetizer import generate_parquet_files
+
+
+def test_collect():
+    with collect() as metrics:
+        with span('parse', 'a.gz', rows=3, n_bytes=10):
+            pass
+        with span('parse', 'b.gz') as current:
+            current.rows = 2
+    with collect() as other:
+        with span('write', rows=5):
+            pass
+    metrics.merge(other.snapshot())
+    report = metrics.report()
+    assert report['stages']['parse']['calls'] == 2
+    assert report['stages']['parse']['rows'] == 5
+    assert report['stages']['write']['rows'] == 5
+    assert set(report['files']) == {'a.gz', 'b.gz'}
+    assert report['peak_rss_bytes'] > 0
+    prometheus = metrics.to_prometheus()
+    assert 'smartbib_stage_rows_total{stage="parse"} 5' in prometheus
+
+
+def test_generate_parquet_files_metrics(tmp_path):
+    path_file = shutil.copy('tests/_resources/s2-corpus-sample.gz', tmp_path)
+    path_metrics = tmp_path / 'metrics.json'
+    generate_parquet_files(
+        str(tmp_path / '*.gz'), engine='arrow', batch_size=4,
+        path_metrics=str(path_metrics), profile_shard=path_file
+    )
+    report = json.loads(path_metrics.read_text())
+    assert report['stages']['file']['rows'] == 10
+    assert report['stages']['parse']['calls'] == 3
+    assert report['stages']['transform.ids']['rows'] > 10
+    assert report['files'][path_file]['decompress'] > 0
+    assert (tmp_path / 'metrics.prom').exists()
+    assert (tmp_path / 's2-corpus-sample.pstats').exists()
@@ -0,0 +1,66 @@
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateIndex
+from smartbib.model import CachedLookup, PaperDatabase
+from smartbib.mysql_writer import write_s2_data_to_db
+from smartbib.parquetizer import _read_json_gzip
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_pdf_urls_key():
+    db = PaperDatabase()
+    (index,) = db.pdf_url.indexes
+    # The whole URL is part of the key, through its hash
+    assert str(CreateIndex(index).compile(dialect=mysql.dialect())) == (
+        'CREATE UNIQUE INDEX ix_pdf_urls_key ON pdf_urls '
+        '(id_paper, content_hash)'
+    )
+
+
+def test_fetch_where_in():
+    df = _read_json_gzip(PATH_SAMPLE)
+    engine = create_engine('sqlite://')
+    db = PaperDatabase()
+    db.create_tables(engine)
+    write_s2_data_to_db(df, engine, db=db)
+    ids = df.index.tolist() + [b'\xff' * 20]
+    expected = sorted(zip(df.index, df.title))
+    with engine.connect() as conn:
+        # IN clauses of 3 values
+        rows = db.fetch_where_in(
+            conn, db.paper, 'id_', ids, ['id_', 'title'], chunk_size=3
+        )
+        assert sorted(map(tuple, rows)) == expected
+        # Temporary table, dropped afterwards
+        rows = db.fetch_where_in(
+            conn, db.paper, 'id_', ids + ids, ['id_', 'title'],
+            temp_table_threshold=5
+        )
+        assert sorted(map(tuple, rows)) == expected
+        assert conn.exec_driver_sql(
+            "SELECT COUNT(*) FROM sqlite_temp_master WHERE type = 'table'"
+        ).scalar() == 0
+
+
+def test_cached_lookup():
+    df = _read_json_gzip(PATH_SAMPLE)
+    engine = create_engine('sqlite://')
+    db = PaperDatabase()
+    db.create_tables(engine)
+    write_s2_data_to_db(df, engine, db=db)
+    lookup = CachedLookup(
+        db, engine, db.citation, 'id_cited', ['id_citer'], max_size=8
+    )
+    ids = df.index.tolist()
+    citers = lookup.get_many(ids)
+    assert (lookup.hits, lookup.misses) == (0, 10)
+    assert [len(rows) for rows in citers.values()] == (
+        df.inCitations.str.len().tolist()
+    )
+    assert len(lookup) == 8
+    # The two least recently used keys were evicted
+    assert lookup.get(ids[-1]) == citers[ids[-1]]
+    assert lookup.get(ids[0]) == citers[ids[0]]
+    assert (lookup.hits, lookup.misses) == (1, 11)
+    assert lookup.get(b'\xff' * 20) == []
@@ -0,0 +1,137 @@
+import io
+import shutil
+import pandas as pd
+from sqlalchemy import create_engine, inspect
+from smartbib.model import PaperDatabase
+from smartbib.mysql_writer import (
+    _frame_to_tsv, _iter_s2_gzip, write_data_to_db, write_s2_data_to_db
+)
+from smartbib.parquetizer import _read_json_gzip, generate_parquet_files
+
+
+def test_frame_to_tsv():
+    df = pd.DataFrame({
+        'id_paper': [b'\x00' * 20, b'\t' * 20],
+        'content': ['a\tb\\c\nd', None],
+    })
+    file = io.StringIO()
+    _frame_to_tsv(df, ['id_paper'], file)
+    assert file.getvalue() == (
+        '00' * 20 + '\ta\\tb\\\\c\\nd\n' + '09' * 20 + '\t\\N\n'
+    )
+
+
+def test_write_s2_data_to_db_sqlite():
+    df = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    engine = create_engine('sqlite://')
+    write_s2_data_to_db(df, engine, method='load_data')
+    with engine.connect() as conn:
+        n_papers = conn.exec_driver_sql('SELECT COUNT(*) FROM papers')
+        assert n_papers.scalar() == 10
+        n_citations = conn.exec_driver_sql('SELECT COUNT(*) FROM citations')
+        assert n_citations.scalar() == df.inCitations.str.len().sum()
+
+
+def test_write_s2_data_to_db_concurrent(tmp_path):
+    df = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    engine = create_engine(f"sqlite:///{tmp_path / 'papers.db'}")
+    write_s2_data_to_db(df, engine, n_threads=4)
+    with engine.connect() as conn:
+        n_authorships = conn.exec_driver_sql(
+            'SELECT COUNT(*) FROM authorship'
+        )
+        assert n_authorships.scalar() == df.authors.str.len().sum()
+        n_authors = conn.exec_driver_sql('SELECT COUNT(*) FROM authors')
+        assert n_authors.scalar() == len({
+            author['id_author'] for authors in df.authors
+            for author in authors
+        })
+
+
+def test_write_s2_data_to_db_upsert():
+    df = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    engine = create_engine('sqlite://')
+    write_s2_data_to_db(df, engine)
+    df['title'] = 'New title'
+    write_s2_data_to_db(df, engine, upsert=True)
+    with engine.connect() as conn:
+        titles = conn.exec_driver_sql('SELECT DISTINCT title FROM papers')
+        assert titles.fetchall() == [('New title',)]
+        n_citations = conn.exec_driver_sql('SELECT COUNT(*) FROM citations')
+        assert n_citations.scalar() == df.inCitations.str.len().sum()
+
+
+def test_write_s2_data_to_db_bulk_load_profile():
+    df = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    engine = create_engine('sqlite://')
+    db = PaperDatabase(profile='bulk_load')
+    db.create_tables(engine)
+    assert not inspect(engine).get_indexes('citations')
+    write_s2_data_to_db(df, engine, db=db)
+    db.finalize(engine)
+    index_names = {
+        index['name'] for index in inspect(engine).get_indexes('citations')
+    }
+    assert index_names == {'ix_citations_id_citer'}
+
+
+def test_iter_s2_gzip_to_sqlite():
+    engine = create_engine('sqlite://')
+    dfs = list(_iter_s2_gzip(['tests/_resources/s2-corpus-sample.gz'], 4))
+    assert [len(df) for df in dfs] == [4, 4, 2]
+    for df in dfs:
+        write_s2_data_to_db(df, engine)
+    df = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    with engine.connect() as conn:
+        n_pdf_urls = conn.exec_driver_sql('SELECT COUNT(*) FROM pdf_urls')
+        assert n_pdf_urls.scalar() == df.pdfUrls.str.len().sum() > 0
+        volumes = conn.exec_driver_sql(
+            'SELECT journal_volume FROM papers WHERE journal_volume IS NULL'
+        )
+        assert not volumes.fetchall()
+
+
+def test_write_s2_data_to_db_long_pdf_urls():
+    df = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    # URLs only differing after their first 255 characters
+    prefix = 'https://example.org/' + 'a' * 255
+    df['pdfUrls'] = [[prefix + '1.pdf', prefix + '2.pdf']] * len(df)
+    engine = create_engine('sqlite://')
+    write_s2_data_to_db(df, engine)
+    write_s2_data_to_db(df, engine, upsert=True)
+    with engine.connect() as conn:
+        n_pdf_urls = conn.exec_driver_sql('SELECT COUNT(*) FROM pdf_urls')
+        assert n_pdf_urls.scalar() == 2 * len(df)
+
+
+def test_write_data_to_db_sqlite_backend(tmp_path):
+    path_db = tmp_path / 'papers.db'
+    write_data_to_db(
+        'tests/_resources/s2-corpus-sample.gz', backend='sqlite',
+        path_db=str(path_db), profile='bulk_load', batch_size=4
+    )
+    engine = create_engine(f'sqlite:///{path_db}')
+    with engine.connect() as conn:
+        journal_mode = conn.exec_driver_sql('PRAGMA journal_mode')
+        assert journal_mode.scalar() == 'wal'
+        n_papers = conn.exec_driver_sql('SELECT COUNT(*) FROM papers')
+        assert n_papers.scalar() == 10
+        index_names = {
+            index['name'] for index in inspect(conn).get_indexes('citations')
+        }
+        assert 'ix_citations_id_citer' in index_names
+
+
+def test_write_data_to_db_mixed_files(tmp_path):
+    shutil.copy('tests/_resources/s2-corpus-sample.gz', tmp_path)
+    generate_parquet_files(str(tmp_path / '*.gz'))
+    path_db = tmp_path / 'papers.db'
+    # The same papers are read from the gzip and the parquet file
+    write_data_to_db(
+        str(tmp_path / 's2-corpus-sample.*'), backend='sqlite',
+        path_db=str(path_db), upsert=True
+    )
+    engine = create_engine(f'sqlite:///{path_db}')
+    with engine.connect() as conn:
+        n_papers = conn.exec_driver_sql('SELECT COUNT(*) FROM papers')
+        assert n_papers.scalar() == 10
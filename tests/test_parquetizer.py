@@ -1,6 +1,98 @@
-from smartbib.parquetizer import read_json_gzip
+import json
+import os
+import shutil
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+import smartbib.parquetizer
+from smartbib.parquetizer import (
+    _read_json_gzip, _run_jobs, _iter_json_gzip, _iter_json_gzip_arrow,
+    store_parquet_batches, generate_parquet_files, PARQUET_SCHEMA
+)
 
 
 def test_read_json_gzip():
-    df_data = read_json_gzip('tests/_resources/s2-corpus-sample.gz')
-    assert df_data.shape == (10, 8)
+    df_data = _read_json_gzip('tests/_resources/s2-corpus-sample.gz')
+    assert df_data.shape == (10, 11)
+
+
+def test_store_parquet_batches(tmp_path):
+    path_file = 'tests/_resources/s2-corpus-sample.gz'
+    store_parquet_batches(
+        _iter_json_gzip(path_file, batch_size=4), path_file, str(tmp_path)
+    )
+    parquet_file = pq.ParquetFile(tmp_path / 's2-corpus-sample.parquet')
+    assert parquet_file.metadata.num_row_groups == 3
+    assert parquet_file.schema_arrow.equals(PARQUET_SCHEMA)
+    df_data = parquet_file.read().to_pandas()
+    assert df_data.shape == (10, 11)
+
+
+def test_arrow_engine_matches_pandas():
+    path_file = 'tests/_resources/s2-corpus-sample.gz'
+    table_pandas = pa.Table.from_pandas(
+        _read_json_gzip(path_file), schema=PARQUET_SCHEMA
+    )
+    table_arrow = pa.concat_tables(_iter_json_gzip_arrow(path_file, 4))
+    assert table_arrow.equals(table_pandas)
+
+
+def test_generate_parquet_files_parallel(tmp_path):
+    shutil.copy('tests/_resources/s2-corpus-sample.gz', tmp_path)
+    (tmp_path / 's2-corpus-broken.gz').write_bytes(b'not a gzip file')
+    failures = generate_parquet_files(
+        str(tmp_path / 's2-corpus-*.gz'), n_jobs=2, max_memory=1
+    )
+    assert list(failures) == [str(tmp_path / 's2-corpus-broken.gz')]
+    assert (tmp_path / 's2-corpus-sample.parquet').exists()
+
+
+def test_generate_parquet_files_manifest(tmp_path):
+    path_file = shutil.copy('tests/_resources/s2-corpus-sample.gz', tmp_path)
+    generate_parquet_files(str(tmp_path / '*.gz'))
+    manifest = json.loads((tmp_path / '_manifest.json').read_text())
+    assert manifest[os.path.abspath(path_file)]['num_rows'] == 10
+    path_parquet = tmp_path / 's2-corpus-sample.parquet'
+    mtime_parquet = path_parquet.stat().st_mtime_ns
+    # Touching the input does not change its content, so it is skipped
+    os.utime(path_file, (0, 0))
+    generate_parquet_files(str(tmp_path / '*.gz'))
+    assert path_parquet.stat().st_mtime_ns == mtime_parquet
+
+
+def test_generate_parquet_files_wildcard_folders(tmp_path):
+    for folder in ('a', 'b'):
+        (tmp_path / folder).mkdir()
+        shutil.copy('tests/_resources/s2-corpus-sample.gz', tmp_path / folder)
+    generate_parquet_files(str(tmp_path / '*' / 's2-corpus-*.gz'))
+    for folder in ('a', 'b'):
+        path_parquet = tmp_path / folder / 's2-corpus-sample.parquet'
+        assert path_parquet.exists()
+        manifest = json.loads(
+            (tmp_path / folder / '_manifest.json').read_text()
+        )
+        entry, = manifest.values()
+        assert entry['output'] == str(path_parquet)
+
+
+def _process_or_die(path, **kwargs):
+    if 'broken' in path:
+        # Kill the worker, as the OOM killer would
+        os._exit(1)
+    time.sleep(0.2)
+    return {}
+
+
+def test_run_jobs_isolates_dead_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(smartbib.parquetizer, '_process_file', _process_or_die)
+    file_list = []
+    for name in ('good-1', 'good-2', 'good-3', 'broken'):
+        (tmp_path / name).write_bytes(b'')
+        file_list.append(str(tmp_path / name))
+    succeeded = []
+    failures = _run_jobs(
+        file_list, {}, n_jobs=4, max_retries=1,
+        on_success=lambda path, result: succeeded.append(path)
+    )
+    assert list(failures) == [str(tmp_path / 'broken')]
+    assert sorted(succeeded) == file_list[:3]
@@ -0,0 +1,35 @@
+import numpy as np
+import pyarrow.parquet as pq
+from smartbib.graph import CitationGraph
+from smartbib.parquetizer import generate_parquet_files
+from smartbib.ranking import citation_score, compute_scores, pagerank
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_pagerank(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    graph = CitationGraph.from_parquet(str(tmp_path / '*.parquet'))
+    # Dense power iteration, where column j holds the transitions from j
+    n_nodes, damping = graph.n_nodes, 0.85
+    transitions = np.full((n_nodes, n_nodes), 1. / n_nodes)
+    for citer in range(n_nodes):
+        references = graph.references(citer)
+        if len(references):
+            transitions[:, citer] = np.bincount(
+                references, minlength=n_nodes
+            ) / len(references)
+    expected = np.full(n_nodes, 1. / n_nodes)
+    for _ in range(200):
+        expected = damping * transitions @ expected + (1 - damping) / n_nodes
+    ranks = pagerank(graph, damping, tol=1e-12, max_iter=200, n_threads=2)
+    assert np.allclose(ranks, expected)
+    assert np.isclose(ranks.sum(), 1.)
+
+    years = np.full(n_nodes, -1)
+    assert np.array_equal(citation_score(graph, years), graph.in_degree())
+
+    compute_scores(str(tmp_path / '*.parquet'), str(tmp_path / 'scores.pq'))
+    scores = pq.read_table(tmp_path / 'scores.pq')
+    assert scores.column_names == ['id_', 'pagerank', 'citation_score']
+    assert scores.num_rows == n_nodes
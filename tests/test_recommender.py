@@ -0,0 +1,22 @@
+import numpy as np
+from smartbib.graph import CitationGraph, _build_csr
+from smartbib.recommender import Recommender
+
+
+def test_recommender():
+    # Edges as (cited, citer): paper 3 cites 0 and 1, paper 4 cites 0 and 2
+    edges = np.array([[0, 3], [1, 3], [0, 4], [2, 4]], dtype=np.int32)
+    ids = np.array([bytes([i + 1]) * 20 for i in range(5)], dtype='S20')
+    graph = CitationGraph(
+        ids, *_build_csr([edges], 5, 0, 1), *_build_csr([edges], 5, 1, 0)
+    )
+    recommender = Recommender(graph)
+    # Co-citation: 1 and 2 are cited together with 0
+    recommendations = recommender.recommend([ids[0]], k=5)
+    assert [paper_id for paper_id, _ in recommendations] == [ids[1], ids[2]]
+    # Bibliographic coupling: 4 shares the reference 0 with 3
+    (paper_id, score), = recommender.recommend([ids[3]], k=5)
+    assert paper_id == ids[4] and np.isclose(score, 1 / np.log(4))
+    # Batches of seed sets, including empty ones
+    batch = recommender.recommend_batch([[ids[0]], [], [ids[3]]], k=1)
+    assert [len(recommendations) for recommendations in batch] == [1, 0, 1]
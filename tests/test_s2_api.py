@@ -0,0 +1,68 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import pandas as pd
+from smartbib.s2_api import _retry_after, ingest_papers
+from smartbib.s2_stub import StubServer, fixtures_from_corpus
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_ingest_papers(tmp_path):
+    path_fixtures = str(tmp_path / 'fixtures.json')
+    fixtures_from_corpus(PATH_SAMPLE, path_fixtures)
+    with gzip.open(PATH_SAMPLE, 'rt') as file:
+        records = [json.loads(line) for line in file]
+    paper_ids = [record['id'] for record in records] + ['0' * 40]
+    path_output = str(tmp_path / 'papers.parquet')
+    n_requests = []
+    for error_every in (0, 7):
+        with StubServer(path_fixtures, error_every=error_every) as server:
+            n_papers = ingest_papers(
+                paper_ids, path_output, base_url=server.url, rate=1_000,
+                burst=100, n_workers=4, batch_size=4, page_size=3
+            )
+            n_requests.append(server.n_requests)
+    assert n_papers == len(records)
+    df = pd.read_parquet(path_output)
+    assert len(df) == len(records)
+    assert sorted(df.title) == sorted(record['title'] for record in records)
+    assert df.inCitations.map(len).sum() == sum(
+        len(record['inCitations']) for record in records
+    )
+    # Every 7th request was rate limited and retried
+    assert n_requests[1] >= n_requests[0] + n_requests[0] // 7 > n_requests[0]
+
+
+def test_retry_after():
+    assert _retry_after('2', 5.) == 2.
+    assert _retry_after('soon', 5.) == 5.
+    # HTTP dates, in the past or in the future
+    now = datetime.now(timezone.utc)
+    assert _retry_after(format_datetime(now, usegmt=True), 5.) == 0.
+    date = format_datetime(now + timedelta(seconds=60), usegmt=True)
+    assert 50. < _retry_after(date, 5.) <= 60.
+
+
+def test_ingest_papers_redirect_close_delimited(tmp_path):
+    path_fixtures = str(tmp_path / 'fixtures.json')
+    fixtures_from_corpus(PATH_SAMPLE, path_fixtures)
+    with gzip.open(PATH_SAMPLE, 'rt') as file:
+        records = [json.loads(line) for line in file]
+    path_output = str(tmp_path / 'papers.parquet')
+    with StubServer(path_fixtures, close_delimited=True) as server:
+        # Every request is redirected, and every response ends by closing
+        # the connection
+        n_papers = ingest_papers(
+            [record['id'] for record in records], path_output,
+            base_url=f'{server.url}/redirect', rate=1_000, burst=100,
+            n_workers=4, page_size=3
+        )
+        n_requests = server.n_requests
+    assert n_papers == len(records)
+    df = pd.read_parquet(path_output)
+    assert df.inCitations.map(len).sum() == sum(
+        len(record['inCitations']) for record in records
+    )
+    assert n_requests % 2 == 0
@@ -0,0 +1,47 @@
+import hashlib
+import pyarrow.parquet as pq
+from smartbib.parquetizer import generate_parquet_files
+from smartbib.text_index import TextIndex, build_text_index
+
+PATH_SAMPLE = 'tests/_resources/s2-corpus-sample.gz'
+
+
+def test_text_index(tmp_path):
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    path_index = str(tmp_path / 'text_index')
+    build_text_index(str(tmp_path / '*.parquet'), path_index, n_features=64)
+    # Running again keeps the shards up to date
+    build_text_index(str(tmp_path / '*.parquet'), path_index, n_features=64)
+    index = TextIndex.load(path_index)
+    assert len(index) == 10
+
+    paper_ids = [hashlib.sha1(str(i).encode()).digest() for i in range(10)]
+    results = index.search_batch(['Title 3', 'learning', 'unknown'], k=3)
+    assert results[0][0][0] == paper_ids[3]
+    assert len(results[1]) == 3 and results[2] == []
+
+    # Blend in a prior favouring paper 5
+    index.set_prior([paper_ids[5]], [1.], weight=10.)
+    assert index.search('learning', k=1)[0][0] == paper_ids[5]
+    # An empty prior resets the scores
+    index.set_prior([], [])
+    assert all(not shard.prior.any() for shard in index.shards)
+
+
+def test_text_index_same_file_names(tmp_path):
+    # Partitions of a dataset share their file names
+    generate_parquet_files(PATH_SAMPLE, str(tmp_path))
+    table = pq.read_table(str(tmp_path / 's2-corpus-sample.parquet'))
+    for i, folder in enumerate(('a', 'b')):
+        (tmp_path / folder).mkdir()
+        path_part = str(tmp_path / folder / 'part-00000.parquet')
+        pq.write_table(table.slice(5 * i, 5), path_part)
+    path_index = str(tmp_path / 'text_index')
+    build_text_index(
+        str(tmp_path / '*' / 'part-00000.parquet'), path_index, n_features=64
+    )
+    index = TextIndex.load(path_index)
+    assert len(index) == 10
+    assert len({
+        id_ for shard in index.shards for id_ in shard.ids.tolist()
+    }) == 10
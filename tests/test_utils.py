@@ -1,5 +1,47 @@
-from smartbib.utils import id_bytes_to_str, id_str_to_bytes
+import threading
+import pytest
+from smartbib.utils import (
+    id_bytes_to_str, id_str_to_bytes, ids_bytes_to_str_array,
+    ids_str_to_bytes_array, prefetch
+)
 
 def test_id_conversion():
     hash_str = '33b237709dbd53953a750355115b57ccb6690da1'
     assert id_bytes_to_str(id_str_to_bytes(hash_str)) == hash_str
+
+
+def test_ids_array_conversion():
+    hash_list = [
+        '33b237709dbd53953a750355115b57ccb6690da1',
+        '00b237709dbd53953a750355115b57ccb6690d00',
+    ]
+    ids_bytes = ids_str_to_bytes_array(hash_list)
+    assert ids_bytes.to_pylist() == [id_str_to_bytes(h) for h in hash_list]
+    assert ids_bytes_to_str_array(ids_bytes).to_pylist() == hash_list
+
+
+def test_prefetch():
+    assert list(prefetch(range(10), size=2)) == list(range(10))
+
+
+def test_prefetch_closed_early():
+    closed = threading.Event()
+
+    def produce():
+        try:
+            yield from range(100)
+        finally:
+            closed.set()
+
+    items = prefetch(produce(), size=1)
+    assert next(items) == 0
+    items.close()
+    # The producer stops and releases the iterable
+    assert closed.wait(timeout=5)
+
+
+def test_ids_array_conversion_invalid():
+    valid = '33b237709dbd53953a750355115b57ccb6690da1'
+    for invalid in ('', 'not an id', 'é' * 20, valid + '0'):
+        with pytest.raises(ValueError):
+            ids_str_to_bytes_array([valid, invalid])